@@ -0,0 +1,66 @@
+"""
+Runs blocking database access and CPU-bound checks off the event loop, for the async endpoints.
+
+sqlite3 calls block the calling thread, and the appointment checks spend most of
+their time in pure-Python difflib comparisons. Awaiting run() hands such work to a
+dedicated thread pool with one worker per pooled reader connection, so at most
+DB_WORKERS of them run at once and further requests wait for a free worker. The
+event loop keeps serving other requests meanwhile, and FastAPI's default
+threadpool, which runs the sync endpoints, is not taken over by long audits.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+import database
+import profiler
+
+DB_WORKERS = database.READER_POOL_SIZE
+
+T = TypeVar("T")
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool that runs blocking database work, starting it on first use.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+        return _executor
+
+
+def shutdown_executor():
+    """
+    Waits for running work to finish and stops the worker threads.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+async def run(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs a blocking function on the database executor and waits for it without blocking the loop.
+
+    The caller's context variables, e.g. the request's database timer from
+    queries.track_db_time(), are visible to the function, and a profiled request
+    samples the worker while it runs the function.
+
+    :param func: The function to run, e.g. perform_appointment_checks.
+    :return: What the function returns; its exceptions are raised here.
+    """
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, profiler.followed(func), *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), call)
@@ -0,0 +1,131 @@
+"""
+Measures how long it takes to import the application modules in a fresh interpreter.
+
+Each module is imported in a new subprocess so nothing is cached between runs.
+With --baseline, the same modules are also imported from a checkout of an older
+revision, e.g. the commit before the heavy dependencies were loaded lazily, in a
+temporary git worktree. The difference between the two columns is the startup gain.
+
+Usage:
+    python benchmark_imports.py [--runs 5] [--baseline <git revision>] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MODULES = [
+    "config",
+    "database",
+    "database_utils",
+    "gdrive",
+    "commissions3",
+    "calculate_commissions",
+    "daily_checks",
+    "appointment_reminders",
+    "main",
+]
+
+HEAVY_DEPENDENCIES = ["pandas", "numpy", "lxml", "googleapiclient", "sqlalchemy", "dotenv"]
+
+_PROBE = """
+import importlib, json, sys, time
+heavy = {heavy!r}
+start = time.perf_counter()
+importlib.import_module({module!r})
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in heavy if m in sys.modules]}}))
+"""
+
+
+def time_import(module: str, tree: str = REPO_DIR) -> dict | None:
+    """
+    Imports a module in a fresh interpreter and returns the elapsed time.
+
+    :param module: The module to import.
+    :param tree: The directory holding the modules, e.g. a worktree of an older revision.
+    :return: A dictionary with 'seconds' and the heavy modules that ended up 'loaded',
+        or None if the module could not be imported there.
+    """
+    probe = _PROBE.format(heavy=HEAVY_DEPENDENCIES, module=module)
+    completed = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, cwd=tree)
+    if completed.returncode != 0:
+        return None
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _median_ms(samples: list[dict | None]) -> float | None:
+    if any(sample is None for sample in samples):
+        return None
+    return round(statistics.median(sample["seconds"] for sample in samples) * 1000, 1)
+
+
+def run_benchmark(runs: int = 5, baseline_tree: str | None = None) -> list[dict]:
+    """
+    Times every application module, and in the baseline tree if given, and returns one row per module.
+
+    :param runs: How many fresh interpreters to start per module and tree.
+    :param baseline_tree: A checkout of the revision to compare with, or None.
+    :return: A list of dictionaries with the median timings in milliseconds; None where
+        a module could not be imported.
+    """
+    results = []
+    for module in MODULES:
+        current = [time_import(module) for _ in range(runs)]
+        row = {"module": module, "current_ms": _median_ms(current),
+               "heavy_loaded": current[-1]["loaded"] if current[-1] else []}
+        if baseline_tree is not None:
+            baseline_ms = _median_ms([time_import(module, baseline_tree) for _ in range(runs)])
+            row["baseline_ms"] = baseline_ms
+            row["saved_ms"] = (round(baseline_ms - row["current_ms"], 1)
+                               if baseline_ms is not None and row["current_ms"] is not None else None)
+        results.append(row)
+    return results
+
+
+def run_against(revision: str, runs: int = 5) -> list[dict]:
+    """
+    Runs the benchmark with a temporary git worktree of an older revision as the baseline.
+
+    :param revision: Any git revision, e.g. 'HEAD~10' or a commit hash.
+    :param runs: How many fresh interpreters to start per module and tree.
+    :return: The rows of run_benchmark.
+    """
+    with tempfile.TemporaryDirectory() as parent:
+        tree = os.path.join(parent, "baseline")
+        subprocess.run(["git", "worktree", "add", "--detach", tree, revision],
+                       cwd=REPO_DIR, check=True, capture_output=True)
+        try:
+            return run_benchmark(runs, tree)
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", tree], cwd=REPO_DIR, capture_output=True)
+
+
+def _format_ms(value: float | None) -> str:
+    return "failed" if value is None else str(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--baseline", help="git revision to compare with, e.g. the commit before a change")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    rows = run_against(args.baseline, args.runs) if args.baseline else run_benchmark(args.runs)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    elif args.baseline:
+        print(f"{'module':<24}{'current ms':>12}{'baseline ms':>13}{'saved ms':>10}  heavy modules loaded")
+        for row in rows:
+            print(f"{row['module']:<24}{_format_ms(row['current_ms']):>12}{_format_ms(row['baseline_ms']):>13}"
+                  f"{_format_ms(row['saved_ms']):>10}  {', '.join(row['heavy_loaded']) or '-'}")
+    else:
+        print(f"{'module':<24}{'current ms':>12}  heavy modules loaded")
+        for row in rows:
+            print(f"{row['module']:<24}{_format_ms(row['current_ms']):>12}  {', '.join(row['heavy_loaded']) or '-'}")
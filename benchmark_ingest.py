@@ -0,0 +1,190 @@
+"""
+Measures how fast the loaders ingest the example exports, at 1x, 10x and 100x their size.
+
+Every file in examples/ is scaled by repeating its data rows, then loaded into a
+fresh database by each engine in a new subprocess, so peak RSS is measured per run.
+For each run it reports rows/s, peak RSS and the time spent in each stage:
+'read' (HTML/Excel parsing), 'infer' (type inference), 'convert' (value coercion),
+'insert' and 'commit'.
+
+Usage:
+    python benchmark_ingest.py [--scales 1 10 100] [--engines loader] [--json] [--output results.json]
+"""
+import argparse
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import blob_cache
+
+EXAMPLES_DIR = blob_cache.EXAMPLES_DIR
+DEFAULT_SCALES = [1, 10, 100]
+STAGES = ["read", "infer", "convert", "insert", "commit"]
+
+
+def replicate_html(data: bytes, factor: int) -> bytes:
+    """
+    Repeats the data rows of the first table of an HTML export `factor` times.
+
+    The first two rows (column names and the row the loader skips) are kept once.
+    """
+    text = data.decode("utf-8")
+    table_start = text.index("<table")
+    table_end = text.index("</table>", table_start)
+    row_starts = [m.start() for m in re.finditer(r"<tr\b", text[table_start:table_end])]
+    if len(row_starts) <= 2:
+        return data
+    body_start = table_start + row_starts[2]
+    body = text[body_start:table_end]
+    return (text[:body_start] + body * factor + text[table_end:]).encode("utf-8")
+
+
+def replicate_xlsx(data: bytes, factor: int) -> bytes:
+    """
+    Repeats the data rows of the active sheet of an XLSX file `factor` times.
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(io.BytesIO(data))
+    sheet = workbook.active
+    rows = list(sheet.iter_rows(min_row=2, values_only=True))
+    for _ in range(factor - 1):
+        for row in rows:
+            sheet.append(row)
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def replicate(path: str, factor: int) -> bytes:
+    """
+    Returns the content of an example file with its rows repeated `factor` times.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if factor == 1:
+        return data
+    if data.lstrip()[:1] == b"<":
+        return replicate_html(data, factor)
+    return replicate_xlsx(data, factor)
+
+
+def _run_loader(path: str, source_name: str, db_path: str) -> dict:
+    # The same stages parse_html_to_db / parse_xlsx_to_db run, timed one by one
+    import database_utils
+
+    parse_func = database_utils.parser_for(source_name)
+    with open(path, "rb") as f:
+        parsed = parse_func(f, source_name, os.path.basename(path))
+    database_utils.write_parsed(parsed, db_path)
+    return {"rows": len(parsed.rows), "stages": parsed.timings}
+
+
+# Ingest pipelines to compare. Each takes (file path, source name, database path)
+# and returns the number of rows parsed and the seconds per stage.
+ENGINES = {
+    "loader": _run_loader,
+}
+
+
+def run_case(path: str, source_name: str, engine: str) -> dict:
+    """
+    Loads one file with one engine into a new database, in this process.
+
+    :return: A dictionary with rows, total seconds, peak RSS and per-stage seconds.
+    """
+    import resource
+
+    # Imported up front so the timings measure ingest, not interpreter warm-up
+    import database_utils
+    import lxml.html
+    import openpyxl
+    import pandas
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "data.db")
+        start = time.perf_counter()
+        result = ENGINES[engine](path, source_name, db_path)
+        seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        "rows": result["rows"],
+        "seconds": round(seconds, 4),
+        "rows_per_second": round(result["rows"] / seconds, 1) if seconds else None,
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "stages": {stage: round(result["stages"].get(stage, 0.0), 4) for stage in STAGES},
+    }
+
+
+def run_benchmark(scales: list[int], engines: list[str], examples_dir: str = EXAMPLES_DIR) -> list[dict]:
+    """
+    Runs every engine over every example file at every scale, each in a fresh subprocess.
+
+    :param scales: The row replication factors.
+    :param engines: Names from ENGINES.
+    :param examples_dir: The directory holding the example exports.
+    :return: One dictionary per file, scale and engine.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in sorted(os.listdir(examples_dir)):
+            source_name = next((s for prefix, s in blob_cache.EXAMPLE_SOURCES.items() if name.startswith(prefix)), None)
+            if source_name is None:
+                print(f"Skipping example '{name}': no source matches its name.", file=sys.stderr)
+                continue
+            for scale in scales:
+                scaled_path = os.path.join(directory, f"{scale}x-{name}")
+                with open(scaled_path, "wb") as f:
+                    f.write(replicate(os.path.join(examples_dir, name), scale))
+                for engine in engines:
+                    completed = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--case", scaled_path, source_name, engine],
+                        capture_output=True, text=True, check=True,
+                    )
+                    row = json.loads(completed.stdout.strip().splitlines()[-1])
+                    results.append({
+                        "file": name,
+                        "source": source_name,
+                        "scale": scale,
+                        "engine": engine,
+                        "bytes": os.path.getsize(scaled_path),
+                        **row,
+                    })
+                    print(f"{name} x{scale} [{engine}]: {row['rows']} rows in {row['seconds']}s", file=sys.stderr)
+                os.remove(scaled_path)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES)
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    parser.add_argument("--output", help="Also write the JSON results to this file.")
+    parser.add_argument("--case", nargs=3, metavar=("PATH", "SOURCE", "ENGINE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        # Child process: run one case and report it on the last line of stdout
+        case = run_case(*args.case)
+        print(json.dumps(case))
+        sys.exit(0)
+
+    rows = run_benchmark(args.scales, args.engines)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"{'file':<48}{'scale':>6}{'rows':>9}{'rows/s':>10}{'RSS MB':>9}"
+              + "".join(f"{stage + ' s':>10}" for stage in STAGES))
+        for row in rows:
+            print(f"{row['file'][:47]:<48}{row['scale']:>6}{row['rows']:>9}{row['rows_per_second']:>10}"
+                  f"{row['peak_rss_mb']:>9}" + "".join(f"{row['stages'][stage]:>10}" for stage in STAGES))
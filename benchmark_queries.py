@@ -0,0 +1,238 @@
+"""
+Measures how the dashboard, the daily checks and the commission calculation scale
+with the amount of data in the database.
+
+For each scale (clinics x years) a database is generated with synthetic_data, then
+timed in fresh subprocesses run from its directory, since the checks and the
+commission calculation read output/data.db relative to the working directory:
+
+- every clinic_dashboard query function, over the last day, the last month, the
+  last year and the whole history, with the granularity the dashboard would pick;
+- perform_appointment_checks over the last day, month and year;
+- perform_commission_calculation for every doctor, for last month.
+
+Each case reports the median of --repeat runs and the number of rows or alerts it
+returned. A case still running after --timeout seconds is reported as a timeout.
+
+Usage:
+    python benchmark_queries.py [--scales 1x1 1x10 10x10] [--repeat 3] [--timeout 600] [--json] [--output results.json]
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import columnar
+import database
+import synthetic_data
+
+DEFAULT_SCALES = ["1x1", "1x10", "10x10"]
+CHECK_RANGES = ["day", "month", "year"]
+
+# clinic_dashboard functions taking (start_date, end_date)
+DASHBOARD_FUNCTIONS = [
+    "get_revenue",
+    "get_new_patients",
+    "get_new_appointments",
+    "get_treatment_distribution",
+    "get_total_unique_patients",
+    "get_aesthetic_total_spending",
+    "get_unique_aesthetic_patients",
+    "get_average_spending_per_patient",
+    "get_average_spending_per_aesthetic_patient",
+]
+# clinic_dashboard functions taking (start_date, end_date, granularity)
+PERIOD_FUNCTIONS = [
+    "get_revenue_by_period",
+    "get_new_patients_by_period",
+    "get_new_appointments_by_period",
+    "get_total_patients_by_period",
+    "get_average_spending_per_patient_by_period",
+]
+
+SPANISH_MONTHS = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto",
+                  "Septiembre", "Octubre", "Noviembre", "Diciembre"]
+
+
+def parse_scale(scale: str) -> tuple[int, int]:
+    """
+    Parses a scale written as CLINICSxYEARS, e.g. '10x10'.
+    """
+    clinics, years = scale.lower().split("x")
+    return int(clinics), int(years)
+
+
+def date_ranges(years: int, today: date | None = None) -> dict[str, tuple[date, date]]:
+    """
+    Returns the ranges every case is timed over, ending before today like the generated data.
+
+    'day' is the last weekday, 'month' the last calendar month, 'year' the last 365
+    days and 'all' the whole generated history.
+    """
+    today = today or date.today()
+    yesterday = today - timedelta(days=1)
+    day = yesterday
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    month_end = today.replace(day=1) - timedelta(days=1)
+    return {
+        "day": (day, day),
+        "month": (month_end.replace(day=1), month_end),
+        "year": (today - timedelta(days=365), yesterday),
+        "all": (today - timedelta(days=365 * years), yesterday),
+    }
+
+
+def _time(func, repeat: int) -> tuple[float, object]:
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return round(statistics.median(timings), 4), result
+
+
+def _size(result) -> int | None:
+    # Rows of a DataFrame or list result; None for scalar metrics
+    return len(result) if hasattr(result, "__len__") else None
+
+
+def _run_dashboard(years: int, repeat: int) -> list[dict]:
+    import clinic_dashboard
+
+    results = []
+    for range_name, (start, end) in date_ranges(years).items():
+        granularity = clinic_dashboard.get_granularity(start, end)
+        for name in DASHBOARD_FUNCTIONS + PERIOD_FUNCTIONS:
+            func = getattr(clinic_dashboard, name)
+            args = (start, end, granularity) if name in PERIOD_FUNCTIONS else (start, end)
+            seconds, result = _time(lambda: func(*args), repeat)
+            results.append({"case": name, "range": range_name, "seconds": seconds, "rows": _size(result)})
+    return results
+
+
+def _run_checks(range_name: str, years: int, repeat: int) -> list[dict]:
+    from datetime import datetime, time as day_time
+
+    from daily_checks import perform_appointment_checks
+
+    start, end = date_ranges(years)[range_name]
+    from_date, to_date = datetime.combine(start, day_time.min), datetime.combine(end, day_time.max)
+    seconds, alerts = _time(lambda: perform_appointment_checks(from_date, to_date), repeat)
+    return [{"case": "perform_appointment_checks", "range": range_name, "seconds": seconds, "rows": len(alerts)}]
+
+
+def _run_commissions(years: int, repeat: int) -> list[dict]:
+    from calculate_commissions import doctors_commissions, perform_commission_calculation
+
+    # perform_commission_calculation reads the named month of the current year
+    start, _ = date_ranges(years)["month"]
+    month_name = SPANISH_MONTHS[start.month - 1]
+    results = []
+    for doctor_id in dict.fromkeys(c["id"] for c in doctors_commissions):
+        # It prints every payment it reads; keep that out of the report
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            seconds, commissions = _time(
+                lambda: perform_commission_calculation(doctors_commissions, doctor_id, month_name), repeat)
+        results.append({"case": f"perform_commission_calculation:{doctor_id}", "range": "month",
+                        "seconds": seconds, "rows": len(commissions)})
+    return results
+
+
+def run_case(kind: str, years: int, repeat: int) -> list[dict]:
+    """
+    Runs one group of cases against output/data.db in the working directory, in this process.
+
+    :param kind: 'dashboard', 'commissions' or 'checks:<range>'.
+    :param years: The years of history in the database.
+    :param repeat: How many times each case is run.
+    :return: One dictionary per case, with its median seconds and result size.
+    """
+    if kind == "dashboard":
+        return _run_dashboard(years, repeat)
+    if kind == "commissions":
+        return _run_commissions(years, repeat)
+    return _run_checks(kind.split(":", 1)[1], years, repeat)
+
+
+def run_benchmark(scales: list[str], repeat: int, timeout: float, seed: int = 0) -> list[dict]:
+    """
+    Generates a database for every scale and times every case against it.
+
+    :param scales: Scales written as CLINICSxYEARS.
+    :param repeat: How many times each case is run.
+    :param timeout: Seconds after which a group of cases is abandoned.
+    :param seed: The random seed passed to synthetic_data.
+    :return: One dictionary per scale and case.
+    """
+    results = []
+    kinds = ["dashboard"] + [f"checks:{r}" for r in CHECK_RANGES] + ["commissions"]
+    for scale in scales:
+        clinics, years = parse_scale(scale)
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            # The generator reports its progress on stdout, which is kept for the results
+            with contextlib.redirect_stdout(sys.stderr):
+                counts = synthetic_data.generate_database(
+                    os.path.join(directory, database.DB_PATH), clinics, years, seed,
+                    parquet_dir=os.path.join(directory, columnar.PARQUET_DIR))
+            print(f"{scale}: generated {sum(counts.values())} rows in {time.perf_counter() - start:.1f}s",
+                  file=sys.stderr)
+            scale_info = {"scale": scale, "clinics": clinics, "years": years, "table_rows": counts}
+
+            for kind in kinds:
+                try:
+                    completed = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--case", kind, str(years), str(repeat)],
+                        cwd=directory, capture_output=True, text=True, check=True, timeout=timeout,
+                    )
+                    cases = json.loads(completed.stdout.strip().splitlines()[-1])
+                except subprocess.TimeoutExpired:
+                    cases = [{"case": kind, "range": None, "seconds": None, "rows": None,
+                              "error": f"timed out after {timeout}s"}]
+                except subprocess.CalledProcessError as e:
+                    cases = [{"case": kind, "range": None, "seconds": None, "rows": None,
+                              "error": e.stderr.strip().splitlines()[-1] if e.stderr.strip() else str(e)}]
+                for case in cases:
+                    results.append({**scale_info, **case})
+                print(f"{scale} [{kind}]: {sum(c['seconds'] or 0 for c in cases):.2f}s", file=sys.stderr)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", nargs="+", default=DEFAULT_SCALES, help="CLINICSxYEARS, e.g. 1x1 10x10")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the median is reported")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before a group of cases is abandoned")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the generated data")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    parser.add_argument("--output", help="Also write the JSON results to this file.")
+    parser.add_argument("--case", nargs=3, metavar=("KIND", "YEARS", "REPEAT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        # Child process: run one group of cases and report it on the last line of stdout
+        kind, years, repeat = args.case
+        cases = run_case(kind, int(years), int(repeat))
+        print(json.dumps(cases))
+        sys.exit(0)
+
+    rows = run_benchmark(args.scales, args.repeat, args.timeout, args.seed)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"{'scale':<8}{'case':<48}{'range':<8}{'seconds':>10}{'rows':>9}")
+        for row in rows:
+            seconds = row.get("error") or row["seconds"]
+            print(f"{row['scale']:<8}{row['case'][:47]:<48}{row['range'] or '':<8}{seconds:>10}"
+                  f"{row['rows'] if row['rows'] is not None else '':>9}")
@@ -0,0 +1,108 @@
+"""
+Measures how much memory the appointment checks hold per fetched row, with full
+dictionaries (get_data_for_date_range) and with compact records that fetch only
+the columns the checks read (get_records_for_date_range).
+
+A synthetic database with one clinic is generated, and the last year of
+tratamientos and citas is fetched both ways, with 'Fecha_normalizada' added to
+every row as perform_appointment_checks does. Memory is measured with tracemalloc:
+'retained' is what the fetched rows still hold afterwards, 'peak' the most that
+was allocated while fetching them.
+
+Usage:
+    python benchmark_records.py [--years 1] [--seed 0] [--json] [--output results.json]
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import columnar
+import database
+import synthetic_data
+
+# (table, date column, columns the checks read, or None for every column)
+CASES = [
+    ("tratamientos", "Fecharealizado", "TREATMENT_COLUMNS"),
+    ("citas", "Fecha", None),
+]
+
+
+def _measure(fetch) -> dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = fetch()
+    for row in rows:
+        row["Fecha_normalizada"] = "01-01-2025"
+    seconds = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "rows": len(rows),
+        "seconds": round(seconds, 4),
+        "retained_bytes": retained,
+        "peak_bytes": peak,
+        "bytes_per_row": round(retained / len(rows), 1) if rows else None,
+    }
+
+
+def run_benchmark(years: int = 1, seed: int = 0) -> list[dict]:
+    """
+    Generates a one-clinic database and measures both representations on its last year.
+
+    :param years: The years of history to generate.
+    :param seed: The random seed passed to synthetic_data.
+    :return: One dictionary per table and representation.
+    """
+    import daily_checks
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, database.DB_PATH)
+        # The generator reports its progress on stdout, which is kept for the results
+        with contextlib.redirect_stdout(sys.stderr):
+            synthetic_data.generate_database(db_path, 1, years, seed,
+                                             parquet_dir=os.path.join(directory, columnar.PARQUET_DIR))
+
+        end = datetime.now()
+        start = end - timedelta(days=365)
+        for table_name, date_column, columns_name in CASES:
+            columns = getattr(daily_checks, columns_name) if columns_name else None
+            fetchers = {
+                "dict": lambda: daily_checks.get_data_for_date_range(db_path, table_name, date_column, start, end),
+                "record": lambda: daily_checks.get_records_for_date_range(
+                    db_path, table_name, date_column, start, end, columns, extra=("Fecha_normalizada",)),
+            }
+            # The first fetch takes the snapshot and prepares the statements; it is not measured
+            for fetch in fetchers.values():
+                fetch()
+            for representation, fetch in fetchers.items():
+                results.append({"table": table_name, "representation": representation, **_measure(fetch)})
+        database.close_pools()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, default=1, help="years of history to generate")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the generated data")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    parser.add_argument("--output", help="Also write the JSON results to this file.")
+    args = parser.parse_args()
+
+    rows = run_benchmark(args.years, args.seed)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"{'table':<14}{'rows as':<9}{'rows':>8}{'seconds':>10}{'retained MB':>13}{'peak MB':>10}{'bytes/row':>11}")
+        for row in rows:
+            print(f"{row['table']:<14}{row['representation']:<9}{row['rows']:>8}{row['seconds']:>10}"
+                  f"{row['retained_bytes'] / 1e6:>13.2f}{row['peak_bytes'] / 1e6:>10.2f}{row['bytes_per_row']:>11}")
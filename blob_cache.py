@@ -0,0 +1,272 @@
+"""
+Content-addressed cache of the raw files every load parsed.
+
+Each downloaded export is kept once under output/blobs/<first two hex digits>/<sha256>,
+and manifest.json records which Drive file (source, name, createdTime) it came from.
+A full reload of a source forgets the files that were removed from its folder.
+The cache makes it possible to rebuild output/data.db without touching Drive, e.g.
+after a schema change, or to load the examples/ files for local benchmarking:
+
+    python blob_cache.py --examples   # cache examples/ and rebuild data.db from them
+    python blob_cache.py              # rebuild data.db from every cached blob
+
+Stop the API server and the dashboard before rebuilding: the database file is
+replaced underneath them.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timezone
+from typing import BinaryIO
+
+import columnar
+import database
+import database_utils
+import maintenance
+import patient_search
+
+BLOB_DIR = "output/blobs"
+MANIFEST_FILE = "manifest.json"
+EXAMPLES_DIR = "examples"
+COPY_CHUNK_BYTES = 1024 * 1024
+
+# Which source each examples/ file belongs to, by file name prefix
+EXAMPLE_SOURCES = {
+    "DatosPersonales": "datos_personales",
+    "FechasPacientes": "fechas_pacientes",
+    "Cobros": "cobros",
+    "exportarTrats": "tratamientos",
+    "Doctoralia-informe_de_citas": "citas",
+    "Doctores": "doctores",
+}
+
+_manifest_lock = threading.Lock()
+
+
+def blob_path(checksum: str, blob_dir: str = BLOB_DIR) -> str:
+    """
+    Returns where the blob with a given SHA-256 checksum is stored.
+    """
+    return os.path.join(blob_dir, checksum[:2], checksum)
+
+
+def load_manifest(blob_dir: str = BLOB_DIR) -> dict[str, dict]:
+    """
+    Reads the cache manifest.
+
+    :param blob_dir: The cache directory.
+    :return: A dictionary mapping file IDs to their source, name, createdTime and sha256.
+    """
+    try:
+        with open(os.path.join(blob_dir, MANIFEST_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_manifest(manifest: dict[str, dict], blob_dir: str):
+    path = os.path.join(blob_dir, MANIFEST_FILE)
+    temp_file = f"{path}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(temp_file, path)
+
+
+def store_blob(stream: BinaryIO, source_name: str, file: dict, blob_dir: str = BLOB_DIR) -> str:
+    """
+    Copies a downloaded file into the cache and records it in the manifest.
+
+    The content is hashed while it is copied, in fixed-size chunks. A blob that
+    is already cached is not written again. The stream is rewound afterwards so
+    it can still be parsed.
+
+    :param stream: A seekable binary stream with the file content.
+    :param source_name: The source the file was loaded for, e.g. 'cobros'.
+    :param file: The Drive file object, including 'id', 'name' and 'createdTime'.
+    :param blob_dir: The cache directory.
+    :return: The SHA-256 checksum of the content.
+    """
+    os.makedirs(blob_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    with tempfile.NamedTemporaryFile(dir=blob_dir, delete=False) as temp:
+        try:
+            while chunk := stream.read(COPY_CHUNK_BYTES):
+                digest.update(chunk)
+                temp.write(chunk)
+                size += len(chunk)
+        except BaseException:
+            temp.close()
+            os.remove(temp.name)
+            raise
+    stream.seek(0)
+
+    checksum = digest.hexdigest()
+    target = blob_path(checksum, blob_dir)
+    if os.path.exists(target):
+        os.remove(temp.name)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(temp.name, target)
+
+    with _manifest_lock:
+        manifest = load_manifest(blob_dir)
+        manifest[file['id']] = {
+            "source": source_name,
+            "name": file['name'],
+            "createdTime": file.get('createdTime', ''),
+            "sha256": checksum,
+            "size": size,
+        }
+        _save_manifest(manifest, blob_dir)
+    return checksum
+
+
+def prune(source_name: str, file_ids: set[str], blob_dir: str = BLOB_DIR) -> int:
+    """
+    Forgets the cached files of a source that are no longer in its Drive folder.
+
+    Their manifest entries are removed, and so are their blobs unless another
+    entry has the same content.
+
+    :param source_name: The source whose folder was listed, e.g. 'cobros'.
+    :param file_ids: The IDs of every file in the folder listing.
+    :param blob_dir: The cache directory.
+    :return: The number of manifest entries removed.
+    """
+    with _manifest_lock:
+        manifest = load_manifest(blob_dir)
+        removed = {file_id: entry for file_id, entry in manifest.items()
+                   if entry["source"] == source_name and file_id not in file_ids}
+        if not removed:
+            return 0
+        for file_id in removed:
+            del manifest[file_id]
+        _save_manifest(manifest, blob_dir)
+
+        in_use = {entry["sha256"] for entry in manifest.values()}
+        for checksum in {entry["sha256"] for entry in removed.values()} - in_use:
+            try:
+                os.remove(blob_path(checksum, blob_dir))
+            except FileNotFoundError:
+                pass
+    print(f"Removed {len(removed)} files of '{source_name}' from the cache: they are no longer in its folder.")
+    return len(removed)
+
+
+def cached_files(blob_dir: str = BLOB_DIR) -> dict[str, list[dict]]:
+    """
+    Groups the cached files by source, oldest first, the order they are loaded in.
+
+    :param blob_dir: The cache directory.
+    :return: A dictionary mapping source names to lists of manifest entries.
+    """
+    by_source = {}
+    for file_id, entry in load_manifest(blob_dir).items():
+        by_source.setdefault(entry["source"], []).append(dict(entry, id=file_id))
+    for entries in by_source.values():
+        entries.sort(key=lambda e: (e["createdTime"], e["name"]))
+    return by_source
+
+
+def seed_from_examples(examples_dir: str = EXAMPLES_DIR, blob_dir: str = BLOB_DIR) -> int:
+    """
+    Adds the example exports to the cache as if they had been downloaded from Drive.
+
+    Files are assigned to sources by EXAMPLE_SOURCES; others are skipped.
+
+    :param examples_dir: The directory holding the example exports.
+    :param blob_dir: The cache directory.
+    :return: The number of files cached.
+    """
+    count = 0
+    for name in sorted(os.listdir(examples_dir)):
+        source_name = next((s for prefix, s in EXAMPLE_SOURCES.items() if name.startswith(prefix)), None)
+        if source_name is None:
+            print(f"Skipping example '{name}': no source matches its name.")
+            continue
+        path = os.path.join(examples_dir, name)
+        created = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+        file = {"id": f"{examples_dir}/{name}", "name": name, "createdTime": created.isoformat()}
+        with open(path, 'rb') as f:
+            store_blob(f, source_name, file, blob_dir)
+        count += 1
+    return count
+
+
+def _remove_database_files(db_path: str):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+
+def rebuild_database(db_path: str = database.DB_PATH, blob_dir: str = BLOB_DIR) -> dict[str, int]:
+    """
+    Rebuilds a database from the cached blobs alone, without contacting Drive.
+
+    Every source is loaded from its cached files in createdTime order, and indexed
+    for the patient search, into a new file next to the database, which then
+    replaces it. The Parquet mirrors are
+    rewritten afterwards.
+
+    :param db_path: The database file to rebuild.
+    :param blob_dir: The cache directory.
+    :return: A dictionary mapping each source to the number of files loaded.
+    """
+    build_path = f"{db_path}.rebuild"
+    _remove_database_files(build_path)
+
+    loaded = {}
+    for source_name, entries in cached_files(blob_dir).items():
+        file_sources = []
+        for entry in entries:
+            path = blob_path(entry["sha256"], blob_dir)
+            if not os.path.exists(path):
+                print(f"Cached blob for '{entry['name']}' is missing; skipping it.")
+                continue
+            file_sources.append((path, entry["name"]))
+        loaded[source_name] = database_utils.load_files(
+            file_sources, build_path, source_name, database_utils.parser_for(source_name))
+        if loaded[source_name] and source_name in patient_search.INDEXED_TABLES:
+            patient_search.index_table(build_path, source_name)
+
+    maintenance.run_maintenance(build_path)
+
+    # Close every connection before swapping the file, so no stale WAL is replayed into it
+    database.close_pools()
+    _remove_database_files(db_path)
+    os.replace(build_path, db_path)
+    print(f"Rebuilt '{db_path}' from {sum(loaded.values())} cached files.")
+
+    for table_name in loaded:
+        if table_name in columnar.MIRRORED_TABLES:
+            try:
+                columnar.export_table(db_path, table_name)
+            except Exception as e:
+                print(f"Could not mirror table '{table_name}' to Parquet: {e}")
+    return loaded
+
+
+def clear_cache(blob_dir: str = BLOB_DIR):
+    """
+    Deletes every cached blob and the manifest.
+    """
+    shutil.rmtree(blob_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the database from the raw-file cache, offline.")
+    parser.add_argument("--examples", action="store_true",
+                        help=f"cache the files in {EXAMPLES_DIR}/ before rebuilding")
+    parser.add_argument("--db", default=database.DB_PATH, help="database file to rebuild")
+    parser.add_argument("--blob-dir", default=BLOB_DIR, help="cache directory")
+    args = parser.parse_args()
+
+    if args.examples:
+        print(f"Cached {seed_from_examples(blob_dir=args.blob_dir)} example files.")
+    print(json.dumps(rebuild_database(args.db, args.blob_dir), indent=2))
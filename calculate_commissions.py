@@ -4,6 +4,11 @@ import sqlite3
 import traceback
 from datetime import datetime
 
+import database
+import date_keys
+import queries
+import records
+
 from commissions3 import perform_calculation
 
 logging.basicConfig(
@@ -57,33 +62,16 @@ def get_payments_with_patient_info(db_path: str, start_date: datetime, end_date:
         end_date: The end date (inclusive) for filtering.
 
     Returns:
-        A list of dictionaries, where each dictionary represents a row of data.
+        A list of records.Record, one per payment, with the columns commissions3 reads.
+        They read like dictionaries and take an 'Importe bruto' field.
     """
-    conn = None
     try:
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row  # This allows accessing columns by name
-        cursor = conn.cursor()
-
-        # Convert datetime objects to ISO format strings for SQLite comparison
-        start_date_str = start_date.isoformat()
-        end_date_str = end_date.isoformat()
-        # CREATE TABLE comisiones ("Fecha" DATETIME, "Código" INTEGER PRIMARY KEY, "Paciente" TEXT, "Tratamiento" TEXT, "Diente" TEXT, "Descripción" TEXT, "Realizado" INTEGER, "Cobrado" INTEGER, "Seguro" INTEGER, "Costelab" REAL, "Costefinan" REAL, "Comisión" INTEGER, "Com" TEXT);
-        # Construct the query with a LEFT JOIN
-        query = """
-            SELECT c.*, dp.Cómonoshaconocido
-            FROM comisiones c
-            LEFT JOIN datos_personales dp ON c.Código = dp.Código
-            WHERE c.Fecha BETWEEN ? AND ?
-        """
-
-        cursor.execute(query, (start_date_str, end_date_str))
-
-        rows = cursor.fetchall()
-
-        # Convert sqlite3.Row objects to dictionaries
-        data = [dict(row) for row in rows]
-        return data
+        with database.snapshot_reader(db_path) as conn:
+            # CREATE TABLE comisiones ("Fecha" DATETIME, "Código" INTEGER PRIMARY KEY, "Paciente" TEXT, "Tratamiento" TEXT, "Diente" TEXT, "Descripción" TEXT, "Realizado" INTEGER, "Cobrado" INTEGER, "Seguro" INTEGER, "Costelab" REAL, "Costefinan" REAL, "Comisión" INTEGER, "Com" TEXT);
+            # Compare on the integer epoch-second shadow of Fecha
+            return queries.fetch_all(conn, "commission_payments_in_range",
+                                     date_keys.range_bounds(start_date, end_date),
+                                     row_factory=records.row_factory(extra=("Importe bruto",)))
 
     except sqlite3.Error as e:
         print(f"SQLite error in get_payments_with_patient_info: {e}")
@@ -91,9 +79,6 @@ def get_payments_with_patient_info(db_path: str, start_date: datetime, end_date:
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
 
 def perform_commission_calculation(all_doctors_commissions, doctor_id, month_name):
@@ -205,69 +190,70 @@ def perform_calculation2(payments, all_doctors_commissions, doctor_id, patients)
     return [commission_results, doctor_analytics]
 
 
-# Example usage
-payments_example = [
-    {
-        "Fecha": "04/09/24",
-        "Código": "440",
-        "Paciente": "MAYRA  DE BIASE  MONTESERIN",
-        "Tratamiento": "",
-        "Diente": "0",
-        "Descripción": "FERULA PROTECCION DE INJERTO",
-        "Realizado": "0,00",
-        "Cobrado": "70,00",
-        "Seguro": "0,00",
-        "Coste lab.": "0,00",
-        "Coste finan.": "0,00",
-        "Comisión%": "0,00",
-        "Com.": ""
+if __name__ == "__main__":
+    # Example usage
+    payments_example = [
+        {
+            "Fecha": "04/09/24",
+            "Código": "440",
+            "Paciente": "MAYRA  DE BIASE  MONTESERIN",
+            "Tratamiento": "",
+            "Diente": "0",
+            "Descripción": "FERULA PROTECCION DE INJERTO",
+            "Realizado": "0,00",
+            "Cobrado": "70,00",
+            "Seguro": "0,00",
+            "Coste lab.": "0,00",
+            "Coste finan.": "0,00",
+            "Comisión%": "0,00",
+            "Com.": ""
+        }
+    ]
+
+    patients_example = {
+        "440": "seguros dentales",
+        "657": "Referido Anna U",
+        "661": "Referido Juan",
+        "662": "Referido Anna U",
+        "663": "seguros dentales",
+        "664": "Facebook",
+        "669": "",
+        "671": "INSTAGRAM",
+        "675": "Amigos"
     }
-]
-
-patients_example = {
-    "440": "seguros dentales",
-    "657": "Referido Anna U",
-    "661": "Referido Juan",
-    "662": "Referido Anna U",
-    "663": "seguros dentales",
-    "664": "Facebook",
-    "669": "",
-    "671": "INSTAGRAM",
-    "675": "Amigos"
-}
 
-# results, total = perform_calculation(payments, doctors_commissions, "15", patients)
+    # results, total = perform_calculation(payments, doctors_commissions, "15", patients)
 
-# results = perform_calculate_commissions("Noviembre", "23")
+    # results = perform_calculate_commissions("Noviembre", "23")
 
-# results = perform_commission_calculation(f'downloads/comisiones_nov_dayana.xls',
-#                                                  f'{download_path}/cliniwin_patients_example.xls',
-#                                                  doctors_commissions,
-#                                                  "22",
-#                                          "Noviembre")
-# print(json.dumps(results, indent=2, ensure_ascii=False))
+    # results = perform_commission_calculation(f'downloads/comisiones_nov_dayana.xls',
+    #                                                  f'{download_path}/cliniwin_patients_example.xls',
+    #                                                  doctors_commissions,
+    #                                                  "22",
+    #                                          "Noviembre")
+    # print(json.dumps(results, indent=2, ensure_ascii=False))
 
 
-# Run the function and print the result
-# parsed_data = parse_patients(f'{download_path}/cliniwin_patients_example.xls')
-# print(json.dumps(parsed_data, indent=4, ensure_ascii=False))
+    # Run the function and print the result
+    # parsed_data = parse_patients(f'{download_path}/cliniwin_patients_example.xls')
+    # print(json.dumps(parsed_data, indent=4, ensure_ascii=False))
 
-# parsed_data = parse_payments(f'{download_path}/cliniwin_payments_example.xls')
-# #print(parsed_data)
-# print(json.dumps(parsed_data[:3], indent=2, ensure_ascii=False))
-# print(json.dumps(parsed_data, indent=4, ensure_ascii=False))
+    # parsed_data = parse_payments(f'{download_path}/cliniwin_payments_example.xls')
+    # #print(parsed_data)
+    # print(json.dumps(parsed_data[:3], indent=2, ensure_ascii=False))
+    # print(json.dumps(parsed_data, indent=4, ensure_ascii=False))
 
-print(perform_calculate_commissions("Enero", "15"))
-# perform_calculate_commissions("2024-11-01", "2024-11-30")
+    print(perform_calculate_commissions("Enero", "15"))
+    # perform_calculate_commissions("2024-11-01", "2024-11-30")
 
-# Run the function and print the results
-# summary, details = perform_commissions_calculation(payments, doctors_commissions)
+    # Run the function and print the results
+    # summary, details = perform_commissions_calculation(payments, doctors_commissions)
 
 
-# print("Summary of Commissions by Doctor:")
-# for row in summary:
-#     print(row)
+    # print("Summary of Commissions by Doctor:")
+    # for row in summary:
+    #     print(row)
 
-# print("\nDetailed Payments:")
-# for payment in details:
-#     print(payment)
+    # print("\nDetailed Payments:")
+    # for payment in details:
+    #     print(payment)
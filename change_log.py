@@ -0,0 +1,503 @@
+"""
+Row-level change log of the loaded tables.
+
+Every row carries a hash of its content in the "row__hash" column, computed at
+ingest time. A load compares the hashes of its rows with the stored ones and
+writes only the rows that are new or changed. Those written to the live table are
+appended to the '_changes' log; a full reload instead compares its staging table
+with the table it replaces when it is swapped in, and logs the differences:
+
+    seq          increasing sequence number, never reused
+    table_name   the table, e.g. 'citas'
+    row_key      the row's key: its Código, or a JSON array of the values of a
+                 composite key such as citas' (Fecha, Hora, Paciente); the row's
+                 hash for tables without a key
+    operation    'insert', 'update' or 'delete'
+    changed_at   when the change was written (UTC)
+
+Derived structures (caches, rollups, alert stores) remember the last sequence
+number they saw and read what changed since with changes_since(), instead of
+recomputing from the whole table. The log keeps config.change_log_days() days of
+changes; prune(), run by the post-load maintenance, deletes older ones. A reader
+whose sequence number is older than first_sequence() has missed changes and must
+read the tables in full again.
+
+Tables with a primary key, other than a surrogate AUTOINCREMENT id such as the
+'id' of cobros, are upserted on it, so their rows are identified by the whole key
+and a changed row is logged as an 'update' of its key. Rows of tables without a
+key, and rows with a NULL in their key, are identified by their content alone: a
+changed row is logged as the delete of the old row and the insert of the new one.
+Identical rows within one file are all kept, but a row already stored, e.g. from
+an overlapping export or an earlier load of the same file, is not added again.
+
+Values are hashed as SQLite stores them under their column's type affinity, so
+the hash of a parsed row equals the hash of the same row read back.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import sqlite3
+from collections import Counter
+from typing import Callable, Sequence
+
+import config
+import database
+import date_keys
+import dimensions
+import name_keys
+
+CHANGES_TABLE = "_changes"
+ROW_HASH_COLUMN = "row__hash"
+
+# Most changes returned by one changes_since() call
+MAX_CHANGES = 10_000
+
+_NUMBER = re.compile(r"\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*")
+
+_SURROGATE_KEY = re.compile(r'"?(\w+)"?\s+INTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT', re.IGNORECASE)
+
+
+def is_hash_column(column: str) -> bool:
+    """
+    Tells whether a column is the row hash.
+    """
+    return column == ROW_HASH_COLUMN
+
+
+def _create_changes_table(conn: sqlite3.Connection):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} ("
+        "seq INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT NOT NULL, row_key TEXT, "
+        "operation TEXT NOT NULL, changed_at TEXT NOT NULL)"
+    )
+
+
+def _as_number(value):
+    # What SQLite makes of a value stored with INTEGER or NUMERIC affinity
+    if isinstance(value, str):
+        if not _NUMBER.fullmatch(value):
+            return value
+        value = float(value) if any(c in value for c in ".eE") else int(value)
+    if isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 63:
+        return int(value)
+    return value
+
+
+def _as_real(value):
+    if isinstance(value, str):
+        return float(value) if _NUMBER.fullmatch(value) else value
+    return float(value) if isinstance(value, int) else value
+
+
+def _as_text(value):
+    return value if isinstance(value, (str, bytes)) else str(value)
+
+
+def _stored_form(declared_type: str) -> Callable:
+    # The affinity rules of https://www.sqlite.org/datatype3.html, in order
+    declared_type = declared_type.upper()
+    if "INT" in declared_type:
+        return _as_number
+    if any(name in declared_type for name in ("CHAR", "CLOB", "TEXT")):
+        return _as_text
+    if not declared_type or "BLOB" in declared_type:
+        return lambda value: value
+    if any(name in declared_type for name in ("REAL", "FLOA", "DOUB")):
+        return _as_real
+    return _as_number
+
+
+def _is_content_column(column: str) -> bool:
+    return not (date_keys.is_shadow_column(column) or name_keys.is_key_column(column) or is_hash_column(column))
+
+
+def _surrogate_key(conn: sqlite3.Connection, storage_name: str) -> str | None:
+    # The AUTOINCREMENT id of a table, which numbers its rows rather than being part of them
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (storage_name,)).fetchone()
+    match = _SURROGATE_KEY.search(row[0]) if row and row[0] else None
+    return match.group(1) if match else None
+
+
+def content_columns(conn: sqlite3.Connection, storage_name: str) -> dict[str, str]:
+    """
+    Returns the columns a table's rows are hashed on, with their declared types.
+
+    Derived columns (date shadows, name keys, the hash) and a surrogate primary key,
+    such as the 'id' of cobros, are left out; every other key column is hashed.
+    Encoded columns (see dimensions.py) are hashed on their values, as TEXT.
+
+    :param conn: A connection to the database.
+    :param storage_name: The table that holds the rows.
+    :return: A dictionary mapping column names to declared types, in table order.
+    """
+    encoded = set(dimensions.encoded_columns(conn, storage_name))
+    surrogate = _surrogate_key(conn, storage_name)
+    return {row[1]: "TEXT" if row[1] in encoded else row[2]
+            for row in conn.execute(f'PRAGMA table_info("{storage_name}")')
+            if _is_content_column(row[1]) and row[1] != surrogate}
+
+
+def row_hasher(conn: sqlite3.Connection, storage_name: str, columns: Sequence[str]) -> Callable[[Sequence], str]:
+    """
+    Returns a function that hashes rows of a table given as tuples of the given columns.
+
+    Only the columns of content_columns() are hashed, and NULLs are left out, so a
+    row hashes the same whether a column was missing from its file or NULL.
+    """
+    declared = content_columns(conn, storage_name)
+    positions = [(position, column, _stored_form(declared[column]))
+                 for position, column in sorted(enumerate(columns), key=lambda item: item[1])
+                 if column in declared]
+
+    def hash_row(row: Sequence) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        for position, column, stored_form in positions:
+            value = row[position]
+            if value is not None:
+                digest.update(f"{column}\x1e{stored_form(value)!r}\x1f".encode())
+        return digest.hexdigest()
+
+    return hash_row
+
+
+def key_columns(conn: sqlite3.Connection, storage_name: str) -> tuple[str, ...]:
+    """
+    Returns the primary key columns of a table, which the loaders upsert on, in key order.
+
+    :return: The key columns, e.g. ('Código',) or ('Fecha', 'Hora', 'Paciente'), or an
+        empty tuple for a table without a key or with a surrogate AUTOINCREMENT id.
+    """
+    if _surrogate_key(conn, storage_name) is not None:
+        return ()
+    keys = sorted((row[5], row[1]) for row in conn.execute(f'PRAGMA table_info("{storage_name}")') if row[5])
+    return tuple(column for _, column in keys)
+
+
+def format_key(values: Sequence) -> str:
+    """
+    Returns the row_key logged for a row with these key values: the value of a
+    single-column key, or a JSON array of the values of a composite one.
+    """
+    if len(values) == 1:
+        return str(values[0])
+    return json.dumps(list(values), ensure_ascii=False, separators=(",", ":"))
+
+
+def _key_sql(alias: str, key: Sequence[str]) -> str:
+    # The SQL form of format_key
+    if len(key) == 1:
+        return f'CAST({alias}."{key[0]}" AS TEXT)'
+    return "json_array(" + ", ".join(f'{alias}."{column}"' for column in key) + ")"
+
+
+def _has_key_sql(alias: str, key: Sequence[str]) -> str:
+    # SQLite lets key columns other than an INTEGER PRIMARY KEY hold NULL; such rows have no usable key
+    return " AND ".join(f'{alias}."{column}" IS NOT NULL' for column in key) if key else "0"
+
+
+def _hash_rows(conn: sqlite3.Connection, storage_name: str, sample: bool = False) -> bool:
+    # Hashes the rows of a table on their values. With sample, only if the first row's
+    # stored hash is stale, e.g. computed before its key columns were hashed
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{storage_name}")')]
+    select_list = ", ".join(dimensions.decoded_select(conn, storage_name))
+    hash_row = row_hasher(conn, storage_name, columns)
+    sql = f'SELECT t.rowid, {select_list} FROM "{storage_name}" t'
+    if sample:
+        first = conn.execute(sql + " LIMIT 1").fetchone()
+        position = columns.index(ROW_HASH_COLUMN) + 1
+        if first is None or first[position] == hash_row(first[1:]):
+            return False
+    rows = conn.execute(sql).fetchall()
+    conn.executemany(f'UPDATE "{storage_name}" SET "{ROW_HASH_COLUMN}" = ? WHERE rowid = ?',
+                     ((hash_row(row[1:]), row[0]) for row in rows))
+    return True
+
+
+def ensure_hash_column(conn: sqlite3.Connection, storage_name: str, create_index: bool = True) -> bool:
+    """
+    Adds and backfills the row hash of a table, and indexes it if the table has no key.
+
+    Cheap to call on every load once the column exists.
+
+    :param conn: A writer connection.
+    :param storage_name: The table that holds the rows, e.g. 'citas__data' or a staging table.
+    :param create_index: False to leave the index out, e.g. on a table about to be replaced.
+    :return: True if the column had to be added.
+    """
+    existing = [row[1] for row in conn.execute(f'PRAGMA table_info("{storage_name}")')]
+    added = ROW_HASH_COLUMN not in existing
+    if added:
+        conn.execute(f'ALTER TABLE "{storage_name}" ADD COLUMN "{ROW_HASH_COLUMN}" TEXT')
+        # Rows loaded before the column existed are hashed once, on their values
+        _hash_rows(conn, storage_name)
+    if create_index and not key_columns(conn, storage_name):
+        database.ensure_index(conn, storage_name, ROW_HASH_COLUMN)
+    return added
+
+
+def _lookup(conn: sqlite3.Connection, sql: str, values: list, width: int = 1) -> list[tuple]:
+    # Looked up in chunks, to stay below SQLite's limit on bound parameters; with a
+    # width above 1, values holds tuples that are matched as row values
+    found = []
+    size = max(1, 500 // width)
+    for start in range(0, len(values), size):
+        chunk = values[start:start + size]
+        if width == 1:
+            placeholders, params = ", ".join("?" for _ in chunk), chunk
+        else:
+            row = "(" + ", ".join("?" for _ in range(width)) + ")"
+            placeholders = "VALUES " + ", ".join(row for _ in chunk)
+            params = [value for values_ in chunk for value in values_]
+        found += conn.execute(sql.format(placeholders=placeholders), params).fetchall()
+    return found
+
+
+def select_changes(conn: sqlite3.Connection, storage_name: str, columns: Sequence[str],
+                   rows: Sequence[tuple], compare_with: str | None = None) -> tuple[list[tuple], list[tuple]]:
+    """
+    Picks the rows of a load that change a table, comparing their hashes with the stored ones.
+
+    Keyed rows are upserted, so only the last row of each key counts; it is new if
+    the key is not stored yet and changed if its hash differs. Composite keys, such as
+    the (Fecha, Hora, Paciente) of citas, are compared as a whole. Rows without a key
+    are new unless the table already holds as many identical rows.
+
+    :param conn: A writer connection, inside the transaction that writes the rows.
+    :param storage_name: The table the rows are written to.
+    :param columns: The columns of the row tuples.
+    :param rows: The parsed rows.
+    :param compare_with: The table or view holding the stored rows, if not the one written
+        to, e.g. the view over every partition of a partitioned table.
+    :return: A tuple (rows to write, each with its hash appended; log entries as
+        (row_key, operation) tuples for log_changes).
+    """
+    hash_row = row_hasher(conn, storage_name, columns)
+    hashed = [row + (hash_row(row),) for row in rows]
+    stored_in = compare_with or storage_name
+    key = key_columns(conn, storage_name)
+    changed, entries = [], []
+
+    if key and all(column in columns for column in key):
+        declared = content_columns(conn, storage_name)
+        # Key values are compared as stored, e.g. a Código parsed as text matches the stored integer
+        key_forms = [(list(columns).index(column), _stored_form(declared.get(column, ""))) for column in key]
+        latest, keyless = {}, []
+        for row in hashed:
+            values = tuple(None if row[position] is None else stored_form(row[position])
+                           for position, stored_form in key_forms)
+            if None in values:
+                # Never replaces a stored row, so it is compared on its content like a row without a key
+                keyless.append(row)
+            else:
+                latest[values] = row
+        key_list = ", ".join(f'"{column}"' for column in key)
+        if len(key) == 1:
+            found = _lookup(conn, f'SELECT {key_list}, "{ROW_HASH_COLUMN}" FROM "{stored_in}" '
+                                  f'WHERE {key_list} IN ({{placeholders}})', [values[0] for values in latest])
+        else:
+            found = _lookup(conn, f'SELECT {key_list}, "{ROW_HASH_COLUMN}" FROM "{stored_in}" '
+                                  f'WHERE ({key_list}) IN ({{placeholders}})', list(latest), len(key))
+        stored = {tuple(row[:-1]): row[-1] for row in found}
+        for values, row in latest.items():
+            if values not in stored:
+                changed.append(row)
+                entries.append((format_key(values), "insert"))
+            elif stored[values] != row[-1]:
+                changed.append(row)
+                entries.append((format_key(values), "update"))
+        hashed = keyless
+        if not hashed:
+            return changed, entries
+
+    stored = Counter(dict(_lookup(conn, f'SELECT "{ROW_HASH_COLUMN}", COUNT(*) FROM "{stored_in}" t '
+                                        f'WHERE "{ROW_HASH_COLUMN}" IN ({{placeholders}}) '
+                                        f'AND NOT ({_has_key_sql("t", key)}) '
+                                        f'GROUP BY "{ROW_HASH_COLUMN}"',
+                                  list({row[-1] for row in hashed}))))
+    for row in hashed:
+        if stored[row[-1]] > 0:
+            # Already in the table, e.g. from an earlier load of the same file
+            stored[row[-1]] -= 1
+        else:
+            changed.append(row)
+            entries.append((row[-1], "insert"))
+    return changed, entries
+
+
+def log_changes(conn: sqlite3.Connection, table_name: str, entries: Sequence[tuple]):
+    """
+    Appends changes to the log.
+
+    Call this inside the same transaction as the write, so the log and the data
+    become visible together.
+
+    :param conn: A writer connection.
+    :param table_name: The table that changed, e.g. 'citas' rather than its storage table.
+    :param entries: (row_key, operation) tuples.
+    """
+    _create_changes_table(conn)
+    conn.executemany(
+        f"INSERT INTO {CHANGES_TABLE} (table_name, row_key, operation, changed_at) "
+        "VALUES (?, ?, ?, datetime('now'))",
+        ((table_name, row_key, operation) for row_key, operation in entries)
+    )
+
+
+def log_reload(conn: sqlite3.Connection, table_name: str, live_name: str, staging_name: str,
+               compare_with: str | None = None) -> int:
+    """
+    Logs the differences between a table and the staging table of a full reload that replaces it.
+
+    :param conn: A writer connection, inside the transaction of the swap.
+    :param table_name: The table being reloaded.
+    :param live_name: The table the staging table replaces, e.g. its storage table; it may not exist.
+    :param staging_name: The filled staging table.
+    :param compare_with: For keyed tables, the table or view the staged rows are looked up
+        in, if not live_name, e.g. the view over every partition of a partitioned table.
+        Only rows of live_name can be deleted by the reload.
+    :return: The number of changes logged.
+    """
+    _create_changes_table(conn)
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (live_name,)).fetchone():
+        live_name = None
+    elif ensure_hash_column(conn, live_name, create_index=False):
+        print(f"Hashed the rows of '{live_name}' to compare them with the reload.")
+
+    before = last_sequence(conn)
+    insert = (f"INSERT INTO {CHANGES_TABLE} (table_name, row_key, operation, changed_at) "
+              "SELECT ?, row_key, operation, datetime('now') FROM ")
+    key = key_columns(conn, staging_name)
+    if live_name is None:
+        row_key = (f'CASE WHEN {_has_key_sql("s", key)} THEN {_key_sql("s", key)} ELSE s."{ROW_HASH_COLUMN}" END'
+                   if key else f's."{ROW_HASH_COLUMN}"')
+        conn.execute(insert + f'(SELECT {row_key} AS row_key, \'insert\' AS operation '
+                              f'FROM "{staging_name}" s)', (table_name,))
+        return last_sequence(conn) - before
+
+    if key and key_columns(conn, live_name) == key:
+        joined = " AND ".join(f'l."{column}" = s."{column}"' for column in key)
+        conn.execute(insert + f"""(
+            SELECT {_key_sql("s", key)} AS row_key,
+                   CASE WHEN l."{key[0]}" IS NULL THEN 'insert' ELSE 'update' END AS operation
+            FROM "{staging_name}" s LEFT JOIN "{compare_with or live_name}" l ON {joined}
+            WHERE {_has_key_sql("s", key)}
+              AND (l."{key[0]}" IS NULL OR l."{ROW_HASH_COLUMN}" IS NOT s."{ROW_HASH_COLUMN}")
+            UNION ALL
+            SELECT {_key_sql("l", key)}, 'delete' FROM "{live_name}" l
+            WHERE {_has_key_sql("l", key)}
+              AND NOT EXISTS (SELECT 1 FROM "{staging_name}" s WHERE {joined}))""", (table_name,))
+        # Rows with a NULL in their key are compared on their content
+        keyless = f'WHERE NOT ({_has_key_sql("t", key)})'
+    else:
+        keyless = ""
+    # Rows without a key are compared as multisets of hashes
+    counts = f'SELECT "{ROW_HASH_COLUMN}" AS h, COUNT(*) AS n FROM "{{table}}" t {keyless} GROUP BY 1'
+    differences = conn.execute(f"""
+        WITH s AS ({counts.format(table=staging_name)}), l AS ({counts.format(table=live_name)})
+        SELECT s.h, 'insert', s.n - COALESCE(l.n, 0) FROM s LEFT JOIN l ON l.h = s.h WHERE s.n > COALESCE(l.n, 0)
+        UNION ALL
+        SELECT l.h, 'delete', l.n - COALESCE(s.n, 0) FROM l LEFT JOIN s ON s.h = l.h WHERE l.n > COALESCE(s.n, 0)
+    """).fetchall()
+    log_changes(conn, table_name, [(row_hash, operation) for row_hash, operation, times in differences
+                                   for _ in range(times)])
+    return last_sequence(conn) - before
+
+
+def changes_since(conn: sqlite3.Connection, since: int = 0, table_name: str | None = None,
+                  limit: int = 1000) -> list[dict]:
+    """
+    Returns the changes logged after a sequence number, oldest first.
+
+    Read the next page by passing the 'seq' of the last change returned.
+
+    :param conn: Any connection to the database.
+    :param since: The last sequence number already processed; 0 for the whole log.
+        Changes up to first_sequence() have been pruned and are not returned.
+    :param table_name: Only the changes of this table, if given.
+    :param limit: The most changes to return, up to MAX_CHANGES.
+    :return: Dictionaries with the 'seq', 'table', 'key', 'operation' and 'changed_at' of each change.
+    """
+    limit = max(1, min(limit, MAX_CHANGES))
+    sql = f"SELECT seq, table_name, row_key, operation, changed_at FROM {CHANGES_TABLE} WHERE seq > ?"
+    params = [since]
+    if table_name is not None:
+        sql += " AND table_name = ?"
+        params.append(table_name)
+    try:
+        rows = conn.execute(sql + " ORDER BY seq LIMIT ?", params + [limit]).fetchall()
+    except sqlite3.OperationalError:
+        # Nothing has been loaded yet
+        return []
+    return [{"seq": seq, "table": table, "key": key, "operation": operation, "changed_at": changed_at}
+            for seq, table, key, operation, changed_at in rows]
+
+
+def last_sequence(conn: sqlite3.Connection) -> int:
+    """
+    Returns the sequence number of the last change logged, or 0 if there is none.
+
+    Pruning does not move it back: it is read from the AUTOINCREMENT counter.
+    """
+    try:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (CHANGES_TABLE,)).fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+def first_sequence(conn: sqlite3.Connection) -> int:
+    """
+    Returns the oldest sequence number changes_since() can still read on from.
+
+    Sequence numbers are contiguous and only the oldest changes are pruned, so
+    every change after it is still in the log.
+    """
+    try:
+        oldest = conn.execute(f"SELECT MIN(seq) FROM {CHANGES_TABLE}").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    return oldest - 1 if oldest is not None else last_sequence(conn)
+
+
+def prune(conn: sqlite3.Connection, keep_days: int | None = None) -> int:
+    """
+    Deletes the changes logged more than `keep_days` days ago.
+
+    :param conn: A writer connection.
+    :param keep_days: How many days of changes to keep; config.change_log_days() by default.
+    :return: The number of changes deleted.
+    """
+    if keep_days is None:
+        keep_days = config.change_log_days()
+    # changed_at is written in order, so this deletes a prefix of the log
+    cutoff = conn.execute("SELECT datetime('now', ?)", (f"-{keep_days} days",)).fetchone()[0]
+    try:
+        last = conn.execute(f"SELECT MAX(seq) FROM {CHANGES_TABLE} WHERE changed_at < ?", (cutoff,)).fetchone()[0]
+    except sqlite3.OperationalError:
+        # Nothing has been loaded yet
+        return 0
+    if last is None:
+        return 0
+    return conn.execute(f"DELETE FROM {CHANGES_TABLE} WHERE seq <= ?", (last,)).rowcount
+
+
+def migrate_database(conn: sqlite3.Connection):
+    """
+    Runs ensure_hash_column over every user table, e.g. the storage tables and
+    partitions behind views, and creates the log.
+
+    Rows that exist when the column is added are hashed but not logged: the log
+    starts with the first load after it. Tables whose hashes were computed on fewer
+    columns, before every key column was hashed, are hashed again.
+
+    :param conn: A writer connection.
+    """
+    _create_changes_table(conn)
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name NOT LIKE '\\_%' ESCAPE '\\'"
+    )]
+    for table_name in tables:
+        if not ensure_hash_column(conn, table_name) and _hash_rows(conn, table_name, sample=True):
+            print(f"Hashed the rows of '{table_name}' again, on every key column.")
@@ -1,144 +1,127 @@
 
 import streamlit as st
 from datetime import date, timedelta
+import functools
 import sqlite3
 import pandas as pd
 
+import columnar
+import config
+import database
+import date_keys
+import queries
+import version_feed
+
 st.title("Clínica Lubens Dashboard")
 
 # --- Database Connection ---
-DB_PATH = "output/data.db"
-
+# Only read: the API adds the date shadow columns when it starts, and loads the data
+DB_PATH = database.DB_PATH
+
+# How often each widget checks the data versions pushed by the API; the check itself reads no data
+WATCH_SECONDS = 2
+
+
+@st.cache_resource
+def version_subscription():
+    """Follows the API's data version stream, once per dashboard process."""
+    return version_feed.Subscriber(config.dashboard_api_url() + version_feed.STREAM_PATH).start()
+
+
+def table_versions(tables):
+    """Returns the current data version of each of the given tables."""
+    versions = version_subscription().versions()
+    if versions is None:
+        # The API is not reachable; read the versions so the widgets still follow the data
+        try:
+            with database.get_pool(DB_PATH).reader() as con:
+                versions = database.get_data_versions(con)
+        except (sqlite3.Error, FileNotFoundError):
+            versions = {}
+    return tuple(versions.get(table, 0) for table in tables)
+
+
+def depends_on(*tables, empty, subject=None):
+    """
+    Caches a query function's results until a load changes one of the tables it reads.
+
+    A failed query is shown with st.error outside the cache, so the next rerun
+    queries again instead of showing the same error until the next load.
+
+    :param tables: The tables the function reads.
+    :param empty: Makes the result shown when the query fails, e.g. int or pd.DataFrame.
+    :param subject: What the function queries, for the error message.
+    """
+    about = f" for {subject}" if subject else ""
+
+    def decorate(func):
+        @st.cache_data(show_spinner=False, max_entries=256)
+        def cached(name, versions, *args):
+            return func(*args)
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            try:
+                # Every wrapped function shares one cache, so the name is part of the key
+                return cached(func.__name__, table_versions(tables), *args)
+            except (sqlite3.Error, FileNotFoundError) as e:
+                st.error(f"Database error{about}: {e}")
+                return empty()
+            except Exception as e:
+                st.error(f"An unexpected error occurred{about}: {e}")
+                return empty()
+        return wrapper
+    return decorate
+
+@depends_on("cobros", empty=int)
 def get_revenue(start_date, end_date):
     """Queries the database to get the total revenue for a given date range."""
-    try:
-        query = f"""
-                SELECT SUM(Importecobrado)
-                FROM cobros
-                WHERE Fechadecobro BETWEEN '{start_date}' AND '{end_date}'
-            """
-        with sqlite3.connect(DB_PATH) as con:
-            total_revenue = pd.read_sql_query(query, con).iloc[0, 0]
-            return total_revenue if total_revenue is not None else 0
-    except (sqlite3.Error, FileNotFoundError) as e:
-        st.error(f"Database error: {e}")
-        return 0
-    except Exception as e:
-        st.error(f"An unexpected error occurred: {e}")
-        return 0
+    with database.get_pool(DB_PATH).reader() as con:
+        total_revenue = queries.read_frame(con, "revenue", date_keys.range_bounds(start_date, end_date)).iloc[0, 0]
+        return total_revenue if total_revenue is not None else 0
 
+@depends_on("fechas_pacientes", empty=int)
 def get_new_patients(start_date, end_date):
     """Queries the database to get the number of new patients for a given date range."""
-    try:
-        query = f"""
-                SELECT COUNT(*)
-                FROM fechas_pacientes
-                WHERE Fechadealta BETWEEN '{start_date}' AND '{end_date}'
-            """
-        with sqlite3.connect(DB_PATH) as con:
-            new_patients = pd.read_sql_query(query, con).iloc[0, 0]
-            return new_patients if new_patients is not None else 0
-    except (sqlite3.Error, FileNotFoundError) as e:
-        st.error(f"Database error: {e}")
-        return 0
-    except Exception as e:
-        st.error(f"An unexpected error occurred: {e}")
-        return 0
+    with database.get_pool(DB_PATH).reader() as con:
+        new_patients = queries.read_frame(con, "new_patients", date_keys.range_bounds(start_date, end_date)).iloc[0, 0]
+        return new_patients if new_patients is not None else 0
 
 
+@depends_on("citas", empty=int)
 def get_new_appointments(start_date, end_date):
     """Queries the database to get the number of new appointments for a given date range."""
-    try:
-        query = f"""
-                SELECT COUNT(*)
-                FROM citas
-                WHERE Fecha BETWEEN '{start_date}' AND '{end_date}'
-            """
-        with sqlite3.connect(DB_PATH) as con:
-            new_appointments = pd.read_sql_query(query, con).iloc[0, 0]
-            return new_appointments if new_appointments is not None else 0
-    except (sqlite3.Error, FileNotFoundError) as e:
-        st.error(f"Database error: {e}")
-        return 0
-    except Exception as e:
-        st.error(f"An unexpected error occurred: {e}")
-        return 0
+    with database.get_pool(DB_PATH).reader() as con:
+        new_appointments = queries.read_frame(con, "new_appointments", date_keys.range_bounds(start_date, end_date)).iloc[0, 0]
+        return new_appointments if new_appointments is not None else 0
 
+@depends_on("tratamientos", empty=pd.DataFrame, subject="treatment distribution")
 def get_treatment_distribution(start_date, end_date):
     """Queries the database to get the distribution of treatments for a given date range."""
-    try:
-        query = f"""
-                SELECT
-                    Especialidad,
-                    COUNT(*) as treatment_count
-                FROM tratamientos
-                WHERE Fecharealizado BETWEEN '{start_date}' AND '{end_date}'
-                GROUP BY Especialidad
-                ORDER BY treatment_count DESC
-            """
-        with sqlite3.connect(DB_PATH) as con:
-            df = pd.read_sql_query(query, con)
-            return df
-    except (sqlite3.Error, FileNotFoundError) as e:
-        st.error(f"Database error for treatment distribution: {e}")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"An unexpected error occurred for treatment distribution: {e}")
-        return pd.DataFrame()
+    with database.get_pool(DB_PATH).reader() as con:
+        df = queries.read_frame(con, "treatment_distribution", date_keys.range_bounds(start_date, end_date))
+        return df
 
+@depends_on("tratamientos", empty=int, subject="total unique patients")
 def get_total_unique_patients(start_date, end_date):
     """Queries the database to get the total number of unique patients who received treatments for a given date range."""
-    try:
-        query = f"""
-                SELECT COUNT(DISTINCT CódigoPaciente)
-                FROM tratamientos
-                WHERE Fecharealizado BETWEEN '{start_date}' AND '{end_date}'
-            """
-        with sqlite3.connect(DB_PATH) as con:
-            total_patients = pd.read_sql_query(query, con).iloc[0, 0]
-            return total_patients if total_patients is not None else 0
-    except (sqlite3.Error, FileNotFoundError) as e:
-        st.error(f"Database error for total unique patients: {e}")
-        return 0
-    except Exception as e:
-        st.error(f"An unexpected error occurred for total unique patients: {e}")
-        return 0
+    with database.get_pool(DB_PATH).reader() as con:
+        total_patients = queries.read_frame(con, "total_unique_patients", date_keys.range_bounds(start_date, end_date)).iloc[0, 0]
+        return total_patients if total_patients is not None else 0
 
+@depends_on("tratamientos", empty=int, subject="aesthetic total spending")
 def get_aesthetic_total_spending(start_date, end_date):
     """Queries the database to get the total spending for 'Estetica' treatments for a given date range."""
-    try:
-        query = f"""
-                SELECT SUM(Precio)
-                FROM tratamientos
-                WHERE Especialidad = 'ESTETICA' AND Fecharealizado BETWEEN '{start_date}' AND '{end_date}'
-            """
-        with sqlite3.connect(DB_PATH) as con:
-            total_spending = pd.read_sql_query(query, con).iloc[0, 0]
-            return total_spending if total_spending is not None else 0
-    except (sqlite3.Error, FileNotFoundError) as e:
-        st.error(f"Database error for aesthetic total spending: {e}")
-        return 0
-    except Exception as e:
-        st.error(f"An unexpected error occurred for aesthetic total spending: {e}")
-        return 0
+    with database.get_pool(DB_PATH).reader() as con:
+        total_spending = queries.read_frame(con, "aesthetic_total_spending", date_keys.range_bounds(start_date, end_date)).iloc[0, 0]
+        return total_spending if total_spending is not None else 0
 
+@depends_on("tratamientos", empty=int, subject="unique aesthetic patients")
 def get_unique_aesthetic_patients(start_date, end_date):
     """Queries the database to get the number of unique patients who received 'Estetica' treatments for a given date range."""
-    try:
-        query = f"""
-                SELECT COUNT(DISTINCT CódigoPaciente)
-                FROM tratamientos
-                WHERE Especialidad = 'Estetica' AND Fecharealizado BETWEEN '{start_date}' AND '{end_date}'
-            """
-        with sqlite3.connect(DB_PATH) as con:
-            unique_patients = pd.read_sql_query(query, con).iloc[0, 0]
-            return unique_patients if unique_patients is not None else 0
-    except (sqlite3.Error, FileNotFoundError) as e:
-        st.error(f"Database error for unique aesthetic patients: {e}")
-        return 0
-    except Exception as e:
-        st.error(f"An unexpected error occurred for unique aesthetic patients: {e}")
-        return 0
+    with database.get_pool(DB_PATH).reader() as con:
+        unique_patients = queries.read_frame(con, "unique_aesthetic_patients", date_keys.range_bounds(start_date, end_date)).iloc[0, 0]
+        return unique_patients if unique_patients is not None else 0
 
 def get_average_spending_per_patient(start_date, end_date):
     """Calculates the average spending per patient for a given date range."""
@@ -167,155 +150,150 @@ def get_granularity(start_date, end_date):
     else:
         return "year"
 
+@depends_on("cobros", empty=pd.DataFrame, subject="revenue by period")
 def get_revenue_by_period(start_date, end_date, granularity):
-    try:
-        if granularity == "day":
-            period_format = '%Y-%m-%d'
-        elif granularity == "month":
-            period_format = '%Y-%m'
-        else: # year
-            period_format = '%Y'
-
-        query = f"""
-                SELECT
-                    strftime('{period_format}', Fechadecobro) as period,
-                    SUM(Importecobrado) as total_revenue
-                FROM cobros
-                WHERE Fechadecobro BETWEEN '{start_date}' AND '{end_date}'
-                GROUP BY period
-                ORDER BY period
-            """
-        with sqlite3.connect(DB_PATH) as con:
-            df = pd.read_sql_query(query, con)
-            return df
-    except (sqlite3.Error, FileNotFoundError) as e:
-        st.error(f"Database error for revenue by period: {e}")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"An unexpected error occurred for revenue by period: {e}")
-        return pd.DataFrame()
-
+    if granularity == "day":
+        period_format = '%Y-%m-%d'
+    elif granularity == "month":
+        period_format = '%Y-%m'
+    else: # year
+        period_format = '%Y'
+
+    if granularity == "year":
+        # Multi-year ranges scan the Parquet mirror instead of every SQLite row
+        mirror = columnar.read_table("cobros", ["Fechadecobro", "Importecobrado"], start_date, end_date)
+        if mirror is not None:
+            mirror["period"] = mirror["Fechadecobro"].dt.strftime(period_format)
+            return mirror.groupby("period", as_index=False).agg(total_revenue=("Importecobrado", "sum"))
+
+    with database.get_pool(DB_PATH).reader() as con:
+        df = queries.read_frame(con, f"revenue_by_period:{granularity}", date_keys.range_bounds(start_date, end_date))
+        df["period"] = [date_keys.period_label(key, granularity) for key in df["period"]]
+        return df
+
+@depends_on("fechas_pacientes", empty=pd.DataFrame, subject="new patients by period")
 def get_new_patients_by_period(start_date, end_date, granularity):
-    try:
-        if granularity == "day":
-            period_format = '%Y-%m-%d'
-        elif granularity == "month":
-            period_format = '%Y-%m'
-        else: # year
-            period_format = '%Y'
-
-        query = f"""
-                SELECT
-                    strftime('{period_format}', Fechadealta) as period,
-                    COUNT(*) as new_patients_count
-                FROM fechas_pacientes
-                WHERE Fechadealta BETWEEN '{start_date}' AND '{end_date}'
-                GROUP BY period
-                ORDER BY period
-            """
-        with sqlite3.connect(DB_PATH) as con:
-            df = pd.read_sql_query(query, con)
-            return df
-    except (sqlite3.Error, FileNotFoundError) as e:
-        st.error(f"Database error for new patients by period: {e}")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"An unexpected error occurred for new patients by period: {e}")
-        return pd.DataFrame()
+    with database.get_pool(DB_PATH).reader() as con:
+        df = queries.read_frame(con, f"new_patients_by_period:{granularity}", date_keys.range_bounds(start_date, end_date))
+        df["period"] = [date_keys.period_label(key, granularity) for key in df["period"]]
+        return df
 
+@depends_on("citas", empty=pd.DataFrame, subject="new appointments by period")
 def get_new_appointments_by_period(start_date, end_date, granularity):
     """Queries the database to get the number of new appointments for a given date range, grouped by period."""
-    try:
-        if granularity == "day":
-            period_format = '%Y-%m-%d'
-        elif granularity == "month":
-            period_format = '%Y-%m'
-        else: # year
-            period_format = '%Y'
-
-        query = f"""
-                SELECT
-                    strftime('{period_format}', Fecha) as period,
-                    COUNT(*) as new_appointments_count
-                FROM citas
-                WHERE Fecha BETWEEN '{start_date}' AND '{end_date}'
-                GROUP BY period
-                ORDER BY period
-            """
-        with sqlite3.connect(DB_PATH) as con:
-            df = pd.read_sql_query(query, con)
-            return df
-    except (sqlite3.Error, FileNotFoundError) as e:
-        st.error(f"Database error for new appointments by period: {e}")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"An unexpected error occurred for new appointments by period: {e}")
-        return pd.DataFrame()
+    with database.get_pool(DB_PATH).reader() as con:
+        df = queries.read_frame(con, f"new_appointments_by_period:{granularity}", date_keys.range_bounds(start_date, end_date))
+        df["period"] = [date_keys.period_label(key, granularity) for key in df["period"]]
+        return df
 
+@depends_on("tratamientos", empty=pd.DataFrame, subject="total patients by period")
 def get_total_patients_by_period(start_date, end_date, granularity):
     """Queries the database to get the total number of unique patients who received treatments for a given date range, grouped by period."""
-    try:
-        if granularity == "day":
-            period_format = '%Y-%m-%d'
-        elif granularity == "month":
-            period_format = '%Y-%m'
-        else: # year
-            period_format = '%Y'
-
-        query = f"""
-                SELECT
-                    strftime('{period_format}', Fecharealizado) as period,
-                    COUNT(DISTINCT CódigoPaciente) as total_patients_count
-                FROM tratamientos
-                WHERE Fecharealizado BETWEEN '{start_date}' AND '{end_date}'
-                GROUP BY period
-                ORDER BY period
-            """
-        with sqlite3.connect(DB_PATH) as con:
-            df = pd.read_sql_query(query, con)
-            return df
-    except (sqlite3.Error, FileNotFoundError) as e:
-        st.error(f"Database error for total patients by period: {e}")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"An unexpected error occurred for total patients by period: {e}")
-        return pd.DataFrame()
+    with database.get_pool(DB_PATH).reader() as con:
+        df = queries.read_frame(con, f"total_patients_by_period:{granularity}", date_keys.range_bounds(start_date, end_date))
+        df["period"] = [date_keys.period_label(key, granularity) for key in df["period"]]
+        return df
 
+@depends_on("tratamientos", empty=pd.DataFrame, subject="average spending per patient by period")
 def get_average_spending_per_patient_by_period(start_date, end_date, granularity):
     """Queries the database to get the average spending per patient for a given date range, grouped by period."""
-    try:
-        if granularity == "day":
-            period_format = '%Y-%m-%d'
-        elif granularity == "month":
-            period_format = '%Y-%m'
-        else: # year
-            period_format = '%Y'
-
-        query = f"""
-                SELECT
-                    period,
-                    AVG(patient_spending) as avg_spending_per_patient
-                FROM (
-                    SELECT
-                        CódigoPaciente,
-                        strftime('{period_format}', Fecharealizado) as period,
-                        SUM(Precio) as patient_spending
-                    FROM tratamientos
-                    WHERE Fecharealizado BETWEEN '{start_date}' AND '{end_date}'
-                    GROUP BY CódigoPaciente, period
-                )
-                GROUP BY period
-                ORDER BY period
-            """
-        with sqlite3.connect(DB_PATH) as con:
-            df = pd.read_sql_query(query, con)
-            return df
-    except (sqlite3.Error, FileNotFoundError) as e:
-        st.error(f"Database error for average spending per patient by period: {e}")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"An unexpected error occurred for average spending per patient by period: {e}")
-        return pd.DataFrame()
+    if granularity == "day":
+        period_format = '%Y-%m-%d'
+    elif granularity == "month":
+        period_format = '%Y-%m'
+    else: # year
+        period_format = '%Y'
+
+    if granularity == "year":
+        # Multi-year ranges scan the Parquet mirror instead of every SQLite row
+        mirror = columnar.read_table("tratamientos", ["CódigoPaciente", "Fecharealizado", "Precio"],
+                                     start_date, end_date)
+        if mirror is not None:
+            mirror["period"] = mirror["Fecharealizado"].dt.strftime(period_format)
+            patient_spending = mirror.groupby(["CódigoPaciente", "period"])["Precio"].sum()
+            return patient_spending.groupby("period").mean().reset_index(name="avg_spending_per_patient")
+
+    with database.get_pool(DB_PATH).reader() as con:
+        df = queries.read_frame(con, f"average_spending_per_patient_by_period:{granularity}", date_keys.range_bounds(start_date, end_date))
+        df["period"] = [date_keys.period_label(key, granularity) for key in df["period"]]
+        return df
+
+
+# --- Widgets ---
+# Each widget is a fragment: it reruns on its own every WATCH_SECONDS, and only
+# queries again when a load has changed one of the tables it reads.
+def format_euros(value):
+    return f"{value:,.2f} €"
+
+@st.fragment(run_every=WATCH_SECONDS)
+def show_metric(label, getter, format_value, start_date, end_date, prev_start_date, prev_end_date, comparison_label):
+    """Shows a metric for the selected range, compared with the previous one."""
+    current_value = getter(start_date, end_date)
+    previous_value = (
+        getter(prev_start_date, prev_end_date)
+        if prev_start_date and prev_end_date
+        else 0
+    )
+
+    delta_str = format_value(current_value - previous_value)
+    if comparison_label:
+        delta_str += f" {comparison_label}"
+    st.metric(label, format_value(current_value), delta_str)
+
+@st.fragment(run_every=WATCH_SECONDS)
+def show_revenue_chart(start_date, end_date, granularity):
+    revenue_df = get_revenue_by_period(start_date, end_date, granularity)
+    if not revenue_df.empty:
+        st.write(f"### Revenue by {granularity.capitalize()}")
+        st.bar_chart(revenue_df, x='period', y='total_revenue')
+    else:
+        st.info("No revenue data available for the selected period.")
+
+@st.fragment(run_every=WATCH_SECONDS)
+def show_patients_chart(start_date, end_date, granularity):
+    new_patients_df = get_new_patients_by_period(start_date, end_date, granularity)
+    total_patients_df = get_total_patients_by_period(start_date, end_date, granularity)
+
+    if not new_patients_df.empty or not total_patients_df.empty:
+        # Merge the two dataframes
+        patients_df = pd.merge(new_patients_df, total_patients_df, on='period', how='outer').fillna(0)
+        patients_df['patients_excluding_new'] = patients_df['total_patients_count'] - patients_df['new_patients_count']
+        
+        # Ensure the columns for charting are present, even if one is all zeros
+        chart_data = patients_df[['period', 'new_patients_count', 'patients_excluding_new']]
+        
+        st.write(f"### Patients by {granularity.capitalize()}")
+        st.bar_chart(chart_data, x='period', y=['new_patients_count', 'patients_excluding_new'])
+    else:
+        st.info("No patient data available for the selected period.")
+
+@st.fragment(run_every=WATCH_SECONDS)
+def show_appointments_chart(start_date, end_date, granularity):
+    appointments_df = get_new_appointments_by_period(start_date, end_date, granularity)
+    if not appointments_df.empty:
+        st.write(f"### New Appointments by {granularity.capitalize()}")
+        st.bar_chart(appointments_df, x='period', y='new_appointments_count')
+    else:
+        st.info("No new appointments data available for the selected period.")
+
+@st.fragment(run_every=WATCH_SECONDS)
+def show_average_spending_chart(start_date, end_date, granularity):
+    avg_spending_df = get_average_spending_per_patient_by_period(start_date, end_date, granularity)
+    if not avg_spending_df.empty:
+        st.write(f"### Average Spending per Patient by {granularity.capitalize()}")
+        st.bar_chart(avg_spending_df, x='period', y='avg_spending_per_patient')
+    else:
+        st.info("No average spending per patient data available for the selected period.")
+
+@st.fragment(run_every=WATCH_SECONDS)
+def show_treatment_distribution_chart(start_date, end_date):
+    treatment_distribution_df = get_treatment_distribution(start_date, end_date)
+    if not treatment_distribution_df.empty:
+        st.write("### Treatment Distribution")
+        st.bar_chart(treatment_distribution_df, x='Especialidad', y='treatment_count')
+    else:
+        st.info("No treatment data available for the selected period.")
+
 
 
 # --- Sidebar for date selection ---
@@ -430,130 +408,28 @@ if start_date and end_date:
     st.write(
         f"Selected date range: **{start_date.strftime('%Y-%m-%d')}** to **{end_date.strftime('%Y-%m-%d')}**"
     )
+    previous_range = (prev_start_date, prev_end_date, comparison_label)
 
     # --- Metrics ---
     col1, col2, col3, col4 = st.columns(4)
 
-    # --- Revenue Metric ---
-    current_revenue = get_revenue(start_date, end_date)
-    previous_revenue = (
-        get_revenue(prev_start_date, prev_end_date)
-        if prev_start_date and prev_end_date
-        else 0
-    )
-
-    delta_revenue = current_revenue - previous_revenue
-    delta_revenue_str = f"{delta_revenue:,.2f} €"
-    if comparison_label:
-        delta_revenue_str += f" {comparison_label}"
-
-    col1.metric("Revenue", f"{current_revenue:,.2f} €", delta_revenue_str)
-
-    # --- New Patients Metric ---
-    current_new_patients = get_new_patients(start_date, end_date)
-    previous_new_patients = (
-        get_new_patients(prev_start_date, prev_end_date)
-        if prev_start_date and prev_end_date
-        else 0
-    )
-
-    delta_new_patients = current_new_patients - previous_new_patients
-    delta_new_patients_str = f"{delta_new_patients}"
-    if comparison_label:
-        delta_new_patients_str += f" {comparison_label}"
-    col2.metric("New Patients", f"{current_new_patients}", delta_new_patients_str)
-
-    # --- New Appointments Metric ---
-    current_new_appointments = get_new_appointments(start_date, end_date)
-    previous_new_appointments = (
-        get_new_appointments(prev_start_date, prev_end_date)
-        if prev_start_date and prev_end_date
-        else 0
-    )
-
-    delta_new_appointments = current_new_appointments - previous_new_appointments
-    delta_new_appointments_str = f"{delta_new_appointments}"
-    if comparison_label:
-        delta_new_appointments_str += f" {comparison_label}"
-    col3.metric(
-        "New Appointments", f"{current_new_appointments}", delta_new_appointments_str
-    )
-
-    # --- Average Spending per Patient Metric ---
-    current_avg_spending = get_average_spending_per_patient(start_date, end_date)
-    previous_avg_spending = (
-        get_average_spending_per_patient(prev_start_date, prev_end_date)
-        if prev_start_date and prev_end_date
-        else 0
-    )
-    delta_avg_spending = current_avg_spending - previous_avg_spending
-    delta_avg_spending_str = f"{delta_avg_spending:,.2f} €"
-    if comparison_label:
-        delta_avg_spending_str += f" {comparison_label}"
-    col4.metric("Avg Spending/Patient", f"{current_avg_spending:,.2f} €", delta_avg_spending_str)
-
-    # --- Average Spending per Aesthetic Patient Metric ---
-    current_avg_aesthetic_spending = get_average_spending_per_aesthetic_patient(start_date, end_date)
-    previous_avg_aesthetic_spending = (
-        get_average_spending_per_aesthetic_patient(prev_start_date, prev_end_date)
-        if prev_start_date and prev_end_date
-        else 0
-    )
-    delta_avg_aesthetic_spending = current_avg_aesthetic_spending - previous_avg_aesthetic_spending
-    delta_avg_aesthetic_spending_str = f"{delta_avg_aesthetic_spending:,.2f} €"
-    if comparison_label:
-        delta_avg_aesthetic_spending_str += f" {comparison_label}"
+    with col1:
+        show_metric("Revenue", get_revenue, format_euros, start_date, end_date, *previous_range)
+    with col2:
+        show_metric("New Patients", get_new_patients, str, start_date, end_date, *previous_range)
+    with col3:
+        show_metric("New Appointments", get_new_appointments, str, start_date, end_date, *previous_range)
+    with col4:
+        show_metric("Avg Spending/Patient", get_average_spending_per_patient, format_euros,
+                    start_date, end_date, *previous_range)
 
     # --- Charts ---
     st.subheader("Trends over time")
 
     granularity = get_granularity(start_date, end_date)
 
-    # Revenue Chart
-    revenue_df = get_revenue_by_period(start_date, end_date, granularity)
-    if not revenue_df.empty:
-        st.write(f"### Revenue by {granularity.capitalize()}")
-        st.bar_chart(revenue_df, x='period', y='total_revenue')
-    else:
-        st.info("No revenue data available for the selected period.")
-
-    # New Patients Chart
-    new_patients_df = get_new_patients_by_period(start_date, end_date, granularity)
-    total_patients_df = get_total_patients_by_period(start_date, end_date, granularity)
-
-    if not new_patients_df.empty or not total_patients_df.empty:
-        # Merge the two dataframes
-        patients_df = pd.merge(new_patients_df, total_patients_df, on='period', how='outer').fillna(0)
-        patients_df['patients_excluding_new'] = patients_df['total_patients_count'] - patients_df['new_patients_count']
-        
-        # Ensure the columns for charting are present, even if one is all zeros
-        chart_data = patients_df[['period', 'new_patients_count', 'patients_excluding_new']]
-        
-        st.write(f"### Patients by {granularity.capitalize()}")
-        st.bar_chart(chart_data, x='period', y=['new_patients_count', 'patients_excluding_new'])
-    else:
-        st.info("No patient data available for the selected period.")
-
-    # New Appointments Chart
-    appointments_df = get_new_appointments_by_period(start_date, end_date, granularity)
-    if not appointments_df.empty:
-        st.write(f"### New Appointments by {granularity.capitalize()}")
-        st.bar_chart(appointments_df, x='period', y='new_appointments_count')
-    else:
-        st.info("No new appointments data available for the selected period.")
-
-    # Average Spending per Patient Chart
-    avg_spending_df = get_average_spending_per_patient_by_period(start_date, end_date, granularity)
-    if not avg_spending_df.empty:
-        st.write(f"### Average Spending per Patient by {granularity.capitalize()}")
-        st.bar_chart(avg_spending_df, x='period', y='avg_spending_per_patient')
-    else:
-        st.info("No average spending per patient data available for the selected period.")
-
-    # Treatment Distribution Chart
-    treatment_distribution_df = get_treatment_distribution(start_date, end_date)
-    if not treatment_distribution_df.empty:
-        st.write("### Treatment Distribution")
-        st.bar_chart(treatment_distribution_df, x='Especialidad', y='treatment_count')
-    else:
-        st.info("No treatment data available for the selected period.")
+    show_revenue_chart(start_date, end_date, granularity)
+    show_patients_chart(start_date, end_date, granularity)
+    show_appointments_chart(start_date, end_date, granularity)
+    show_average_spending_chart(start_date, end_date, granularity)
+    show_treatment_distribution_chart(start_date, end_date)
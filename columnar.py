@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import os
+import shutil
+from datetime import date, datetime, time
+from typing import TYPE_CHECKING
+
+import change_log
+import database
+import date_keys
+import name_keys
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Directory holding one Parquet dataset per mirrored table.
+PARQUET_DIR = "output/parquet"
+
+# Tables mirrored to Parquet after each load, with the date column their files are
+# partitioned by (one 'year=YYYY' directory per year). None means a single partition.
+MIRRORED_TABLES = {
+    "cobros": "Fechadecobro",
+    "tratamientos": "Fecharealizado",
+    "citas": "Fecha",
+    "fechas_pacientes": "Fechadealta",
+    "datos_personales": None,
+}
+
+
+def export_table(db_path: str, table_name: str, parquet_dir: str = PARQUET_DIR) -> int:
+    """
+    Writes a table from the SQLite database as a year-partitioned Parquet dataset.
+
+    The dataset is written next to the existing one and renamed into place, so
+    readers never see a half-written mirror.
+
+    :param db_path: The path to the SQLite database file.
+    :param table_name: The table to mirror. Must be one of MIRRORED_TABLES.
+    :param parquet_dir: The directory holding the Parquet datasets.
+    :return: The number of rows written.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partition_column = MIRRORED_TABLES[table_name]
+
+    with database.get_pool(db_path).reader() as conn:
+        declared_types = {row[1]: row[2] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+        df = pd.read_sql_query(f'SELECT * FROM "{table_name}"', conn)
+
+    # The integer date shadows, name keys and row hash only serve SQLite and the loaders; Parquet has native timestamps
+    df = df[[c for c in df.columns if not date_keys.is_shadow_column(c) and not name_keys.is_key_column(c)
+             and not change_log.is_hash_column(c)]]
+
+    if partition_column and partition_column not in df.columns:
+        raise ValueError(f"Table '{table_name}' has no '{partition_column}' column to partition by.")
+
+    for col_name in df.columns:
+        sql_type = declared_types.get(col_name)
+        if sql_type == "DATETIME":
+            df[col_name] = pd.to_datetime(df[col_name], errors='coerce', format='ISO8601')
+        elif df[col_name].dtype == object:
+            # TEXT columns can hold a mix of str and numbers; Arrow needs one type
+            df[col_name] = df[col_name].astype("string")
+
+    partitioning = None
+    if partition_column:
+        df["year"] = df[partition_column].dt.year.astype("Int64")
+        partitioning = ds.partitioning(pa.schema([("year", pa.int64())]), flavor="hive")
+
+    target = os.path.join(parquet_dir, table_name)
+    staging = f"{target}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    ds.write_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        staging,
+        format="parquet",
+        partitioning=partitioning,
+        existing_data_behavior="delete_matching",
+    )
+
+    previous = f"{target}.old"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(target):
+        os.rename(target, previous)
+    os.rename(staging, target)
+    shutil.rmtree(previous, ignore_errors=True)
+
+    print(f"Mirrored {len(df)} rows of '{table_name}' to '{target}'.")
+    return len(df)
+
+
+def read_table(table_name: str, columns: list[str], start_date: date | None = None,
+               end_date: date | None = None, parquet_dir: str = PARQUET_DIR) -> pd.DataFrame | None:
+    """
+    Reads selected columns of a mirrored table, optionally restricted to a date range.
+
+    Only the requested columns are decoded, year partitions outside the range are
+    skipped, and the date filter is pushed down to the Parquet row groups.
+
+    :param table_name: The mirrored table to read.
+    :param columns: The columns to return.
+    :param start_date: The start date (inclusive), or None for no lower bound.
+    :param end_date: The end date (inclusive, whole day), or None for no upper bound.
+    :param parquet_dir: The directory holding the Parquet datasets.
+    :return: A DataFrame, or None if the table has not been mirrored yet.
+    """
+    import pyarrow.dataset as ds
+
+    path = os.path.join(parquet_dir, table_name)
+    if not os.path.isdir(path):
+        return None
+
+    partition_column = MIRRORED_TABLES[table_name]
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+
+    condition = None
+    if partition_column and start_date is not None:
+        start = datetime.combine(start_date, time.min) if not isinstance(start_date, datetime) else start_date
+        condition = (ds.field("year") >= start.year) & (ds.field(partition_column) >= start)
+    if partition_column and end_date is not None:
+        end = datetime.combine(end_date, time.max) if not isinstance(end_date, datetime) else end_date
+        upper = (ds.field("year") <= end.year) & (ds.field(partition_column) <= end)
+        condition = upper if condition is None else condition & upper
+
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
@@ -19,6 +19,9 @@ spanish_months = {
 
 
 def parse_number(value):
+    # Values read from the database are already numbers
+    if isinstance(value, (int, float)):
+        return float(value)
     try:
         return float(value.replace(",", ".")) if value else 0.0
     except ValueError:
@@ -257,32 +260,33 @@ def merge_entries(entries, month_name):
 
     return merged_entries
 
-# Example Usage:
-payments = [
-    {
-        "Fecha": "04/09/24",
-        "Código": "440",
-        "Paciente": "MAYRA  DE BIASE  MONTESERIN",
-        "Tratamiento": "",
-        "Diente": "0",
-        "Descripción": "FERULA PROTECCION DE INJERTO",
-        "Realizado": "0,00",
-        "Cobrado": "70,00",
-        "Seguro": "0,00",
-        "Coste lab.": "0,00",
-        "Coste finan.": "0,00",
-        "Comisión%": "0,00",
-        "Com.": ""
+if __name__ == "__main__":
+    # Example Usage:
+    payments = [
+        {
+            "Fecha": "04/09/24",
+            "Código": "440",
+            "Paciente": "MAYRA  DE BIASE  MONTESERIN",
+            "Tratamiento": "",
+            "Diente": "0",
+            "Descripción": "FERULA PROTECCION DE INJERTO",
+            "Realizado": "0,00",
+            "Cobrado": "70,00",
+            "Seguro": "0,00",
+            "Coste lab.": "0,00",
+            "Coste finan.": "0,00",
+            "Comisión%": "0,00",
+            "Com.": ""
+        }
+    ]
+    doctors_commissions = [
+        {"id": "10", "name": "Macarena Remohi Martínez-Medina", "treatment_type": "dentistry", "commission_type": "regular",
+         "commission": 60},
+        {"id": "10", "name": "Macarena Remohi Martínez-Medina", "treatment_type": "dentistry",
+         "commission_type": "invisalign", "commission": 50},
+    ]
+    patients = {
+        "440": "seguros dentales",
+        "657": "Referido Anna U",
+        "661": "Referido Juan"
     }
-]
-doctors_commissions = [
-    {"id": "10", "name": "Macarena Remohi Martínez-Medina", "treatment_type": "dentistry", "commission_type": "regular",
-     "commission": 60},
-    {"id": "10", "name": "Macarena Remohi Martínez-Medina", "treatment_type": "dentistry",
-     "commission_type": "invisalign", "commission": 50},
-]
-patients = {
-    "440": "seguros dentales",
-    "657": "Referido Anna U",
-    "661": "Referido Juan"
-}
@@ -1,12 +1,21 @@
 import os
-from dotenv import load_dotenv
-
-# Load environment variables from a .env file
-load_dotenv()
+from functools import lru_cache
 
 ENV_SUFFIX = '_GOOGLE_DRIVE_DIR'
 
 
+@lru_cache(maxsize=1)
+def load_environment() -> None:
+    """
+    Loads environment variables from a .env file.
+
+    The .env file is only read the first time this is called, so importing
+    this module does not touch the filesystem.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
 def get_drive_sources() -> dict[str, str]:
     """
     Scans environment variables and returns a dictionary of sources
@@ -17,6 +26,7 @@ def get_drive_sources() -> dict[str, str]:
 
     :return: A dictionary mapping source names to their URLs.
     """
+    load_environment()
     sources = {}
     for key, value in os.environ.items():
         if key.endswith(ENV_SUFFIX):
@@ -25,5 +35,66 @@ def get_drive_sources() -> dict[str, str]:
             sources[name] = value
     return sources
 
-# Load the sources on startup
-DRIVE_SOURCES = get_drive_sources()
+
+def __getattr__(name: str):
+    # DRIVE_SOURCES is resolved on first access instead of on import.
+    if name == 'DRIVE_SOURCES':
+        sources = get_drive_sources()
+        globals()['DRIVE_SOURCES'] = sources
+        return sources
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def profiling_enabled() -> bool:
+    """
+    Tells whether API requests may ask for a sampling profile with ?profile=1.
+
+    Profiling is off unless PROFILE_REQUESTS=1 is set in the environment or the .env file,
+    since a profile replaces the response and reveals the server's code layout.
+
+    :return: True if profiling is allowed.
+    """
+    load_environment()
+    return os.environ.get('PROFILE_REQUESTS') == '1'
+
+
+def dimension_encoding_enabled() -> bool:
+    """
+    Tells whether the loaders store low-cardinality text columns as keys into dimension tables.
+
+    Encoding is off unless ENCODE_DIMENSIONS=1 is set in the environment or the .env file;
+    see dimensions.py.
+
+    :return: True if new and fully reloaded tables are dictionary-encoded.
+    """
+    load_environment()
+    return os.environ.get('ENCODE_DIMENSIONS') == '1'
+
+
+def change_log_days() -> int:
+    """
+    Returns how many days of row changes the change log keeps.
+
+    Set CHANGE_LOG_DAYS in the environment or the .env file to keep more or fewer;
+    older changes are pruned by the post-load maintenance (see change_log.prune).
+
+    :return: The number of days, 30 by default.
+    """
+    load_environment()
+    try:
+        return max(int(os.environ.get('CHANGE_LOG_DAYS', '30')), 0)
+    except ValueError:
+        return 30
+
+
+def dashboard_api_url() -> str:
+    """
+    Returns the base URL of the API the dashboard follows for data version changes.
+
+    Set DASHBOARD_API_URL in the environment or the .env file when the API does not
+    run on this machine's port 8000.
+
+    :return: The URL without a trailing slash, e.g. 'http://localhost:8000'.
+    """
+    load_environment()
+    return os.environ.get('DASHBOARD_API_URL', 'http://localhost:8000').rstrip('/')
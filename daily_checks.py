@@ -5,6 +5,13 @@ from collections import defaultdict
 from datetime import datetime
 from typing import List, Dict, Any
 
+import change_log
+import database
+import date_keys
+import name_keys
+import queries
+import records
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(levelname)s - %(asctime)s - %(module)s - %(funcName)s - %(message)s',
@@ -38,6 +45,14 @@ doctors = {
     "33": "Andrea Vicente Pardo"
 }
 
+# Columns of tratamientos read by check_treatments and check_doctors
+TREATMENT_COLUMNS = ["Fecharealizado", "NumDoctor"]
+
+# Name keys computed at ingest (see name_keys.py): of the patient joined to a treatment,
+# and of an appointment's Paciente
+TREATMENT_NAME_COLUMNS = name_keys.key_columns("NombreCompleto")
+APPOINTMENT_NAME_COLUMNS = name_keys.key_columns("Paciente")
+
 
 def get_data_for_date_range(db_path: str, table_name: str, date_column: str, start_date: datetime,
                             end_date: datetime) -> list[dict]:
@@ -55,36 +70,19 @@ def get_data_for_date_range(db_path: str, table_name: str, date_column: str, sta
     Returns:
         A list of dictionaries, where each dictionary represents a row of data.
     """
-    conn = None
     try:
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row  # This allows accessing columns by name
-        cursor = conn.cursor()
-
-        # Convert datetime objects to ISO format strings for SQLite comparison
-        start_date_str = start_date.isoformat()
-        end_date_str = end_date.isoformat()
-        query = f"SELECT * FROM {table_name} WHERE {date_column} BETWEEN ? AND ?"
-        print(query)
-        # Determine the join key based on the table name
-        join_key = "Código"  # Default join key
-        if table_name == "tratamientos":
-            join_key = "CódigoPaciente"
-            # Construct the query with a LEFT JOIN
-            query = f"""
-                SELECT t.*, dp.Nombre, dp.Apellido1, dp.Apellido2
-                FROM {table_name} t
-                LEFT JOIN datos_personales dp ON t.{join_key} = dp.Código
-                WHERE t.{date_column} BETWEEN ? AND ?
-            """
-
-        cursor.execute(query, (start_date_str, end_date_str))
-
-        rows = cursor.fetchall()
-
-        # Convert sqlite3.Row objects to dictionaries
-        data = [dict(row) for row in rows]
-        return data
+        with database.snapshot_reader(db_path) as conn:
+            # Compare on the integer epoch-second shadow of the date column
+            query_name = queries.rows_in_range(table_name, date_column)
+            rows = queries.fetch_all(conn, query_name, date_keys.range_bounds(start_date, end_date),
+                                     row_factory=sqlite3.Row)
+
+            # Convert sqlite3.Row objects to dictionaries, leaving out the date shadows, name keys and row hash
+            columns = [name for name in rows[0].keys()
+                       if not date_keys.is_shadow_column(name) and not name_keys.is_key_column(name)
+                       and not change_log.is_hash_column(name)] if rows else []
+            data = [{name: row[name] for name in columns} for row in rows]
+            return data
 
     except sqlite3.Error as e:
         print(f"SQLite error in get_data_for_date_range (Table: {table_name}, Column: {date_column}): {e}")
@@ -92,9 +90,46 @@ def get_data_for_date_range(db_path: str, table_name: str, date_column: str, sta
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
+
+
+def get_records_for_date_range(db_path: str, table_name: str, date_column: str, start_date: datetime,
+                               end_date: datetime, columns: list[str] | None = None,
+                               extra: tuple[str, ...] = ()) -> list[records.Record]:
+    """
+    Like get_data_for_date_range, but fetches only the given columns, into compact records.
+
+    Args:
+        db_path: The path to the SQLite database file.
+        table_name: The name of the table to query.
+        date_column: The name of the column containing date information.
+        start_date: The start date (inclusive) for filtering.
+        end_date: The end date (inclusive) for filtering.
+        columns: The columns of the table to fetch; every column but the date shadows and the row hash by default,
+            which includes the name keys the checks match on. Columns the table does not have
+            are left out.
+        extra: Fields the caller fills in afterwards, e.g. 'Fecha_normalizada'.
+
+    Returns:
+        A list of records.Record, which read like the dictionaries of get_data_for_date_range.
+    """
+    try:
+        with database.snapshot_reader(db_path) as conn:
+            existing = [row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')]
+            if columns is None:
+                selected = [name for name in existing
+                            if not date_keys.is_shadow_column(name) and not change_log.is_hash_column(name)]
+            else:
+                selected = [name for name in columns if name in existing]
+            query_name = queries.rows_in_range(table_name, date_column, selected)
+            return queries.fetch_all(conn, query_name, date_keys.range_bounds(start_date, end_date),
+                                     row_factory=records.row_factory(extra))
+
+    except sqlite3.Error as e:
+        print(f"SQLite error in get_records_for_date_range (Table: {table_name}, Column: {date_column}): {e}")
+        return []
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        return []
 
 
 def get_treatments(db_path: str, start_date: datetime,
@@ -110,24 +145,23 @@ def get_treatments(db_path: str, start_date: datetime,
     Returns:
         A list of dictionaries, where each dictionary represents a row of data.
     """
-    conn = None
     try:
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row  # This allows accessing columns by name
-        cursor = conn.cursor()
+        with database.snapshot_reader(db_path) as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row  # This allows accessing columns by name
 
-        # Convert datetime objects to ISO format strings for SQLite comparison
-        start_date_str = start_date.isoformat()
-        end_date_str = end_date.isoformat()
+            # Convert datetime objects to ISO format strings for SQLite comparison
+            start_date_str = start_date.isoformat()
+            end_date_str = end_date.isoformat()
 
-        query = f"SELECT * FROM tratamientos WHERE 'Fecharealizado' BETWEEN ? AND ?"
-        cursor.execute(query, (start_date_str, end_date_str))
-        # Nombre']} {entry['Apellido 1']} {entry['Apellido 2'
-        rows = cursor.fetchall()
+            query = f"SELECT * FROM tratamientos WHERE 'Fecharealizado' BETWEEN ? AND ?"
+            cursor.execute(query, (start_date_str, end_date_str))
+            # Nombre']} {entry['Apellido 1']} {entry['Apellido 2'
+            rows = cursor.fetchall()
 
-        # Convert sqlite3.Row objects to dictionaries
-        data = [dict(row) for row in rows]
-        return data
+            # Convert sqlite3.Row objects to dictionaries
+            data = [dict(row) for row in rows]
+            return data
 
     except sqlite3.Error as e:
         print(f"SQLite error in get_data_for_date_range (Table: {table_name}, Column: {date_column}): {e}")
@@ -135,14 +169,15 @@ def get_treatments(db_path: str, start_date: datetime,
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
 
 def perform_appointment_checks(from_date, to_date):
-    appointments = get_data_for_date_range("output/data.db", "citas", "Fecha", from_date, to_date)
-    treatments = get_data_for_date_range("output/data.db", "tratamientos", "Fecharealizado", from_date, to_date)
+    # Appointments keep every column, as they are returned in the alerts; treatments
+    # only need their date and doctor, plus the patient name from the join
+    appointments = get_records_for_date_range("output/data.db", "citas", "Fecha", from_date, to_date,
+                                              extra=("Fecha_normalizada",))
+    treatments = get_records_for_date_range("output/data.db", "tratamientos", "Fecharealizado", from_date, to_date,
+                                            TREATMENT_COLUMNS, extra=("Fecha_normalizada",))
 
     appointments = [
         appointment for appointment in appointments
@@ -177,6 +212,10 @@ def perform_appointment_checks(from_date, to_date):
         appointments = grouped_appointments.get(date, [])
         treatments = grouped_treatments.get(date, [])
         alerts.extend(perform_checks(appointments, treatments))
+
+    # Hand the appointments out as plain dictionaries without the name keys, ready for the JSON response
+    for alert in alerts:
+        alert["data"] = {key: value for key, value in alert["data"].items() if not name_keys.is_key_column(key)}
     return alerts
 
 
@@ -211,7 +250,44 @@ def check_state(appointments):
 
 def normalize_name(name: str) -> str:
     """Normalize a name by converting to lowercase and removing extra spaces."""
-    return " ".join(name.lower().strip().split())
+    return name_keys.normalize_name(name)
+
+
+def treatment_name_keys(entry) -> tuple[str, str]:
+    """
+    Returns the normalized name and name key of a treatment's patient.
+
+    Both are read from the joined datos_personales row; they are only computed here
+    when the join found no patient, or for entries that do not come from the database.
+    """
+    norm_column, _, key_column = TREATMENT_NAME_COLUMNS
+    if entry.get(norm_column):
+        return entry[norm_column], entry[key_column]
+    # Prioritize name from datos_personales, fallback to original name fields
+    if entry.get('Nombre') and entry.get('Apellido1'):
+        name = f"{entry['Nombre']} {entry['Apellido1']} {entry.get('Apellido2') or ''}".strip()
+    else:
+        # Fallback to the original name fields if the join failed
+        name = f"{entry.get('Nombre', '')} {entry.get('Apellido 1', '')} {entry.get('Apellido 2', '')}".strip()
+    norm, _, key = name_keys.name_values([name])
+    return norm or "", key or ""
+
+
+def appointment_name_keys(appointment) -> tuple[str, str, str]:
+    """
+    Returns the patient name of an appointment as shown in the alerts, normalized, and its name key.
+
+    The normalized name and key of 'Paciente' are read from the columns computed at ingest when present.
+    """
+    if appointment.get('Nombre') and appointment.get('Apellido1'):
+        name = f"{appointment['Nombre']} {appointment['Apellido1']} {appointment.get('Apellido2') or ''}".strip()
+    else:
+        name = appointment['Paciente']
+        norm_column, _, key_column = APPOINTMENT_NAME_COLUMNS
+        if appointment.get(norm_column):
+            return name, appointment[norm_column], appointment[key_column]
+    norm, _, key = name_keys.name_values([name])
+    return name, norm or "", key or ""
 
 
 def generate_suggestions(target_name: str, candidates: List[str]) -> List[str]:
@@ -224,33 +300,27 @@ def check_treatments(appointments: List[Dict[str, Any]], treatments: List[Dict[s
     # print("Checking treatments...")
     alerts = []
 
-    # Build a list of normalized names from cliniwin_treatments
+    # Build the normalized names and name keys of cliniwin_treatments; the sets
+    # answer the exact lookups, the list feeds the suggestions
     cliniwin_names = []
+    cliniwin_keys = set()
     for entry in treatments:
-        # Prioritize name from datos_personales, fallback to original name fields
-        if entry.get('Nombre') and entry.get('Apellido1'):
-            name = f"{entry['Nombre']} {entry['Apellido1']} {entry.get('Apellido2', '')}".strip()
-        else:
-            # Fallback to the original name fields if the join failed
-            name = f"{entry.get('Nombre', '')} {entry.get('Apellido 1', '')} {entry.get('Apellido 2', '')}".strip()
-        cliniwin_names.append(normalize_name(name))
-
+        name, key = treatment_name_keys(entry)
+        cliniwin_names.append(name)
+        if key:
+            cliniwin_keys.add(key)
+    cliniwin_name_set = set(cliniwin_names)
 
     for appointment in appointments:
         # Process only appointments with 'Estado' == 'Visita realizada'
         if appointment['Estado'] != 'Visita realizada':
             continue
 
-        # Prioritize name from datos_personales, fallback to original 'Paciente' field
-        if appointment.get('Nombre') and appointment.get('Apellido1'):
-            patient_name_str = f"{appointment['Nombre']} {appointment['Apellido1']} {appointment.get('Apellido2', '')}".strip()
-        else:
-            patient_name_str = appointment['Paciente']
-
-        patient_name = normalize_name(patient_name_str)
+        patient_name_str, patient_name, patient_key = appointment_name_keys(appointment)
 
-        # Check if the patient is in cliniwin_treatments
-        if patient_name not in cliniwin_names:
+        # Check if the patient is in cliniwin_treatments, also when the names only
+        # differ in accents or word order
+        if patient_name not in cliniwin_name_set and patient_key not in cliniwin_keys:
             suggestions = generate_suggestions(patient_name, cliniwin_names)
             alerts.append({
                 "type": "Tratamiento inexistente",
@@ -276,14 +346,15 @@ def check_doctors(
     # logging.info(f'this is the treatments: {treatments}')
     # logging.info(f'this is the appointments: {appointments}')
 
-    # Create a mapping of normalized names to cliniwin treatments
+    # Create mappings of normalized names and name keys to cliniwin treatments
     cliniwin_mapping = {}
+    cliniwin_key_mapping = {}
     for entry in treatments:
-        if entry.get('Nombre') and entry.get('Apellido1'):
-            name = f"{entry['Nombre']} {entry['Apellido1']} {entry.get('Apellido2', '')}".strip()
-        else:
-            name = f"{entry.get('Nombre', '')} {entry.get('Apellido 1', '')} {entry.get('Apellido 2', '')}".strip()
-        cliniwin_mapping[normalize_name(name)] = entry
+        name, key = treatment_name_keys(entry)
+        cliniwin_mapping[name] = entry
+        if key:
+            cliniwin_key_mapping[key] = entry
+    cliniwin_names = list(cliniwin_mapping.keys())
 
     # logging.info(f'this is the cliniwin mapping: {cliniwin_mapping}')
     for appointment in appointments:
@@ -291,20 +362,18 @@ def check_doctors(
             continue
 
         # Normalize the patient name from Doctoralia
-        if appointment.get('Nombre') and appointment.get('Apellido1'):
-            patient_name_str = f"{appointment['Nombre']} {appointment['Apellido1']} {appointment.get('Apellido2', '')}".strip()
-        else:
-            patient_name_str = appointment['Paciente']
-        patient_name = normalize_name(patient_name_str)
-
-
-        # Find the best match for the patient in Cliniwin
-        matched_name = match_patient_name(patient_name, list(cliniwin_mapping.keys()))
-
-        if not matched_name:
-            continue
+        patient_name_str, patient_name, patient_key = appointment_name_keys(appointment)
 
-        cliniwin_entry = cliniwin_mapping[matched_name]
+        # Find the patient in Cliniwin: by name, by name key, or else by the closest name
+        if patient_name in cliniwin_mapping:
+            cliniwin_entry = cliniwin_mapping[patient_name]
+        elif patient_key in cliniwin_key_mapping:
+            cliniwin_entry = cliniwin_key_mapping[patient_key]
+        else:
+            matched_name = match_patient_name(patient_name, cliniwin_names)
+            if not matched_name:
+                continue
+            cliniwin_entry = cliniwin_mapping[matched_name]
         # Compare doctor numbers
         doctoralia_doctor_name = appointment['Especialista']
         doctoralia_doctor_number = [key for key, value in doctors.items() if value == doctoralia_doctor_name]
@@ -330,49 +399,50 @@ def normalize_date(date_str, input_format, output_format='%d-%m-%Y'):
         return None
 
 
-doctoralia_appointments = [
-    {'Fecha': '11/11/2024', 'Paciente': 'Antón Kolesnik', 'Especialista': 'Anna Pevrukhina',
-     'Servicios': 'Primera visita Odontología', 'Aseguradora': 'Sin aseguradora', 'Precio': '',
-     'Origen de la cita': 'Agenda', 'Estado': 'Visita realizada', 'Creación de la cita': '05/11/2024'},
-    {'Fecha': '11/11/2024', 'Paciente': 'VITALI STEPANENKO', 'Especialista': 'Alejandro Cordero',
-     'Servicios': 'Primera visita Odontología', 'Aseguradora': '', 'Precio': '', 'Origen de la cita': 'Agenda',
-     'Estado': 'Visita realizada', 'Creación de la cita': '21/10/2024'},
-    {'Fecha': '11/11/2024', 'Paciente': 'VITALI STEPANENKO 2', 'Especialista': 'Anna Pevrukhina',
-     'Servicios': 'Primera visita Odontología', 'Aseguradora': '', 'Precio': '', 'Origen de la cita': 'Agenda',
-     'Estado': 'Cancelada', 'Creación de la cita': '21/10/2024'},
-    {'Fecha': '11/11/2024', 'Paciente': 'VITALI STEPANENKO 3', 'Especialista': 'Anna Pevrukhina',
-     'Servicios': 'Primera visita Odontología', 'Aseguradora': '', 'Precio': '', 'Origen de la cita': 'Agenda',
-     'Estado': 'Programada', 'Creación de la cita': '21/10/2024'}
-]
-
-cliniwin_treatments = [
-    {'Fecha realizado': '11/11/24', 'Nombre': 'VITALI', 'Apellido 1': 'STEPANENKO', 'Apellido 2': '', 'Dni': 'Y778163P',
-     'Móvil': '651559048', 'Cómo nos ha conocido': 'Referido Anna U', 'Descripción': 'PRIMERA VISITA ODONTOLOGIA',
-     'Doctor': 'ANNA', 'Coste': '0,00', 'Importe': '0,00', 'Fecha última visita': '11/11/24', 'Fecha próxima cita': '',
-     'Num. Doctor': '15'},
-    {'Fecha realizado': '11/11/24', 'Nombre': 'Vitalii', 'Apellido 1': 'Stepanenko', 'Apellido 2': '',
-     'Dni': 'FY026540', 'Móvil': '', 'Cómo nos ha conocido': 'Referido Anna U', 'Descripción': 'RECONSTRUCCIÓN',
-     'Doctor': 'ANNA', 'Coste': '0,00', 'Importe': '80,00', 'Fecha última visita': '11/11/24', 'Fecha próxima cita': '',
-     'Num. Doctor': '15'},
-    {'Fecha realizado': '11/11/24', 'Nombre': 'BULANY', 'Apellido 1': 'VADYM', 'Apellido 2': '', 'Dni': 'Z0428528C',
-     'Móvil': '', 'Cómo nos ha conocido': 'Referido Anna U', 'Descripción': 'RECONSTRUCCIÓN', 'Doctor': 'ANNA',
-     'Coste': '0,00', 'Importe': '80,00', 'Fecha última visita': '11/11/24', 'Fecha próxima cita': '',
-     'Num. Doctor': '15'},
-    {'Fecha realizado': '11/11/24', 'Nombre': 'LARISA', 'Apellido 1': 'KARIMOVA', 'Apellido 2': '', 'Dni': 'Y778163P',
-     'Móvil': '651559048', 'Cómo nos ha conocido': 'Referido Anna U', 'Descripción': 'PRIMERA VISITA ODONTOLOGIA',
-     'Doctor': 'ANNA', 'Coste': '0,00', 'Importe': '0,00', 'Fecha última visita': '11/11/24', 'Fecha próxima cita': '',
-     'Num. Doctor': '15'},
-    {'Fecha realizado': '11/11/24', 'Nombre': 'Vitalii', 'Apellido 1': 'Stepanenko', 'Apellido 2': '',
-     'Dni': 'FY026540', 'Móvil': '', 'Cómo nos ha conocido': 'Referido Anna U', 'Descripción': 'RECONSTRUCCIÓN',
-     'Doctor': 'ANNA', 'Coste': '0,00', 'Importe': '80,00', 'Fecha última visita': '11/11/24', 'Fecha próxima cita': '',
-     'Num. Doctor': '15'},
-    {'Fecha realizado': '11/11/24', 'Nombre': 'BULANY', 'Apellido 1': 'VADYM', 'Apellido 2': '', 'Dni': 'Z0428528C',
-     'Móvil': '', 'Cómo nos ha conocido': 'Referido Anna U', 'Descripción': 'RECONSTRUCCIÓN', 'Doctor': 'ANNA',
-     'Coste': '0,00', 'Importe': '80,00', 'Fecha última visita': '11/11/24', 'Fecha próxima cita': '',
-     'Num. Doctor': '15'}
-]
-
 if __name__ == "__main__":
+    # Example records, kept here so importing the module stays cheap
+    doctoralia_appointments = [
+        {'Fecha': '11/11/2024', 'Paciente': 'Antón Kolesnik', 'Especialista': 'Anna Pevrukhina',
+         'Servicios': 'Primera visita Odontología', 'Aseguradora': 'Sin aseguradora', 'Precio': '',
+         'Origen de la cita': 'Agenda', 'Estado': 'Visita realizada', 'Creación de la cita': '05/11/2024'},
+        {'Fecha': '11/11/2024', 'Paciente': 'VITALI STEPANENKO', 'Especialista': 'Alejandro Cordero',
+         'Servicios': 'Primera visita Odontología', 'Aseguradora': '', 'Precio': '', 'Origen de la cita': 'Agenda',
+         'Estado': 'Visita realizada', 'Creación de la cita': '21/10/2024'},
+        {'Fecha': '11/11/2024', 'Paciente': 'VITALI STEPANENKO 2', 'Especialista': 'Anna Pevrukhina',
+         'Servicios': 'Primera visita Odontología', 'Aseguradora': '', 'Precio': '', 'Origen de la cita': 'Agenda',
+         'Estado': 'Cancelada', 'Creación de la cita': '21/10/2024'},
+        {'Fecha': '11/11/2024', 'Paciente': 'VITALI STEPANENKO 3', 'Especialista': 'Anna Pevrukhina',
+         'Servicios': 'Primera visita Odontología', 'Aseguradora': '', 'Precio': '', 'Origen de la cita': 'Agenda',
+         'Estado': 'Programada', 'Creación de la cita': '21/10/2024'}
+    ]
+
+    cliniwin_treatments = [
+        {'Fecha realizado': '11/11/24', 'Nombre': 'VITALI', 'Apellido 1': 'STEPANENKO', 'Apellido 2': '', 'Dni': 'Y778163P',
+         'Móvil': '651559048', 'Cómo nos ha conocido': 'Referido Anna U', 'Descripción': 'PRIMERA VISITA ODONTOLOGIA',
+         'Doctor': 'ANNA', 'Coste': '0,00', 'Importe': '0,00', 'Fecha última visita': '11/11/24', 'Fecha próxima cita': '',
+         'Num. Doctor': '15'},
+        {'Fecha realizado': '11/11/24', 'Nombre': 'Vitalii', 'Apellido 1': 'Stepanenko', 'Apellido 2': '',
+         'Dni': 'FY026540', 'Móvil': '', 'Cómo nos ha conocido': 'Referido Anna U', 'Descripción': 'RECONSTRUCCIÓN',
+         'Doctor': 'ANNA', 'Coste': '0,00', 'Importe': '80,00', 'Fecha última visita': '11/11/24', 'Fecha próxima cita': '',
+         'Num. Doctor': '15'},
+        {'Fecha realizado': '11/11/24', 'Nombre': 'BULANY', 'Apellido 1': 'VADYM', 'Apellido 2': '', 'Dni': 'Z0428528C',
+         'Móvil': '', 'Cómo nos ha conocido': 'Referido Anna U', 'Descripción': 'RECONSTRUCCIÓN', 'Doctor': 'ANNA',
+         'Coste': '0,00', 'Importe': '80,00', 'Fecha última visita': '11/11/24', 'Fecha próxima cita': '',
+         'Num. Doctor': '15'},
+        {'Fecha realizado': '11/11/24', 'Nombre': 'LARISA', 'Apellido 1': 'KARIMOVA', 'Apellido 2': '', 'Dni': 'Y778163P',
+         'Móvil': '651559048', 'Cómo nos ha conocido': 'Referido Anna U', 'Descripción': 'PRIMERA VISITA ODONTOLOGIA',
+         'Doctor': 'ANNA', 'Coste': '0,00', 'Importe': '0,00', 'Fecha última visita': '11/11/24', 'Fecha próxima cita': '',
+         'Num. Doctor': '15'},
+        {'Fecha realizado': '11/11/24', 'Nombre': 'Vitalii', 'Apellido 1': 'Stepanenko', 'Apellido 2': '',
+         'Dni': 'FY026540', 'Móvil': '', 'Cómo nos ha conocido': 'Referido Anna U', 'Descripción': 'RECONSTRUCCIÓN',
+         'Doctor': 'ANNA', 'Coste': '0,00', 'Importe': '80,00', 'Fecha última visita': '11/11/24', 'Fecha próxima cita': '',
+         'Num. Doctor': '15'},
+        {'Fecha realizado': '11/11/24', 'Nombre': 'BULANY', 'Apellido 1': 'VADYM', 'Apellido 2': '', 'Dni': 'Z0428528C',
+         'Móvil': '', 'Cómo nos ha conocido': 'Referido Anna U', 'Descripción': 'RECONSTRUCCIÓN', 'Doctor': 'ANNA',
+         'Coste': '0,00', 'Importe': '80,00', 'Fecha última visita': '11/11/24', 'Fecha próxima cita': '',
+         'Num. Doctor': '15'}
+    ]
+
     DB_PATH = "output/data.db"
     # Define your date range (example: entire year 2023)
     start_date = datetime(2026, 1, 1)
@@ -1,21 +1,48 @@
-from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine
-import pandas as pd
+from __future__ import annotations
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from sqlalchemy.engine import Engine
+
+# The SQLite file every loader writes to and every request path reads from.
+DB_PATH = "output/data.db"
+
+# How many read-only connections each pool keeps open.
+READER_POOL_SIZE = 4
+
+# Per-connection cache of prepared statements, keyed by SQL text.
+CACHED_STATEMENTS = 256
 
 # In-memory SQLite database
-# The 'check_same_thread=False' is important for FastAPI usage.
-DATABASE_URL = "sqlite:///:memory:"
+# The engine connects to the current in-memory snapshot of DB_PATH (see refresh_snapshot),
+# so SQLAlchemy and pandas readers share the same hot copy as the request paths.
+DATABASE_URL = "sqlite://"
 
-# The connect_args are necessary to allow the same connection to be used across different threads,
-# which is what happens when a new request comes into a FastAPI application.
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+_engine = None
 
 
 def get_db_engine() -> Engine:
     """
     Returns the shared database engine instance.
+
+    The engine is created on first use so that importing this module does not
+    load SQLAlchemy. Every checkout opens a connection to whichever snapshot is
+    current at that moment, so a swap is picked up by the next query.
     """
-    return engine
+    global _engine
+    if _engine is None:
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import NullPool
+        _engine = create_engine(DATABASE_URL, creator=connect_snapshot, poolclass=NullPool)
+    return _engine
 
 
 def  load_dataframe_to_db(df: pd.DataFrame, table_name: str, engine: Engine):
@@ -35,3 +62,386 @@ def  load_dataframe_to_db(df: pd.DataFrame, table_name: str, engine: Engine):
     except Exception as e:
         print(f"An error occurred while loading data into the database: {e}")
 
+
+class ConnectionPool:
+    """
+    A thread-safe pool of SQLite connections to a single database file.
+
+    There is one writer connection, guarded by a lock so that only one thread
+    writes at a time, and up to `readers` read-only connections that are handed
+    out and returned. The database runs in WAL mode, so readers never block the
+    writer and vice versa. Connections live as long as the pool, which keeps
+    their prepared-statement caches warm between requests.
+    """
+
+    def __init__(self, db_path: str, readers: int = READER_POOL_SIZE,
+                 cached_statements: int = CACHED_STATEMENTS):
+        self.db_path = db_path
+        self.cached_statements = cached_statements
+        self._idle_readers: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._reader_slots = threading.BoundedSemaphore(readers)
+        self._all_readers: list[sqlite3.Connection] = []
+        self._writer: sqlite3.Connection | None = None
+        self._writer_lock = threading.Lock()
+        self._readers_lock = threading.Lock()
+
+    def _connect_writer(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        # Only takes effect on a new file; lets maintenance release free pages incrementally
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _connect_reader(self) -> sqlite3.Connection:
+        # The writer is opened first so the file exists and is switched to WAL.
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect_writer()
+        uri = f"{Path(self.db_path).absolute().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        with self._readers_lock:
+            self._all_readers.append(conn)
+        return conn
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrows a read-only connection, blocking while all of them are in use.
+
+        :return: A context manager yielding an sqlite3 connection.
+        """
+        with self._reader_slots:
+            try:
+                conn = self._idle_readers.get_nowait()
+            except queue.Empty:
+                conn = self._connect_reader()
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle_readers.put(conn)
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """
+        Takes the writer connection for the duration of the block.
+
+        The transaction is committed when the block exits normally and rolled
+        back if it raises.
+
+        :return: A context manager yielding an sqlite3 connection.
+        """
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect_writer()
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def close(self):
+        """
+        Closes every connection held by the pool.
+        """
+        with self._readers_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers.clear()
+            self._idle_readers = queue.LifoQueue()
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str = DB_PATH) -> ConnectionPool:
+    """
+    Returns the process-wide connection pool for a database file, creating it on first use.
+
+    :param db_path: The path to the SQLite database file.
+    :return: The ConnectionPool for that file.
+    """
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(db_path)
+            _pools[key] = pool
+        return pool
+
+
+def close_pools():
+    """
+    Closes every pool and snapshot opened by this process.
+    """
+    with _snapshots_lock:
+        for snapshot in _snapshots.values():
+            snapshot.retire()
+        _snapshots.clear()
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+def bump_data_version(conn: sqlite3.Connection, table_name: str):
+    """
+    Records that a table's contents changed.
+
+    Call this inside the same transaction as the write, so the version and the
+    data become visible together.
+
+    :param conn: The writer connection.
+    :param table_name: The table that was modified.
+    """
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS _data_versions ("
+        "table_name TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at TEXT)"
+    )
+    conn.execute(
+        "INSERT INTO _data_versions (table_name, version, updated_at) VALUES (?, 1, datetime('now')) "
+        "ON CONFLICT(table_name) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at",
+        (table_name,)
+    )
+
+
+def ensure_index(conn: sqlite3.Connection, table_name: str, column: str):
+    """
+    Creates an index on one column of a table unless the table already has one.
+
+    The index is named idx_<table>_<column>. Tables swapped in by a staged load keep
+    the index names they were built with, so when the name is already taken by
+    another table's index a numbered suffix is added.
+
+    :param conn: A writer connection.
+    :param table_name: The table to index.
+    :param column: The column to index.
+    """
+    for index in conn.execute(f'PRAGMA index_list("{table_name}")').fetchall():
+        indexed = [row[2] for row in conn.execute(f'PRAGMA index_info("{index[1]}")')]
+        if indexed == [column]:
+            return
+    base_name = index_name = f"idx_{table_name}_{column}"
+    suffix = 1
+    while conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (index_name,)).fetchone():
+        suffix += 1
+        index_name = f"{base_name}_{suffix}"
+    conn.execute(f'CREATE INDEX "{index_name}" ON "{table_name}" ("{column}")')
+
+
+def get_data_versions(conn: sqlite3.Connection) -> dict[str, int]:
+    """
+    Returns the current data version of every table that has been loaded.
+
+    :param conn: Any connection to the database.
+    :return: A dictionary mapping table names to their version numbers.
+    """
+    try:
+        return dict(conn.execute("SELECT table_name, version FROM _data_versions").fetchall())
+    except sqlite3.OperationalError:
+        # Nothing has been loaded yet
+        return {}
+
+
+class Snapshot:
+    """
+    A read-only, in-memory copy of the database taken at one data version.
+
+    The copy lives in a named shared-cache memory database, so any number of
+    connections can read it. The snapshot keeps one anchor connection open for
+    its whole life; the data is freed once the snapshot is retired and the last
+    reader has handed its connection back.
+
+    A retired snapshot hands out no more connections: connecting to its name
+    once the last connection is closed would open a new, empty database.
+    """
+
+    _counter = 0
+    _counter_lock = threading.Lock()
+
+    def __init__(self, version: int):
+        with Snapshot._counter_lock:
+            Snapshot._counter += 1
+            name = f"snapshot_{os.getpid()}_{Snapshot._counter}"
+        self.version = version
+        self.uri = f"file:{name}?mode=memory&cache=shared"
+        self._anchor = self._connect()
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._retired = False
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.uri, uri=True, check_same_thread=False,
+                               cached_statements=CACHED_STATEMENTS)
+
+    def connect(self) -> sqlite3.Connection | None:
+        """
+        Opens a new connection to the snapshot.
+
+        :return: An sqlite3 connection, or None if the snapshot has been retired.
+        """
+        with self._lock:
+            # Under the lock, so the anchor cannot be closed while the connection opens
+            return None if self._retired else self._connect()
+
+    def borrow(self) -> sqlite3.Connection | None:
+        """
+        Takes an idle connection to the snapshot, or opens one; hand it back with give_back().
+
+        :return: An sqlite3 connection, or None if the snapshot has been retired.
+        """
+        with self._lock:
+            if self._retired:
+                return None
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+
+    def give_back(self, conn: sqlite3.Connection):
+        """
+        Returns a borrowed connection, closing it if the snapshot has been retired meanwhile.
+        """
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if self._retired:
+                conn.close()
+            else:
+                self._idle.put(conn)
+
+    def load_from(self, source: sqlite3.Connection):
+        """
+        Copies the whole source database into the snapshot with the backup API.
+
+        :param source: A connection to the database file.
+        """
+        source.backup(self._anchor)
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrows a connection to the snapshot.
+
+        :return: A context manager yielding an sqlite3 connection.
+        :raises sqlite3.OperationalError: If the snapshot has been retired; use
+            snapshot_reader() to read whichever snapshot is current.
+        """
+        conn = self.borrow()
+        if conn is None:
+            raise sqlite3.OperationalError(f"Snapshot {self.uri} has been retired")
+        try:
+            yield conn
+        finally:
+            self.give_back(conn)
+
+    def retire(self):
+        """
+        Closes the idle connections and the anchor; readers still holding a
+        connection keep the data alive until they return it.
+        """
+        with self._lock:
+            self._retired = True
+            while not self._idle.empty():
+                self._idle.get_nowait().close()
+            self._anchor.close()
+
+
+_snapshots: dict[str, Snapshot] = {}
+_snapshots_lock = threading.Lock()
+
+
+def refresh_snapshot(db_path: str = DB_PATH, force: bool = False) -> bool:
+    """
+    Rebuilds the in-memory snapshot of a database if its data version changed.
+
+    The new copy is built next to the old one and swapped in with a single
+    assignment, so readers see either the old or the new data, never a mix.
+
+    :param db_path: The path to the SQLite database file.
+    :param force: Rebuild even if the data version has not changed.
+    :return: True if a new snapshot was swapped in, False otherwise.
+    """
+    key = os.path.abspath(db_path)
+    with _snapshots_lock:
+        with get_pool(db_path).reader() as source:
+            version = sum(get_data_versions(source).values())
+            current = _snapshots.get(key)
+            if current is not None and current.version == version and not force:
+                return False
+            snapshot = Snapshot(version)
+            try:
+                snapshot.load_from(source)
+            except Exception:
+                snapshot.retire()
+                raise
+        _snapshots[key] = snapshot
+    if current is not None:
+        current.retire()
+    print(f"Swapped in snapshot of '{db_path}' at data version {version}.")
+    return True
+
+
+def get_snapshot(db_path: str = DB_PATH) -> Snapshot:
+    """
+    Returns the current snapshot of a database, taking the first one if needed.
+
+    :param db_path: The path to the SQLite database file.
+    :return: The current Snapshot.
+    """
+    snapshot = _snapshots.get(os.path.abspath(db_path))
+    if snapshot is None:
+        refresh_snapshot(db_path)
+        snapshot = _snapshots[os.path.abspath(db_path)]
+    return snapshot
+
+
+@contextmanager
+def snapshot_reader(db_path: str = DB_PATH) -> Iterator[sqlite3.Connection]:
+    """
+    Borrows a connection to the current in-memory snapshot of a database.
+
+    Reads through this connection never touch the disk and never wait for a
+    running load. The snapshot is refreshed by refresh_snapshot after reloads;
+    a reader keeps the snapshot it borrowed from alive until it is done.
+
+    :param db_path: The path to the SQLite database file.
+    :return: A context manager yielding an sqlite3 connection.
+    """
+    while True:
+        snapshot = get_snapshot(db_path)
+        conn = snapshot.borrow()
+        if conn is not None:
+            break
+        # Retired after it was looked up; the next lookup finds the snapshot that replaced it
+    try:
+        yield conn
+    finally:
+        snapshot.give_back(conn)
+
+
+def connect_snapshot(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """
+    Opens a new connection to the current in-memory snapshot of a database, for the engine.
+
+    :param db_path: The path to the SQLite database file.
+    :return: An sqlite3 connection; closing it is up to the caller.
+    """
+    while True:
+        conn = get_snapshot(db_path).connect()
+        if conn is not None:
+            return conn
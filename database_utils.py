@@ -1,370 +1,788 @@
-import pandas as pd
-import sqlite3
-import numpy as np
-from datetime import datetime
+from __future__ import annotations
+
 import io
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
 
-def parse_html_to_db(file_source, db_name, table_name, file_name="<stream>"):
+import change_log
+import database
+import date_keys
+import dimensions
+import maintenance
+import name_keys
+import partitions
+import queries
+from ingest_trace import IngestTrace, Span
+
+# Worker processes used to parse the files of one source in parallel. Parsing is
+# CPU-bound pandas/lxml work; writing stays on a single connection in this process.
+PARSE_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1))
+
+# A staged load fills "<table>__staging" and swaps it in for the live table, which
+# is renamed to "<table>__retired" and dropped; see load_files
+STAGING_SUFFIX = "__staging"
+RETIRED_SUFFIX = "__retired"
+
+_parse_pool: ProcessPoolExecutor | None = None
+_parse_pool_lock = threading.Lock()
+
+
+@dataclass
+class ParsedFile:
+    """
+    The rows of one export, converted to the types they are stored as, together
+    with the statement that creates their table. Plain Python values only, so a
+    ParsedFile can be sent back from a worker process.
+
+    `timings` holds the seconds spent in each stage: 'read' (HTML/Excel parsing),
+    'infer' (column cleaning and type inference), 'convert' (value coercion) and,
+    once written, 'insert' and 'commit'. `rejected` counts the values that could
+    not be converted to their column's type and are stored as NULL.
+    """
+    table_name: str
+    file_name: str
+    create_table_sql: str
+    insert_verb: str
+    columns: list[str]
+    rows: list[tuple]
+    timings: dict[str, float] = field(default_factory=dict)
+    rejected: int = 0
+
+
+def _is_blank(value) -> bool:
+    # Empty cells can reach the conversion loop as float NaN; they are NULLs, not rejected values
+    return isinstance(value, float) and math.isnan(value)
+
+
+def parse_html(file_source, table_name, file_name="<stream>") -> ParsedFile | None:
     """
     Parses an HTML file (assumed to be an .xls file with HTML content),
-    cleans the data, infers SQL types, creates/updates a table in an SQLite database,
-    and populates it with data.
+    cleans the data, infers SQL types and converts every value, without touching
+    the database.
 
     Assumes:
     - The first data row contains column names.
     - The second data row is meaningless and should be ignored.
     - 'Código' column (if present) is used as a primary key for upsert operations.
-    """
-    try:
-        tables = pd.read_html(file_source)
-        if not tables:
-            print(f"No tables found in the HTML file: {file_name}")
-            return
-
-        df = tables[0]
-        print(df.columns.tolist())
-
-        # Set the first data row as column headers
-        df.columns = df.iloc[0]
-
-        # Drop the original first two rows (header row and meaningless second row)
-        df = df.iloc[2:].reset_index(drop=True)
 
-        # Clean column names for SQL (replace spaces, special chars)
-        original_columns = df.columns.tolist()
-        cleaned_columns = []
-        for col in original_columns:
-            clean_col = "".join(c for c in str(col) if c.isalnum() or c == '_').replace(' ', '_')
-            cleaned_columns.append(clean_col)
-        df.columns = cleaned_columns
+    :return: The parsed rows, or None if the file holds no table.
+    """
+    import numpy as np
+    import pandas as pd
+
+    started = time.perf_counter()
+    tables = pd.read_html(file_source)
+    if not tables:
+        print(f"No tables found in the HTML file: {file_name}")
+        return None
+    read_done = time.perf_counter()
+
+    df = tables[0]
+
+    # Set the first data row as column headers
+    df.columns = df.iloc[0]
+
+    # Drop the original first two rows (header row and meaningless second row)
+    df = df.iloc[2:].reset_index(drop=True)
+
+    # Clean column names for SQL (replace spaces, special chars)
+    original_columns = df.columns.tolist()
+    cleaned_columns = []
+    for col in original_columns:
+        clean_col = "".join(c for c in str(col) if c.isalnum() or c == '_').replace(' ', '_')
+        cleaned_columns.append(clean_col)
+    df.columns = cleaned_columns
+
+    # Filter out columns named "nan"
+    df = df.loc[:, df.columns != 'nan']
+
+    # Specific modification for 'tratamientos' table
+    if table_name == "tratamientos":
+        columns = df.columns.tolist()
+        if "Código" in columns:
+            # Find the first occurrence of "Código" and rename it
+            first_occurrence_index = columns.index("Código")
+            columns[first_occurrence_index] = "CódigoPaciente"
+            df.columns = columns
+            print(f"Renamed first column 'Código' to 'CódigoPaciente' for table '{table_name}'.")
+
+    # Infer SQL types and create CREATE TABLE statement
+    column_defs = []
+
+    if table_name == 'cobros':
+        column_defs.append('"id" INTEGER PRIMARY KEY AUTOINCREMENT')
+
+    # Store inferred types for later use during insertion
+    inferred_sql_types = {}
+
+    for col_name, dtype in df.dtypes.items():
+        sql_type = "TEXT" # Default
+        if table_name == "comisiones" and "Realizado" in col_name or "Cobrado" in col_name or "Seguro" in col_name or "Comisión" in col_name:
+            sql_type = "REAL"
+        elif col_name == 'Código':
+            sql_type = "INTEGER"
+        elif 'Fecha' in col_name:
+            sql_type = "DATETIME"
+        elif "Importe" in col_name or "Saldo" in col_name or "Precio" in col_name or "Coste" in col_name: # Added for Importe/Saldo
+            sql_type = "REAL"
+        elif 'object' in str(dtype):
+            # Try to infer more specific types for object columns
+            # Check if it can be converted to numeric (integer or real)
+            if pd.to_numeric(df[col_name], errors='coerce').notna().all():
+                # Check if all are integers
+                if (pd.to_numeric(df[col_name], errors='coerce') % 1 == 0).all():
+                    sql_type = "INTEGER"
+                else:
+                    sql_type = "REAL"
+            # Check if it can be converted to datetime
+            elif pd.to_datetime(df[col_name], errors='coerce').notna().all():
+                sql_type = "DATETIME"
+        elif 'int' in str(dtype):
+            sql_type = "INTEGER"
+        elif 'float' in str(dtype):
+            sql_type = "REAL"
+        elif 'datetime' in str(dtype):
+            sql_type = "DATETIME"
+
+        inferred_sql_types[col_name] = sql_type
+        col_def = f'"{col_name}" {sql_type}'
+        if col_name == 'Código' and table_name != 'cobros':
+            col_def += " PRIMARY KEY"
+        column_defs.append(col_def)
+
+    create_table_sql = f'CREATE TABLE IF NOT EXISTS {table_name} ({", ".join(column_defs)})'
+
+    inferred = time.perf_counter()
+
+    # Replace NaN with None for SQL NULL values
+    df = df.replace({np.nan: None})
+
+    # Rows whose key already exists are replaced, so the last file loaded wins
+    insert_verb = 'INSERT' if table_name == 'cobros' else 'INSERT OR REPLACE'
+
+    # Convert every value to the type it will be stored as; values that cannot be
+    # converted are stored as NULL and counted as rejected
+    rows = []
+    rejected = 0
+    for index, row in df.iterrows():
+        values = []
+        for col_name, value in row.items():
+            # print(f'{col_name} = {value}')
+            sql_type = inferred_sql_types.get(col_name, "TEXT") # Get inferred type
+
+            if value is None:
+                values.append(None)
+            elif sql_type == "INTEGER":
+                try:
+                    values.append(int(value))
+                except (ValueError, TypeError):
+                    values.append(None)
+                    if not _is_blank(value):
+                        rejected += 1
+            elif sql_type == "REAL":
+                if isinstance(value, str):
+                    if value.lower() == 'nan': # Handle "nan" string
+                        values.append(None)
+                    else:
+                        try:
+                            # Replace comma with dot for decimal conversion
+                            cleaned_value = value.replace(',', '.')
+                            converted_value = float(cleaned_value)
+                            # Divide by 100 if the value is an integer and implies cents
+                            # This assumes the input is always an integer string representing cents
+                            # e.g., "1234" means 12.34
+                            if converted_value == int(converted_value): # Check if it's an integer float
+                                converted_value /= 100.0
+                            # print(converted_value)
+                            # values.append(converted_value)
+                            # print("{:.2f}".format(converted_value))
+                            values.append("{:.2f}".format(converted_value))
+                        except (ValueError, TypeError):
+                            values.append(None)
+                            if not _is_blank(value):
+                                rejected += 1
+                else: # Not a string, try direct conversion
+                    try:
+                        converted_value = float(value)
+                        if converted_value == int(converted_value): # Check if it's an integer float
+                            converted_value /= 100.0
+                        values.append("{:.2f}".format(converted_value))
+                    except (ValueError, TypeError):
+                        values.append(None)
+                        if not _is_blank(value):
+                            rejected += 1
+            elif sql_type == "DATETIME":
+                try:
+                    # Attempt to parse common date formats
+                    if isinstance(value, str):
+                        # Try dd/mm/yy first, then other common formats
+                        try:
+                            dt_obj = datetime.strptime(value, '%d/%m/%y')
+                        except ValueError:
+                            dt_obj = pd.to_datetime(value, dayfirst=True) # Let pandas handle other formats
+                        values.append(dt_obj.isoformat())
+                    else:
+                        values.append(pd.to_datetime(value, dayfirst=True).isoformat())
+                except (ValueError, TypeError):
+                    values.append(None)
+                    if not _is_blank(value):
+                        rejected += 1
+            else: # TEXT or other unhandled types
+                values.append(str(value))
+        rows.append(tuple(values))
 
-        # Filter out columns named "nan"
-        df = df.loc[:, df.columns != 'nan']
+    timings = {"read": read_done - started, "infer": inferred - read_done, "convert": time.perf_counter() - inferred}
+    return ParsedFile(table_name, file_name, create_table_sql, insert_verb, df.columns.tolist(), rows, timings,
+                      rejected)
 
-        # Specific modification for 'tratamientos' table
-        if table_name == "tratamientos":
-            columns = df.columns.tolist()
-            if "Código" in columns:
-                # Find the first occurrence of "Código" and rename it
-                first_occurrence_index = columns.index("Código")
-                columns[first_occurrence_index] = "CódigoPaciente"
-                df.columns = columns
-                print(f"Renamed first column 'Código' to 'CódigoPaciente' for table '{table_name}'.")
 
+def parse_xlsx(file_stream, table_name, file_name="<stream>") -> ParsedFile:
+    """
+    Parses an XLSX file, cleans the data, infers SQL types and converts every
+    value, without touching the database.
 
-        # Connect to SQLite database
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
+    Assumes:
+    - The first row of the XLSX file contains column names.
+    - 'Código' column (if present) is used as a primary key for upsert operations.
 
-        try:
-            # Infer SQL types and create CREATE TABLE statement
-            column_defs = []
-            
-            if table_name == 'cobros':
-                column_defs.append('"id" INTEGER PRIMARY KEY AUTOINCREMENT')
-
-            # Store inferred types for later use during insertion
-            inferred_sql_types = {}
-
-            for col_name, dtype in df.dtypes.items():
-                sql_type = "TEXT" # Default
-                if table_name == "comisiones" and "Realizado" in col_name or "Cobrado" in col_name or "Seguro" in col_name or "Comisión" in col_name:
-                    sql_type = "REAL"
-                elif col_name == 'Código':
-                    sql_type = "INTEGER"
-                elif 'Fecha' in col_name:
-                    sql_type = "DATETIME"
-                elif "Importe" in col_name or "Saldo" in col_name or "Precio" in col_name or "Coste" in col_name: # Added for Importe/Saldo
-                    sql_type = "REAL"
-                elif 'object' in str(dtype):
-                    # Try to infer more specific types for object columns
-                    # Check if it can be converted to numeric (integer or real)
-                    if pd.to_numeric(df[col_name], errors='coerce').notna().all():
-                        # Check if all are integers
-                        if (pd.to_numeric(df[col_name], errors='coerce') % 1 == 0).all():
-                            sql_type = "INTEGER"
-                        else:
-                            sql_type = "REAL"
-                    # Check if it can be converted to datetime
-                    elif pd.to_datetime(df[col_name], errors='coerce').notna().all():
-                        sql_type = "DATETIME"
-                elif 'int' in str(dtype):
+    :return: The parsed rows.
+    """
+    import numpy as np
+    import pandas as pd
+
+    started = time.perf_counter()
+    # Read the XLSX file directly from the seekable stream; wrapping its bytes in
+    # another BytesIO would hold a second full copy of the file in memory
+    df = pd.read_excel(file_stream)
+    read_done = time.perf_counter()
+    # Clean column names for SQL (replace spaces, special chars)
+    original_columns = df.columns.tolist()
+    cleaned_columns = []
+    for col in original_columns:
+        clean_col = "".join(c for c in str(col) if c.isalnum() or c == '_').replace(' ', '_')
+        cleaned_columns.append(clean_col)
+    df.columns = cleaned_columns
+
+    # Filter out columns named "nan" (can happen if there are empty columns in Excel)
+    df = df.loc[:, df.columns != 'nan']
+
+    # Infer SQL types and create CREATE TABLE statement
+    column_defs = []
+    if table_name == 'cobros':
+        column_defs.append('"id" INTEGER PRIMARY KEY AUTOINCREMENT')
+
+    # Store inferred types for later use during insertion
+    inferred_sql_types = {}
+
+    for col_name, dtype in df.dtypes.items():
+        sql_type = "TEXT" # Default
+        if col_name == 'Código':
+            sql_type = "INTEGER"
+        elif 'Fecha' in col_name:
+            sql_type = "DATETIME"
+        elif "Importe" in col_name or "Saldo" in col_name or "Precio" in col_name or "Coste" in col_name:
+            sql_type = "REAL"
+        elif 'object' in str(dtype):
+            # Try to infer more specific types for object columns
+            # Check if it can be converted to numeric (integer or real)
+            if pd.to_numeric(df[col_name], errors='coerce').notna().all():
+                # Check if all are integers
+                if (pd.to_numeric(df[col_name], errors='coerce') % 1 == 0).all():
                     sql_type = "INTEGER"
-                elif 'float' in str(dtype):
+                else:
                     sql_type = "REAL"
-                elif 'datetime' in str(dtype):
-                    sql_type = "DATETIME"
-
-                inferred_sql_types[col_name] = sql_type
-                col_def = f'"{col_name}" {sql_type}'
-                if col_name == 'Código' and table_name != 'cobros':
-                    col_def += " PRIMARY KEY"
-                column_defs.append(col_def)
-
-            create_table_sql = f'CREATE TABLE IF NOT EXISTS {table_name} ({", ".join(column_defs)})'
-            # print(f"Created table sql '{create_table_sql}'")
-            cursor.execute(create_table_sql)
-
-            # Replace NaN with None for SQL NULL values
-            df = df.replace({np.nan: None})
-
-            # Prepare for insertion (INSERT OR REPLACE for upsert)
-            cols = ', '.join([f'"{c}"' for c in df.columns])
-            placeholders = ', '.join(['?' for _ in df.columns])
-            
-            if table_name == 'cobros':
-                insert_sql = f'INSERT INTO {table_name} ({cols}) VALUES ({placeholders})'
-            else:
-                insert_sql = f'INSERT OR REPLACE INTO {table_name} ({cols}) VALUES ({placeholders})'
-
-            # Iterate and insert/update data with type conversion
-            for index, row in df.iterrows():
-                values = []
-                for col_name, value in row.items():
-                    # print(f'{col_name} = {value}')
-                    sql_type = inferred_sql_types.get(col_name, "TEXT") # Get inferred type
-
-                    if value is None:
+            # Check if it can be converted to datetime
+            # elif pd.to_datetime(df[col_name], errors='coerce', dayfirst=True).notna().all():
+
+            # Check if it can be converted to datetime
+            elif pd.to_datetime(df[col_name], errors='coerce', dayfirst=True).notna().all():
+                sql_type = "DATETIME"
+        elif 'int' in str(dtype):
+            sql_type = "INTEGER"
+        elif 'float' in str(dtype):
+            sql_type = "REAL"
+        elif 'datetime' in str(dtype):
+            sql_type = "DATETIME"
+
+        inferred_sql_types[col_name] = sql_type
+        col_def = f'"{col_name}" {sql_type}'
+        if col_name == 'Código' and table_name != 'cobros' and table_name != 'citas':
+            col_def += " PRIMARY KEY"
+        column_defs.append(col_def)
+
+    column_definitions_str = ", ".join(column_defs)
+
+    if table_name == 'citas':
+        create_table_sql = f'CREATE TABLE IF NOT EXISTS {table_name} ({column_definitions_str}, PRIMARY KEY ("Fecha", "Hora", "Paciente"))'
+    else:
+        create_table_sql = f'CREATE TABLE IF NOT EXISTS {table_name} ({column_definitions_str})'
+
+    inferred = time.perf_counter()
+
+    # Replace NaN with None for SQL NULL values
+    df = df.replace({np.nan: None})
+
+    # Rows whose key already exists are replaced, so the last file loaded wins
+    insert_verb = 'INSERT' if table_name == 'cobros' else 'INSERT OR REPLACE'
+
+    # Convert every value to the type it will be stored as; values that cannot be
+    # converted are stored as NULL and counted as rejected
+    rows = []
+    rejected = 0
+    for index, row in df.iterrows():
+        values = []
+        for col_name, value in row.items():
+            sql_type = inferred_sql_types.get(col_name, "TEXT")
+
+            if value is None:
+                values.append(None)
+            elif sql_type == "INTEGER":
+                try:
+                    values.append(int(value))
+                except (ValueError, TypeError):
+                    values.append(None)
+                    if not _is_blank(value):
+                        rejected += 1
+            elif sql_type == "REAL":
+                if isinstance(value, str):
+                    if value.lower() == 'nan':
                         values.append(None)
-                    elif sql_type == "INTEGER":
+                    else:
                         try:
-                            values.append(int(value))
+                            # Replace comma with dot for decimal conversion
+                            cleaned_value = value.replace(',', '.')
+                            converted_value = float(cleaned_value)
+                            # NOTE: This specific conversion (dividing by 100) is carried over
+                            # from parse_html_to_db. It assumes that integer-like float strings
+                            # represent cents and need to be converted to euros/dollars.
+                            # If 'citas' data does not follow this pattern, this logic might need adjustment.
+                            if converted_value == int(converted_value):
+                                converted_value /= 100.0
+                            values.append("{:.2f}".format(converted_value))
                         except (ValueError, TypeError):
                             values.append(None)
-                    elif sql_type == "REAL":
-                        if isinstance(value, str):
-                            if value.lower() == 'nan': # Handle "nan" string
-                                values.append(None)
-                            else:
-                                try:
-                                    # Replace comma with dot for decimal conversion
-                                    cleaned_value = value.replace(',', '.')
-                                    converted_value = float(cleaned_value)
-                                    # Divide by 100 if the value is an integer and implies cents
-                                    # This assumes the input is always an integer string representing cents
-                                    # e.g., "1234" means 12.34
-                                    if converted_value == int(converted_value): # Check if it's an integer float
-                                        converted_value /= 100.0
-                                    # print(converted_value)
-                                    # values.append(converted_value)
-                                    # print("{:.2f}".format(converted_value))
-                                    values.append("{:.2f}".format(converted_value))
-                                except (ValueError, TypeError):
-                                    values.append(None)
-                        else: # Not a string, try direct conversion
+                            if not _is_blank(value):
+                                rejected += 1
+                else:
+                    try:
+                        converted_value = float(value)
+                        if converted_value == int(converted_value):
+                            converted_value /= 100.0
+                        values.append("{:.2f}".format(converted_value))
+                    except (ValueError, TypeError):
+                        values.append(None)
+                        if not _is_blank(value):
+                            rejected += 1
+            elif sql_type == "DATETIME":
+                try:
+
+                    if isinstance(value, str):
+                        # Attempt to parse common date formats
+                        # Prioritize explicit formats to avoid inference issues
+                        common_date_formats = ['%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d', '%Y-%m-%d', '%d/%m/%y', '%d-%m-%y']
+                        parsed = False
+                        for fmt in common_date_formats:
                             try:
-                                converted_value = float(value)
-                                if converted_value == int(converted_value): # Check if it's an integer float
-                                    converted_value /= 100.0
-                                values.append("{:.2f}".format(converted_value))
-                            except (ValueError, TypeError):
-                                values.append(None)
-                    elif sql_type == "DATETIME":
-                        try:
-                            # Attempt to parse common date formats
-                            if isinstance(value, str):
-                                # Try dd/mm/yy first, then other common formats
-                                try:
-                                    dt_obj = datetime.strptime(value, '%d/%m/%y')
-                                except ValueError:
-                                    dt_obj = pd.to_datetime(value, dayfirst=True) # Let pandas handle other formats
+                                dt_obj = datetime.strptime(value, fmt)
+                                values.append(dt_obj.isoformat())
+                                parsed = True
+                                break
+                            except ValueError:
+                                continue
+                        if not parsed:
+                            # Fallback to pandas' robust parser if explicit formats fail
+                            dt_obj = pd.to_datetime(value, dayfirst=True, errors='coerce')
+                            if pd.notna(dt_obj):
                                 values.append(dt_obj.isoformat())
                             else:
-                                values.append(pd.to_datetime(value, dayfirst=True).isoformat())
-                        except (ValueError, TypeError):
+                                values.append(None)
+                                if not _is_blank(value):
+                                    rejected += 1
+                    else:
+                        dt_obj = pd.to_datetime(value, dayfirst=True, errors='coerce')
+                        if pd.notna(dt_obj):
+                            values.append(dt_obj.isoformat())
+                        else:
                             values.append(None)
-                    else: # TEXT or other unhandled types
-                        values.append(str(value))
-                # print(f"{values}")
-                cursor.execute(insert_sql, tuple(values))
+                            if not _is_blank(value):
+                                rejected += 1
+                except (ValueError, TypeError):
+                    values.append(None)
+                    if not _is_blank(value):
+                        rejected += 1
+            else:
+                values.append(str(value))
+        rows.append(tuple(values))
+
+    timings = {"read": read_done - started, "infer": inferred - read_done, "convert": time.perf_counter() - inferred}
+    return ParsedFile(table_name, file_name, create_table_sql, insert_verb, df.columns.tolist(), rows, timings,
+                      rejected)
+
+
+def write_parsed(parsed: ParsedFile, db_name, into: str | None = None):
+    """
+    Creates the table of a parsed file if needed and inserts its rows, in one transaction.
 
-            conn.commit()
+    Rows are inserted with INSERT OR REPLACE (plain INSERT for 'cobros'), so
+    writing files in createdTime order lets the newest file win. The time taken
+    is recorded as parsed.timings['insert'] and parsed.timings['commit'].
 
-            print(f"Successfully parsed '{file_name}' and populated table '{table_name}' in '{db_name}'.")
+    :param into: Write into this table instead of the parsed file's own, e.g. a staging
+        table. Its date shadows and name keys are left unindexed and no change is logged
+        nor data version bumped.
 
+    Rows that are already stored unchanged, e.g. by an earlier file, are not written
+    again, and when nothing changed the data version is left as it was; see change_log.py.
+
+    With dictionary encoding (see dimensions.py), the rows of an encoded table are
+    written to its storage table with their dimension keys. The rows of a partitioned
+    table (see partitions.py) are written to its current partition, except for those
+    of a table without a key dated in a closed year, which are skipped.
+    """
+    started = time.perf_counter()
+
+    # Borrow the shared writer connection; the block commits on success
+    with database.get_pool(db_name).writer() as conn:
+        # The rows go to the staging table, to "<table>__data" behind the view of an encoded table,
+        # or to the current partition of a partitioned one
+        partitioned = partitions.is_partitioned(conn, parsed.table_name)
+        if partitioned:
+            table_name, encoded = into or partitions.current_partition(parsed.table_name), False
+        else:
+            table_name, encoded = dimensions.write_target(conn, parsed.table_name, into)
+        if encoded:
+            conn.execute(dimensions.storage_sql(parsed.create_table_sql, table_name))
+        else:
+            conn.execute(parsed.create_table_sql.replace(f" {parsed.table_name} (", f' "{table_name}" (', 1))
+        rows = parsed.rows
+        # Closed years of a partitioned table without a key are read-only
+        writable = partitions.frozen_filter(conn, parsed.table_name, parsed.columns)
+        if writable is not None:
+            rows = [row for row in rows if writable(row)]
+
+        # Every row carries a hash of its content, and only rows that are new or changed are
+        # written; those written to the live table are logged (see change_log.py)
+        change_log.ensure_hash_column(conn, table_name)
+        # Rows of a partitioned table may already be stored in a closed year
+        compare_with = parsed.table_name if partitioned and into is None else None
+        rows, changes = change_log.select_changes(conn, table_name, parsed.columns, rows, compare_with)
+        if encoded:
+            rows = dimensions.encode_rows(conn, table_name, parsed.columns, rows)
+
+        # Keep integer shadows of every date column for range filters and period bucketing
+        table_date_columns = date_keys.ensure_shadow_columns(conn, table_name, create_indexes=into is None)
+        shadowed_columns = [c for c in parsed.columns if c in table_date_columns]
+        shadow_positions = [parsed.columns.index(c) for c in shadowed_columns]
+
+        insert_columns = (parsed.columns + [change_log.ROW_HASH_COLUMN]
+                          + [s for c in shadowed_columns for s in date_keys.shadow_columns(c)])
+
+        # And the normalized, accent-folded and keyed forms of the patient name, if the table has one
+        name_positions = []
+        name_source = name_keys.NAME_SOURCES.get(parsed.table_name)
+        if name_source and all(c in parsed.columns for c in name_source[1]):
+            name, sources = name_source
+            name_keys.ensure_name_columns(conn, table_name, name, sources, create_indexes=into is None)
+            name_positions = [parsed.columns.index(c) for c in sources]
+            insert_columns += list(name_keys.key_columns(name))
+
+        cols = ', '.join([f'"{c}"' for c in insert_columns])
+        placeholders = ', '.join(['?' for _ in insert_columns])
+        insert_sql = f'{parsed.insert_verb} INTO "{table_name}" ({cols}) VALUES ({placeholders})'
+
+        conn.executemany(insert_sql, (
+            row + tuple(v for position in shadow_positions for v in date_keys.shadow_values(row[position]))
+            + (name_keys.name_values([row[position] for position in name_positions]) if name_positions else ())
+            for row in rows
+        ))
+
+        if into is None:
+            if encoded:
+                dimensions.sync_view(conn, parsed.table_name, table_name)
+            if partitioned:
+                partitions.freeze_years(conn, parsed.table_name)
+            if changes:
+                change_log.log_changes(conn, parsed.table_name, changes)
+                database.bump_data_version(conn, parsed.table_name)
+            maintenance.record_changes(conn, table_name, len(rows))
+        inserted = time.perf_counter()
+
+    parsed.timings["insert"] = inserted - started
+    parsed.timings["commit"] = time.perf_counter() - inserted
+    queries.add_db_time(time.perf_counter() - started)
+
+
+def drop_staging_tables(db_name, table_name):
+    """
+    Drops the staging and retired tables of a table, e.g. left behind by an interrupted load.
+    """
+    with database.get_pool(db_name).writer() as conn:
+        conn.execute(f'DROP TABLE IF EXISTS "{table_name}{STAGING_SUFFIX}"')
+        conn.execute(f'DROP TABLE IF EXISTS "{table_name}{RETIRED_SUFFIX}"')
+
+
+def swap_staging_table(db_name, table_name) -> dict[str, float]:
+    """
+    Indexes and analyzes a filled staging table, then swaps it in for the live table.
+
+    The indexes and planner statistics are built while no reader can see the
+    staging table. The swap itself is two renames in one short transaction, so
+    readers of the live table see either all of the old rows or all of the new
+    ones, and writers wait for milliseconds rather than for the whole load. The
+    replaced table is dropped afterwards, in its own transaction. A dictionary-encoded
+    staging table takes the place of the storage table behind the table's view
+    (see dimensions.py), and the staging table of a partitioned table the place of
+    its current partition (see partitions.py). The rows the reload inserts, changes
+    and removes are logged in the swap's transaction (see change_log.py).
+
+    :param db_name: The path to the SQLite database file.
+    :param table_name: The live table.
+    :return: The seconds spent in each step: 'index', 'analyze', 'swap' and 'drop'.
+    """
+    staging_name = table_name + STAGING_SUFFIX
+    retired_name = table_name + RETIRED_SUFFIX
+    pool = database.get_pool(db_name)
+    timings = {}
+
+    started = time.perf_counter()
+    with pool.writer() as conn:
+        date_keys.ensure_shadow_columns(conn, staging_name)
+        change_log.ensure_hash_column(conn, staging_name)
+        if table_name in name_keys.NAME_SOURCES:
+            name_keys.ensure_name_columns(conn, staging_name, *name_keys.NAME_SOURCES[table_name])
+    timings["index"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with pool.writer() as conn:
+        conn.execute(f'ANALYZE "{staging_name}"')
+    timings["analyze"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with pool.writer() as conn:
+        # Views keep referring to the live name instead of following it to the retired table
+        conn.execute("PRAGMA legacy_alter_table = ON")
+        try:
+            # DDL does not open a transaction by itself; both renames must commit together
+            conn.execute("BEGIN IMMEDIATE")
+            # An encoded staging table becomes the storage table behind the view; see dimensions.py.
+            # A partitioned table keeps its view and closed years, and only its current partition is replaced
+            partitioned = partitions.is_partitioned(conn, table_name)
+            if partitioned:
+                live_storage = storage_name = partitions.current_partition(table_name)
+                encoded = False
+            else:
+                live_storage = dimensions.storage_table(conn, table_name)
+                encoded = bool(dimensions.encoded_columns(conn, staging_name))
+                storage_name = table_name + dimensions.DATA_SUFFIX if encoded else table_name
+            # Log what the reload changed while the replaced rows are still there to compare with
+            change_log.log_reload(conn, table_name, live_storage, staging_name,
+                                  table_name if partitioned else None)
+            if live_storage != table_name and not partitioned:
+                conn.execute(f'DROP VIEW "{table_name}"')
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                            (live_storage,)).fetchone():
+                conn.execute(f'ALTER TABLE "{live_storage}" RENAME TO "{retired_name}"')
+            conn.execute(f'ALTER TABLE "{staging_name}" RENAME TO "{storage_name}"')
+            if encoded:
+                dimensions.sync_view(conn, table_name, storage_name)
+            if partitioned:
+                partitions.freeze_years(conn, table_name)
+            # Renaming leaves the statistics under the old table names
+            conn.execute("DELETE FROM sqlite_stat1 WHERE tbl IN (?, ?)", (table_name, storage_name))
+            conn.execute("UPDATE sqlite_stat1 SET tbl = ? WHERE tbl = ?", (storage_name, staging_name))
+            database.bump_data_version(conn, table_name)
+            maintenance.mark_analyzed(conn, storage_name)
         finally:
-            conn.close()
+            conn.execute("PRAGMA legacy_alter_table = OFF")
+    timings["swap"] = time.perf_counter() - started
 
-    except FileNotFoundError:
-        print(f"Error: The file '{file_name}' was not found.")
-    except Exception as e:
-        print(f"An error occurred while parsing the HTML file or interacting with the database: {e}")
+    started = time.perf_counter()
+    with pool.writer() as conn:
+        conn.execute(f'DROP TABLE IF EXISTS "{retired_name}"')
+    timings["drop"] = time.perf_counter() - started
 
+    queries.add_db_time(sum(timings.values()))
+    return timings
 
-def parse_xlsx_to_db(file_stream, db_name, table_name, file_name="<stream>"):
+
+def parser_for(source_name):
     """
-    Parses an XLSX file, cleans the data, infers SQL types, creates/updates a table
-    in an SQLite database, and populates it with data.
+    Returns the parse function used for a source's exports.
 
-    Assumes:
-    - The first row of the XLSX file contains column names.
-    - 'Código' column (if present) is used as a primary key for upsert operations.
+    Doctoralia appointments and the doctors list are real XLSX files; every other
+    source is exported as HTML with an .xls extension.
     """
-    try:
-        # Read the XLSX file directly from the byte stream
-        # file_stream.read() returns bytes, io.BytesIO wraps it into a file-like object
-        df = pd.read_excel(io.BytesIO(file_stream.read()))
-        # Clean column names for SQL (replace spaces, special chars)
-        original_columns = df.columns.tolist()
-        cleaned_columns = []
-        for col in original_columns:
-            clean_col = "".join(c for c in str(col) if c.isalnum() or c == '_').replace(' ', '_')
-            cleaned_columns.append(clean_col)
-        df.columns = cleaned_columns
-
-        # Filter out columns named "nan" (can happen if there are empty columns in Excel)
-        df = df.loc[:, df.columns != 'nan']
-
-        # Connect to SQLite database
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
+    if source_name == "citas" or source_name == "doctores":
+        return parse_xlsx
+    return parse_html # Default parser
 
-        try:
-            # Infer SQL types and create CREATE TABLE statement
-            column_defs = []
-            if table_name == 'cobros':
-                column_defs.append('"id" INTEGER PRIMARY KEY AUTOINCREMENT')
 
-            # Store inferred types for later use during insertion
-            inferred_sql_types = {}
+def get_parse_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process pool that parses files, starting it on first use.
 
-            for col_name, dtype in df.dtypes.items():
-                sql_type = "TEXT" # Default
-                if col_name == 'Código':
-                    sql_type = "INTEGER"
-                elif 'Fecha' in col_name:
-                    sql_type = "DATETIME"
-                elif "Importe" in col_name or "Saldo" in col_name or "Precio" in col_name or "Coste" in col_name:
-                    sql_type = "REAL"
-                elif 'object' in str(dtype):
-                    # Try to infer more specific types for object columns
-                    # Check if it can be converted to numeric (integer or real)
-                    if pd.to_numeric(df[col_name], errors='coerce').notna().all():
-                        # Check if all are integers
-                        if (pd.to_numeric(df[col_name], errors='coerce') % 1 == 0).all():
-                            sql_type = "INTEGER"
-                        else:
-                            sql_type = "REAL"
-                    # Check if it can be converted to datetime
-                    # elif pd.to_datetime(df[col_name], errors='coerce', dayfirst=True).notna().all():
-
-                    # Check if it can be converted to datetime
-                    elif pd.to_datetime(df[col_name], errors='coerce', dayfirst=True).notna().all():
-                        sql_type = "DATETIME"
-                elif 'int' in str(dtype):
-                    sql_type = "INTEGER"
-                elif 'float' in str(dtype):
-                    sql_type = "REAL"
-                elif 'datetime' in str(dtype):
-                    sql_type = "DATETIME"
+    Workers are spawned rather than forked, so they do not inherit this process's
+    threads and open SQLite connections.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS,
+                                              mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
 
-                inferred_sql_types[col_name] = sql_type
-                col_def = f'"{col_name}" {sql_type}'
-                if col_name == 'Código' and table_name != 'cobros' and table_name != 'citas':
-                    col_def += " PRIMARY KEY"
-                column_defs.append(col_def)
 
-            column_definitions_str = ", ".join(column_defs)
+def shutdown_parse_pool():
+    """
+    Stops the parse worker processes.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown()
+            _parse_pool = None
 
-            if table_name == 'citas':
-                create_table_sql = f'CREATE TABLE IF NOT EXISTS {table_name} ({column_definitions_str}, PRIMARY KEY ("Fecha", "Hora", "Paciente"))'
-            else:
-                create_table_sql = f'CREATE TABLE IF NOT EXISTS {table_name} ({column_definitions_str})'
 
-            # print(f"Created table sql '{create_table_sql}'")
-            cursor.execute(create_table_sql)
+def _parse_file(parse_func, file_source, table_name, file_name) -> ParsedFile | None:
+    # file_source is a path or the raw bytes, as open streams cannot be sent to a worker
+    if isinstance(file_source, (bytes, bytearray)):
+        return parse_func(io.BytesIO(file_source), table_name, file_name)
+    with open(file_source, 'rb') as f:
+        return parse_func(f, table_name, file_name)
 
-            # Replace NaN with None for SQL NULL values
-            df = df.replace({np.nan: None})
 
-            # Prepare for insertion (INSERT OR REPLACE for upsert)
-            cols = ', '.join([f'"{c}"' for c in df.columns])
-            placeholders = ', '.join(['?' for _ in df.columns])
-            if table_name == 'cobros':
-                insert_sql = f'INSERT INTO {table_name} ({cols}) VALUES ({placeholders})'
-            else:
-                insert_sql = f'INSERT OR REPLACE INTO {table_name} ({cols}) VALUES ({placeholders})'
+def _parse_now(parse_func, file_source, table_name, file_name) -> Future:
+    # Parses in this process, returning a finished Future like the pool would
+    future = Future()
+    try:
+        future.set_result(_parse_file(parse_func, file_source, table_name, file_name))
+    except Exception as e:
+        future.set_exception(e)
+    return future
 
-            # Iterate and insert/update data with type conversion
-            for index, row in df.iterrows():
-                values = []
-                for col_name, value in row.items():
-                    sql_type = inferred_sql_types.get(col_name, "TEXT")
 
-                    if value is None:
-                        values.append(None)
-                    elif sql_type == "INTEGER":
-                        try:
-                            values.append(int(value))
-                        except (ValueError, TypeError):
-                            values.append(None)
-                    elif sql_type == "REAL":
-                        if isinstance(value, str):
-                            if value.lower() == 'nan':
-                                values.append(None)
-                            else:
-                                try:
-                                    # Replace comma with dot for decimal conversion
-                                    cleaned_value = value.replace(',', '.')
-                                    converted_value = float(cleaned_value)
-                                    # NOTE: This specific conversion (dividing by 100) is carried over
-                                    # from parse_html_to_db. It assumes that integer-like float strings
-                                    # represent cents and need to be converted to euros/dollars.
-                                    # If 'citas' data does not follow this pattern, this logic might need adjustment.
-                                    if converted_value == int(converted_value):
-                                        converted_value /= 100.0
-                                    values.append("{:.2f}".format(converted_value))
-                                except (ValueError, TypeError):
-                                    values.append(None)
-                        else:
-                            try:
-                                converted_value = float(value)
-                                if converted_value == int(converted_value):
-                                    converted_value /= 100.0
-                                values.append("{:.2f}".format(converted_value))
-                            except (ValueError, TypeError):
-                                values.append(None)
-                    elif sql_type == "DATETIME":
-                        try:
+def _source_size(file_source) -> int | None:
+    if isinstance(file_source, (bytes, bytearray)):
+        return len(file_source)
+    try:
+        return os.path.getsize(file_source)
+    except OSError:
+        return None
 
-                            if isinstance(value, str):
-                                # Attempt to parse common date formats
-                                # Prioritize explicit formats to avoid inference issues
-                                common_date_formats = ['%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d', '%Y-%m-%d', '%d/%m/%y', '%d-%m-%y']
-                                parsed = False
-                                for fmt in common_date_formats:
-                                    try:
-                                        dt_obj = datetime.strptime(value, fmt)
-                                        values.append(dt_obj.isoformat())
-                                        parsed = True
-                                        break
-                                    except ValueError:
-                                        continue
-                                if not parsed:
-                                    # Fallback to pandas' robust parser if explicit formats fail
-                                    dt_obj = pd.to_datetime(value, dayfirst=True, errors='coerce')
-                                    if pd.notna(dt_obj):
-                                        values.append(dt_obj.isoformat())
-                                    else:
-                                        values.append(None)
-                            else:
-                                dt_obj = pd.to_datetime(value, dayfirst=True, errors='coerce')
-                                if pd.notna(dt_obj):
-                                    values.append(dt_obj.isoformat())
-                                else:
-                                    values.append(None)
-                        except (ValueError, TypeError):
-                            values.append(None)
-                    else:
-                        values.append(str(value))
-                cursor.execute(insert_sql, tuple(values))
 
-            conn.commit()
+def load_files(files, db_name, table_name, parse_func, trace: IngestTrace | None = None,
+               staged: bool = False) -> int:
+    """
+    Parses several files of one source in parallel and writes them to the database in order.
+
+    Each file is parsed in a worker process while the files before it are being
+    written, but rows are always written file by file in the order given, so with
+    files sorted by createdTime the newest file wins, as with sequential loading.
+    A single file is parsed in this process.
+
+    A staged load replaces the table with the rows of these files alone: they are
+    written to "<table>__staging", which is swapped in by swap_staging_table once
+    every file is in. Readers keep seeing the previous table until then. If any
+    file fails, the staging table is dropped and the live table is left as it was.
+
+    :param files: A list of (path or bytes, file name) tuples, oldest first.
+    :param db_name: The path to the SQLite database file.
+    :param table_name: The table to load into.
+    :param parse_func: parse_html or parse_xlsx.
+    :param trace: Optional IngestTrace that receives the parse and write spans of every file.
+    :param staged: True to replace the table through a staging table, for full reloads.
+    :return: The number of files written to the live table.
+    """
+    if len(files) <= 1 or PARSE_WORKERS <= 1:
+        futures = [_parse_now(parse_func, file_source, table_name, file_name) for file_source, file_name in files]
+    else:
+        pool = get_parse_pool()
+        futures = [pool.submit(_parse_file, parse_func, file_source, table_name, file_name)
+                   for file_source, file_name in files]
+
+    into = None
+    if staged:
+        drop_staging_tables(db_name, table_name)
+        into = table_name + STAGING_SUFFIX
+
+    written = 0
+    failed = 0
+    for (file_source, file_name), future in zip(files, futures):
+        try:
+            parsed = future.result()
+            if parsed is None:
+                continue
+            write_parsed(parsed, db_name, into)
+            written += 1
+            if trace is not None:
+                trace.add_parsed(parsed, _source_size(file_source))
+            print(f"Successfully parsed '{file_name}' and populated table '{into or table_name}' in '{db_name}'.")
+        except Exception as e:
+            failed += 1
+            if trace is not None:
+                trace.add(Span(table_name, "load", file_name, error=str(e)))
+            print(f"An error occurred while parsing '{file_name}' or interacting with the database: {e}")
+
+    if not staged:
+        return written
+    if not written or failed:
+        drop_staging_tables(db_name, table_name)
+        reason = f"{failed} of {len(files)} files could not be loaded" if failed else "no file had any rows"
+        print(f"Kept the current '{table_name}' table: {reason}.")
+        return 0
+    try:
+        timings = swap_staging_table(db_name, table_name)
+    except Exception as e:
+        drop_staging_tables(db_name, table_name)
+        if trace is not None:
+            trace.add(Span(table_name, "swap", error=str(e)))
+        print(f"Could not swap in the new '{table_name}' table: {e}")
+        return 0
+    if trace is not None:
+        for stage, seconds in timings.items():
+            trace.add(Span(table_name, stage, seconds=seconds))
+    print(f"Swapped in the new '{table_name}' table in {timings['swap'] * 1000:.1f} ms.")
+    return written
+
 
-            print(f"Successfully parsed '{file_name}' and populated table '{table_name}' in '{db_name}'.")
+def parse_html_to_db(file_source, db_name, table_name, file_name="<stream>"):
+    """
+    Parses an HTML file (assumed to be an .xls file with HTML content),
+    cleans the data, infers SQL types, creates/updates a table in an SQLite database,
+    and populates it with data.
 
-        finally:
-            conn.close()
+    See parse_html for the assumptions on the file layout.
+    """
+    try:
+        parsed = parse_html(file_source, table_name, file_name)
+        if parsed is None:
+            return
+        write_parsed(parsed, db_name)
+        print(f"Successfully parsed '{file_name}' and populated table '{table_name}' in '{db_name}'.")
+
+    except FileNotFoundError:
+        print(f"Error: The file '{file_name}' was not found.")
+    except Exception as e:
+        print(f"An error occurred while parsing the HTML file or interacting with the database: {e}")
+
+
+def parse_xlsx_to_db(file_stream, db_name, table_name, file_name="<stream>"):
+    """
+    Parses an XLSX file, cleans the data, infers SQL types, creates/updates a table
+    in an SQLite database, and populates it with data.
+
+    See parse_xlsx for the assumptions on the file layout.
+    """
+    try:
+        parsed = parse_xlsx(file_stream, table_name, file_name)
+        write_parsed(parsed, db_name)
+        print(f"Successfully parsed '{file_name}' and populated table '{table_name}' in '{db_name}'.")
 
     except Exception as e:
         print(f"An error occurred while parsing the XLSX file or interacting with the database: {e}")
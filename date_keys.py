@@ -0,0 +1,162 @@
+import calendar
+import sqlite3
+from datetime import date, datetime, time, timedelta
+
+import database
+
+# Every DATETIME column gets two integer shadow columns, filled at ingest time:
+#   "<column>__ts"    seconds since 1970-01-01 (indexed, used for range predicates)
+#   "<column>__month" months since year 0, i.e. year * 12 + month - 1 (used for bucketing)
+# Day buckets are "<column>__ts" / 86400 and year buckets are "<column>__month" / 12,
+# so neither filtering nor grouping has to parse the ISO text again.
+TS_SUFFIX = "__ts"
+MONTH_SUFFIX = "__month"
+
+SECONDS_PER_DAY = 86400
+EPOCH = date(1970, 1, 1)
+
+
+def is_shadow_column(column: str) -> bool:
+    """
+    Tells whether a column is one of the integer date shadows.
+
+    :param column: The column name.
+    :return: True for '<column>__ts' and '<column>__month' columns.
+    """
+    return column.endswith(TS_SUFFIX) or column.endswith(MONTH_SUFFIX)
+
+
+def shadow_columns(column: str) -> tuple[str, str]:
+    """
+    Returns the names of the shadow columns of a date column.
+
+    :param column: The DATETIME column name.
+    :return: A tuple (epoch-seconds column, month-key column).
+    """
+    return f"{column}{TS_SUFFIX}", f"{column}{MONTH_SUFFIX}"
+
+
+def to_epoch_seconds(value: datetime) -> int:
+    """
+    Converts a naive datetime to seconds since the epoch, treating it as UTC like SQLite does.
+    """
+    return calendar.timegm(value.timetuple())
+
+
+def shadow_values(iso_value: str | None) -> tuple[int | None, int | None]:
+    """
+    Computes the shadow values for a date stored as an ISO string.
+
+    :param iso_value: The value written to the DATETIME column, or None.
+    :return: A tuple (epoch seconds, month key), or (None, None) if there is no date.
+    """
+    if not iso_value:
+        return None, None
+    try:
+        value = datetime.fromisoformat(iso_value)
+    except ValueError:
+        return None, None
+    return to_epoch_seconds(value), value.year * 12 + value.month - 1
+
+
+def ensure_shadow_columns(conn: sqlite3.Connection, table_name: str, create_indexes: bool = True) -> list[str]:
+    """
+    Adds, backfills and indexes the shadow columns of every DATETIME column in a table.
+
+    Columns and indexes that already exist are left alone, so this is cheap to call
+    on every load.
+
+    :param conn: A writer connection.
+    :param table_name: The table to migrate.
+    :param create_indexes: False to leave the indexes out, e.g. while a staging table
+        is being filled; calling this again later adds them.
+    :return: The DATETIME columns of the table, in table order.
+    """
+    table_info = conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()
+    existing = {row[1] for row in table_info}
+    date_columns = [row[1] for row in table_info if row[2] == "DATETIME"]
+
+    for column in date_columns:
+        ts_column, month_column = shadow_columns(column)
+        if ts_column not in existing or month_column not in existing:
+            if ts_column not in existing:
+                conn.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{ts_column}" INTEGER')
+            if month_column not in existing:
+                conn.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{month_column}" INTEGER')
+            # Rows loaded before the shadows existed are converted once, in SQL
+            conn.execute(
+                f'UPDATE "{table_name}" SET '
+                f'"{ts_column}" = CAST(strftime(\'%s\', "{column}") AS INTEGER), '
+                f'"{month_column}" = CAST(strftime(\'%Y\', "{column}") AS INTEGER) * 12 '
+                f'+ CAST(strftime(\'%m\', "{column}") AS INTEGER) - 1 '
+                f'WHERE "{column}" IS NOT NULL'
+            )
+        if create_indexes:
+            database.ensure_index(conn, table_name, ts_column)
+    return date_columns
+
+
+def migrate_database(conn: sqlite3.Connection):
+    """
+    Runs ensure_shadow_columns over every user table in the database.
+
+    :param conn: A writer connection.
+    """
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name NOT LIKE '\\_%' ESCAPE '\\'"
+    )]
+    for table_name in tables:
+        ensure_shadow_columns(conn, table_name)
+
+
+def range_bounds(start: date | datetime, end: date | datetime) -> tuple[int, int]:
+    """
+    Translates an inclusive date range into epoch-second bounds for a BETWEEN predicate.
+
+    A plain date as the end of the range covers that whole day.
+
+    :param start: The start date or datetime (inclusive).
+    :param end: The end date or datetime (inclusive).
+    :return: A tuple (lower bound, upper bound) in epoch seconds.
+    """
+    if not isinstance(start, datetime):
+        start = datetime.combine(start, time.min)
+    if not isinstance(end, datetime):
+        end = datetime.combine(end, time.max)
+    return to_epoch_seconds(start), to_epoch_seconds(end)
+
+
+def period_key_sql(column: str, granularity: str) -> str:
+    """
+    Returns an integer SQL expression that buckets a date column by day, month or year.
+
+    :param column: The DATETIME column name (optionally prefixed by a table alias).
+    :param granularity: 'day', 'month' or 'year'.
+    :return: The SQL expression.
+    """
+    prefix, _, name = column.rpartition(".")
+    prefix = f"{prefix}." if prefix else ""
+    ts_column, month_column = shadow_columns(name)
+    if granularity == "day":
+        return f'{prefix}"{ts_column}" / {SECONDS_PER_DAY}'
+    elif granularity == "month":
+        return f'{prefix}"{month_column}"'
+    else:  # year
+        return f'{prefix}"{month_column}" / 12'
+
+
+def period_label(key: int, granularity: str) -> str:
+    """
+    Turns a bucket produced by period_key_sql back into the label shown on charts.
+
+    :param key: The integer bucket.
+    :param granularity: 'day', 'month' or 'year'.
+    :return: 'YYYY-MM-DD', 'YYYY-MM' or 'YYYY'.
+    """
+    key = int(key)
+    if granularity == "day":
+        return (EPOCH + timedelta(days=key)).isoformat()
+    elif granularity == "month":
+        return f"{key // 12:04d}-{key % 12 + 1:02d}"
+    else:  # year
+        return f"{key:04d}"
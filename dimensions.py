@@ -0,0 +1,298 @@
+"""
+Optional dictionary encoding of low-cardinality text columns.
+
+Columns such as Estado or Especialidad repeat a handful of strings in every row.
+With ENCODE_DIMENSIONS=1 (see config.dimension_encoding_enabled), the loaders
+store each of ENCODED_COLUMNS as an integer key into a dimension table
+"_dim_<column>" (id, value), shared by every table that has the column:
+
+    "<table>__data"   the rows, with integer keys in the encoded columns
+    "<table>"         a view joining the keys back to their values, with the
+                      columns, names and order of the plain table
+
+Readers keep querying "<table>" unchanged, while the rows and the indexes on them
+hold small integers. The loaders write to the storage table (storage_table) and
+keep the view in step with its columns (sync_view). Tables become encoded when
+they are created or fully reloaded with the option on; encode_table converts an
+existing table in place. A full reload with the option off turns a table back
+into a plain one.
+
+An encoded column is declared as 'INTEGER REFERENCES "_dim_<column>" (id)', so
+encoded_columns() can tell the encoding of a table from its schema alone, also
+after renames.
+
+Usage:
+    python dimensions.py [table ...]    # encode these tables, or every encodable one
+"""
+from __future__ import annotations
+
+import argparse
+import re
+import sqlite3
+from typing import Iterable, Sequence
+
+import config
+import database
+
+# Text columns with few distinct values, stored as integer keys when encoding is on
+ENCODED_COLUMNS = ("Especialidad", "Estado", "Especialista", "Doctor", "Aseguradora",
+                   "Origendelacita", "Cómonoshaconocido")
+
+# An encoded table keeps its rows in "<table>__data" behind a view named "<table>"
+DATA_SUFFIX = "__data"
+
+DIMENSION_PREFIX = "_dim_"
+
+
+def dimension_table(column: str) -> str:
+    """
+    Returns the dimension table of an encoded column, e.g. '_dim_Estado'.
+    """
+    return f"{DIMENSION_PREFIX}{column}"
+
+
+def _object_type(conn: sqlite3.Connection, name: str) -> str | None:
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def is_encoded(conn: sqlite3.Connection, table_name: str) -> bool:
+    """
+    Tells whether a table is stored dictionary-encoded, i.e. is a view over "<table>__data".
+    """
+    return _object_type(conn, table_name) == "view" and _object_type(conn, table_name + DATA_SUFFIX) == "table"
+
+
+def storage_table(conn: sqlite3.Connection, table_name: str) -> str:
+    """
+    Returns the table that holds the rows of a table: "<table>__data" if it is encoded, else the table itself.
+
+    Schema changes (new columns, indexes) and writes go to the storage table.
+    """
+    return table_name + DATA_SUFFIX if is_encoded(conn, table_name) else table_name
+
+
+def write_target(conn: sqlite3.Connection, table_name: str, into: str | None = None) -> tuple[str, bool]:
+    """
+    Returns the table a load writes its rows to, and whether that table is encoded.
+
+    A staging table is encoded when the option is on. Otherwise rows go to the
+    storage table of an encoded table, and a table that does not exist yet is
+    created encoded when the option is on; an existing plain table stays plain
+    until its next full reload or encode_table.
+
+    :param conn: A writer connection.
+    :param table_name: The table being loaded.
+    :param into: The staging table of a full reload, if any.
+    :return: A tuple (table to create and write, encoded).
+    """
+    if into is not None:
+        return into, config.dimension_encoding_enabled()
+    if is_encoded(conn, table_name):
+        return table_name + DATA_SUFFIX, True
+    if _object_type(conn, table_name) is None and config.dimension_encoding_enabled():
+        return table_name + DATA_SUFFIX, True
+    return table_name, False
+
+
+def encoded_columns(conn: sqlite3.Connection, storage_name: str) -> list[str]:
+    """
+    Returns the encoded columns of a storage table, from its references to dimension tables.
+    """
+    return [row[3] for row in conn.execute(f'PRAGMA foreign_key_list("{storage_name}")')
+            if row[2].startswith(DIMENSION_PREFIX)]
+
+
+def _encodable_columns(create_table_sql: str) -> list[str]:
+    return [column for column in ENCODED_COLUMNS
+            if re.search(rf'"{re.escape(column)}" TEXT(?=\s*[,)])', create_table_sql)]
+
+
+def storage_sql(create_table_sql: str, storage_name: str) -> str:
+    """
+    Rewrites a CREATE TABLE statement into the one of an encoded storage table.
+
+    The TEXT columns of ENCODED_COLUMNS become integer references to their dimension
+    tables; every other column is kept as declared.
+
+    :param create_table_sql: The statement of the plain table, e.g. ParsedFile.create_table_sql
+        or the 'sql' of the table in sqlite_master.
+    :param storage_name: The name of the table to create, e.g. 'citas__data' or a staging table.
+    :return: A CREATE TABLE IF NOT EXISTS statement.
+    """
+    columns_sql = create_table_sql[create_table_sql.index("("):]
+    for column in _encodable_columns(columns_sql):
+        columns_sql = re.sub(rf'"{re.escape(column)}" TEXT(?=\s*[,)])',
+                             f'"{column}" INTEGER REFERENCES "{dimension_table(column)}" (id)', columns_sql)
+    return f'CREATE TABLE IF NOT EXISTS "{storage_name}" {columns_sql}'
+
+
+def ensure_dimension_tables(conn: sqlite3.Connection, columns: Iterable[str]):
+    """
+    Creates the dimension tables of encoded columns that do not have one yet.
+    """
+    for column in columns:
+        conn.execute(f'CREATE TABLE IF NOT EXISTS "{dimension_table(column)}" '
+                     "(id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)")
+
+
+def _dimension_keys(conn: sqlite3.Connection, column: str, values: set) -> dict:
+    # Adds the values not seen yet and returns the key of every value
+    table = dimension_table(column)
+    conn.executemany(f'INSERT OR IGNORE INTO "{table}" (value) VALUES (?)', ((value,) for value in values))
+    keys = {}
+    values = list(values)
+    # Looked up in chunks, to stay below SQLite's limit on bound parameters
+    for start in range(0, len(values), 500):
+        chunk = values[start:start + 500]
+        placeholders = ", ".join("?" for _ in chunk)
+        keys.update(conn.execute(f'SELECT value, id FROM "{table}" WHERE value IN ({placeholders})', chunk))
+    return keys
+
+
+def encode_rows(conn: sqlite3.Connection, storage_name: str, columns: Sequence[str],
+                rows: Sequence[tuple]) -> Sequence[tuple]:
+    """
+    Replaces the values of the encoded columns of rows by their dimension keys, adding new values.
+
+    :param conn: A writer connection.
+    :param storage_name: The storage table the rows are written to.
+    :param columns: The columns of the row tuples, in order.
+    :param rows: The row tuples to write.
+    :return: The rows to insert; the input itself if the table has no encoded columns.
+    """
+    encoded = set(encoded_columns(conn, storage_name))
+    positions = [(position, column) for position, column in enumerate(columns) if column in encoded]
+    if not positions:
+        return rows
+    ensure_dimension_tables(conn, encoded)
+
+    keys = {}
+    for position, column in positions:
+        values = {row[position] for row in rows if row[position] is not None}
+        keys[position] = _dimension_keys(conn, column, {str(value) for value in values})
+
+    encoded_rows = []
+    for row in rows:
+        row = list(row)
+        for position, _ in positions:
+            if row[position] is not None:
+                row[position] = keys[position][str(row[position])]
+        encoded_rows.append(tuple(row))
+    return encoded_rows
+
+
+def sync_view(conn: sqlite3.Connection, table_name: str, storage_name: str | None = None):
+    """
+    Creates or recreates the view of an encoded table when its storage table's columns changed.
+
+    :param conn: A writer connection.
+    :param table_name: The table the view is named after, e.g. 'citas'.
+    :param storage_name: Its storage table; "<table>__data" by default.
+    """
+    storage_name = storage_name or table_name + DATA_SUFFIX
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{storage_name}")')]
+    if _object_type(conn, table_name) == "view":
+        if [row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')] == columns:
+            return
+        conn.execute(f'DROP VIEW "{table_name}"')
+
+    select_list = decoded_select(conn, storage_name)
+    conn.execute(f'CREATE VIEW "{table_name}" AS SELECT {", ".join(select_list)} FROM "{storage_name}" t')
+
+
+def decoded_select(conn: sqlite3.Connection, storage_name: str) -> list[str]:
+    """
+    Returns the select list that reads the rows of a storage table with their values instead of their keys.
+
+    :param conn: A connection to the database.
+    :param storage_name: The storage table, aliased as 't' in the query the list is used in.
+    :return: One expression per column of the storage table, in table order.
+    """
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{storage_name}")')]
+    encoded = set(encoded_columns(conn, storage_name))
+    ensure_dimension_tables(conn, encoded)
+    # A subquery per column, rather than a join, is only evaluated when a query reads the column
+    return [
+        f'(SELECT value FROM "{dimension_table(column)}" WHERE id = t."{column}") AS "{column}"'
+        if column in encoded else f't."{column}"'
+        for column in columns
+    ]
+
+
+def migrate_database(conn: sqlite3.Connection):
+    """
+    Recreates the views of encoded tables whose storage tables gained columns, e.g. date shadows.
+
+    Run it after the other migrations.
+
+    :param conn: A writer connection.
+    """
+    storage_tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+                      if row[0].endswith(DATA_SUFFIX)]
+    for storage_name in storage_tables:
+        table_name = storage_name[:-len(DATA_SUFFIX)]
+        if _object_type(conn, table_name) in (None, "view"):
+            sync_view(conn, table_name, storage_name)
+
+
+def encode_table(db_path: str, table_name: str) -> bool:
+    """
+    Converts a plain table into an encoded one, in one transaction.
+
+    The rows are copied into "<table>__data" with their values replaced by keys, the
+    plain table is dropped and the view takes its name. Its indexes are recreated on
+    the storage table.
+
+    :param db_path: The path to the SQLite database file.
+    :param table_name: The table to convert.
+    :return: False if the table is missing, already encoded, or has no column to encode.
+    """
+    with database.get_pool(db_path).writer() as conn:
+        row = conn.execute("SELECT type, sql FROM sqlite_master WHERE name = ?", (table_name,)).fetchone()
+        if row is None or row[0] != "table" or not _encodable_columns(row[1]):
+            return False
+        storage_name = table_name + DATA_SUFFIX
+        columns = [info[1] for info in conn.execute(f'PRAGMA table_info("{table_name}")')]
+        indexes = conn.execute(
+            "SELECT il.name, ii.name FROM pragma_index_list(?) il JOIN pragma_index_info(il.name) ii "
+            "WHERE il.origin = 'c'", (table_name,)).fetchall()
+
+        # DDL does not open a transaction by itself; the copy and the swap must commit together
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(f'DROP TABLE IF EXISTS "{storage_name}"')
+        conn.execute(storage_sql(row[1], storage_name))
+        encoded = encoded_columns(conn, storage_name)
+        ensure_dimension_tables(conn, encoded)
+        for column in encoded:
+            conn.execute(f'INSERT OR IGNORE INTO "{dimension_table(column)}" (value) '
+                         f'SELECT DISTINCT "{column}" FROM "{table_name}" WHERE "{column}" IS NOT NULL')
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        keys = ", ".join(
+            f'(SELECT id FROM "{dimension_table(column)}" WHERE value = t."{column}")' if column in encoded
+            else f't."{column}"' for column in columns)
+        conn.execute(f'INSERT INTO "{storage_name}" ({column_list}) SELECT {keys} FROM "{table_name}" t')
+        conn.execute(f'DROP TABLE "{table_name}"')
+        for index_name, column in indexes:
+            conn.execute(f'CREATE INDEX "{index_name}" ON "{storage_name}" ("{column}")')
+        sync_view(conn, table_name, storage_name)
+        database.bump_data_version(conn, table_name)
+    print(f"Encoded {', '.join(encoded)} of '{table_name}' into dimension tables.")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("tables", nargs="*", help="tables to encode; every table with an encodable column by default")
+    parser.add_argument("--db", default=database.DB_PATH, help="the SQLite database file")
+    args = parser.parse_args()
+
+    tables = args.tables
+    if not tables:
+        with database.get_pool(args.db).reader() as conn:
+            tables = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+                "AND name NOT LIKE '\\_%' ESCAPE '\\'")]
+    for table in tables:
+        encode_table(args.db, table)
+    database.close_pools()
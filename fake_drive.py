@@ -0,0 +1,175 @@
+"""
+A local stand-in for the Google Drive v3 service, backed by a directory.
+
+Every sub-directory of the root is a Drive folder whose ID is the directory name,
+and every file inside it is a Drive file. The subset of the API used by gdrive is
+implemented, with paging, so the loaders can be exercised without network access
+or credentials:
+
+    service = FakeDriveService("drive_root", max_page_size=2)
+    files = gdrive.list_files_in_folder(service, "cobros")
+    stream = gdrive.get_file_as_stream(service, files[0])
+
+    token = gdrive.get_start_page_token(service)
+    service.add_file("cobros", "Cobros-2026.xls", data)
+    changed, removed, token = gdrive.list_changes(service, token)
+"""
+import os
+import re
+from datetime import datetime, timezone
+
+import gdrive
+
+_EXTENSION_MIME_TYPES = {
+    '.xlsx': gdrive.MIME_TYPES['excel'],
+    '.xls': gdrive.MIME_TYPES['excel_legacy'],
+}
+
+
+class _Request:
+    def __init__(self, result: dict):
+        self._result = result
+
+    def execute(self) -> dict:
+        return self._result
+
+
+class _Response(dict):
+    def __init__(self, status: int, headers: dict):
+        super().__init__(headers)
+        self.status = status
+
+
+class _FakeHttp:
+    """Serves byte ranges of one file the way MediaIoBaseDownload requests them."""
+
+    def __init__(self, path: str):
+        self._path = path
+
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        size = os.path.getsize(self._path)
+        match = re.match(r'bytes=(\d+)-(\d+)', (headers or {}).get('range', ''))
+        start, end = (int(match.group(1)), int(match.group(2))) if match else (0, size - 1)
+        if size == 0:
+            return _Response(416, {'content-range': 'bytes */0'}), b''
+        end = min(end, size - 1)
+        with open(self._path, 'rb') as f:
+            f.seek(start)
+            content = f.read(end - start + 1)
+        return _Response(206, {'content-range': f'bytes {start}-{end}/{size}'}), content
+
+
+class _MediaRequest:
+    def __init__(self, file_id: str, path: str):
+        self.uri = f"fake-drive://{file_id}"
+        self.headers = {}
+        self.http = _FakeHttp(path)
+
+
+class _Files:
+    def __init__(self, service: "FakeDriveService"):
+        self._service = service
+
+    def list(self, q: str, pageSize: int = 100, pageToken: str | None = None, **kwargs) -> _Request:
+        folder_id = re.search(r"'([^']+)' in parents", q).group(1)
+        files = sorted(self._service.folder_files(folder_id), key=lambda f: f['createdTime'])
+        return _Request(self._service.page(files, 'files', pageSize, pageToken))
+
+    def get_media(self, fileId: str) -> _MediaRequest:
+        return _MediaRequest(fileId, self._service.path_of(fileId))
+
+    def export_media(self, fileId: str, mimeType: str) -> _MediaRequest:
+        return _MediaRequest(fileId, self._service.path_of(fileId))
+
+
+class _Changes:
+    def __init__(self, service: "FakeDriveService"):
+        self._service = service
+
+    def getStartPageToken(self) -> _Request:
+        return _Request({'startPageToken': str(len(self._service.changes_log))})
+
+    def list(self, pageToken: str, pageSize: int = 100, **kwargs) -> _Request:
+        start = int(pageToken)
+        size = min(pageSize, self._service.max_page_size)
+        changes = self._service.changes_log[start:start + size]
+        result = {'changes': changes}
+        if start + size < len(self._service.changes_log):
+            result['nextPageToken'] = str(start + size)
+        else:
+            result['newStartPageToken'] = str(len(self._service.changes_log))
+        return _Request(result)
+
+
+class FakeDriveService:
+    """
+    Mimics the parts of googleapiclient's Drive v3 Resource that gdrive calls.
+
+    :param root: The directory whose sub-directories are the Drive folders.
+    :param max_page_size: The largest page the fake returns, to exercise pagination.
+    """
+
+    def __init__(self, root: str, max_page_size: int = 1000):
+        self.root = root
+        self.max_page_size = max_page_size
+        self.changes_log: list[dict] = []
+
+    def files(self) -> _Files:
+        return _Files(self)
+
+    def changes(self) -> _Changes:
+        return _Changes(self)
+
+    def path_of(self, file_id: str) -> str:
+        return os.path.join(self.root, *file_id.split('/'))
+
+    def describe(self, folder_id: str, name: str) -> dict:
+        path = os.path.join(self.root, folder_id, name)
+        created = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+        return {
+            'id': f"{folder_id}/{name}",
+            'name': name,
+            'mimeType': _EXTENSION_MIME_TYPES.get(os.path.splitext(name)[1].lower(), 'application/octet-stream'),
+            'createdTime': created.isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+            'parents': [folder_id],
+        }
+
+    def folder_files(self, folder_id: str) -> list[dict]:
+        directory = os.path.join(self.root, folder_id)
+        if not os.path.isdir(directory):
+            return []
+        return [self.describe(folder_id, name) for name in os.listdir(directory)
+                if os.path.isfile(os.path.join(directory, name))]
+
+    def page(self, items: list, key: str, page_size: int, page_token: str | None) -> dict:
+        start = int(page_token or 0)
+        size = min(page_size, self.max_page_size)
+        result = {key: items[start:start + size]}
+        if start + size < len(items):
+            result['nextPageToken'] = str(start + size)
+        return result
+
+    def add_file(self, folder_id: str, name: str, data: bytes) -> dict:
+        """
+        Creates or overwrites a file and records it in the change feed.
+
+        :return: The Drive file object of the new file.
+        """
+        os.makedirs(os.path.join(self.root, folder_id), exist_ok=True)
+        with open(os.path.join(self.root, folder_id, name), 'wb') as f:
+            f.write(data)
+        file = self.describe(folder_id, name)
+        self.changes_log.append({'fileId': file['id'], 'removed': False, 'file': file})
+        return file
+
+    def remove_file(self, folder_id: str, name: str):
+        """
+        Deletes a file and records the removal in the change feed.
+        """
+        os.remove(os.path.join(self.root, folder_id, name))
+        self.changes_log.append({'fileId': f"{folder_id}/{name}", 'removed': True})
+
+    def close(self):
+        """
+        Matches Resource.close(); there are no connections to close.
+        """
@@ -1,8 +1,16 @@
-import io
+from __future__ import annotations
+
+import json
+import os
 import re
-from google.oauth2 import service_account
-from googleapiclient.discovery import build, Resource
-from googleapiclient.http import MediaIoBaseDownload
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from google.oauth2.service_account import Credentials
+    from googleapiclient.discovery import Resource
 
 # Scopes required for the actions. Read-only is sufficient.
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
@@ -14,26 +22,121 @@ MIME_TYPES = {
     'excel': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
     'excel_legacy': 'application/vnd.ms-excel'
 }
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Files per page when listing folders and changes (the API maximum is 1000)
+PAGE_SIZE = 1000
+FILE_FIELDS = "id, name, mimeType, createdTime"
+
+# Downloads are fetched in chunks of this size and kept in memory up to
+# SPOOL_MAX_MEMORY_BYTES; larger files are spooled to a temporary file on disk.
+DOWNLOAD_CHUNK_BYTES = 4 * 1024 * 1024
+SPOOL_MAX_MEMORY_BYTES = 16 * 1024 * 1024
+
+# Where the change-feed token of the last sync is kept
+SYNC_STATE_FILE = 'output/drive_sync_state.json'
+
+# Access tokens live for an hour; the background refresher renews them this long
+# before they expire, so no list or download call ever waits for a token.
+TOKEN_REFRESH_MARGIN = timedelta(minutes=10)
+# How long the refresher waits before retrying after a failed refresh
+TOKEN_RETRY_SECONDS = 60
+HTTP_TIMEOUT_SECONDS = 120
+
+_service: Resource | None = None
+_service_lock = threading.Lock()
+_refresher: threading.Thread | None = None
+_stop_refresher = threading.Event()
+
+
+def build_drive_service() -> tuple[Resource, Credentials]:
+    """
+    Builds a new Google Drive client authenticated with the service account.
+
+    The client sends every call through one httplib2.Http, which keeps its
+    connection to the Drive API open between calls. The discovery document
+    bundled with googleapiclient is used, so building does not hit the network.
+
+    :return: A tuple (Drive service resource, its credentials).
+    """
+    import google_auth_httplib2
+    import httplib2
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+
+    creds = service_account.Credentials.from_service_account_file(
+        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+    http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT_SECONDS))
+    service = build('drive', 'v3', http=http, cache_discovery=False, static_discovery=True)
+    return service, creds
 
 
+def _refresh_credentials(creds: Credentials):
+    """
+    Keeps the cached client's access token fresh until close_drive_service is called.
+
+    Refreshes use their own httplib2.Http, because the client's one is not thread-safe.
+    """
+    import google_auth_httplib2
+    import httplib2
+
+    request = google_auth_httplib2.Request(httplib2.Http(timeout=HTTP_TIMEOUT_SECONDS))
+    while not _stop_refresher.is_set():
+        wait_seconds = TOKEN_RETRY_SECONDS
+        try:
+            # google-auth keeps expiry as a naive UTC datetime
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            if not creds.valid or creds.expiry - now <= TOKEN_REFRESH_MARGIN:
+                creds.refresh(request)
+            wait_seconds = max((creds.expiry - TOKEN_REFRESH_MARGIN - now).total_seconds(), TOKEN_RETRY_SECONDS)
+        except Exception as e:
+            print(f"An error occurred while refreshing the Google Drive token: {e}")
+        _stop_refresher.wait(wait_seconds)
+
 
 def get_drive_service() -> Resource | None:
     """
-    Authenticates with the Google Drive API using a service account.
+    Returns the process-wide Google Drive client, authenticating on first use.
+
+    The client is built once and reused by every reload; its token is renewed in the
+    background. If authentication fails, the next call tries again.
+    Like googleapiclient's own objects, the client must only be used by one thread at a time.
 
     :return: An authenticated Google Drive service resource object, or None if authentication fails.
     """
-    try:
-        creds = service_account.Credentials.from_service_account_file(
-            SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-        service = build('drive', 'v3', credentials=creds)
-        return service
-    except FileNotFoundError:
-        print(f"ERROR: The service account file '{SERVICE_ACCOUNT_FILE}' was not found.")
-        return None
-    except Exception as e:
-        print(f"An error occurred during authentication: {e}")
-        return None
+    global _service, _refresher
+    with _service_lock:
+        if _service is not None:
+            return _service
+        try:
+            service, creds = build_drive_service()
+        except FileNotFoundError:
+            print(f"ERROR: The service account file '{SERVICE_ACCOUNT_FILE}' was not found.")
+            return None
+        except Exception as e:
+            print(f"An error occurred during authentication: {e}")
+            return None
+        _stop_refresher.clear()
+        _refresher = threading.Thread(target=_refresh_credentials, args=(creds,),
+                                      name="drive-token-refresh", daemon=True)
+        _refresher.start()
+        _service = service
+        return _service
+
+
+def close_drive_service():
+    """
+    Stops the token refresher and closes the cached client's connections.
+    """
+    global _service, _refresher
+    with _service_lock:
+        _stop_refresher.set()
+        if _refresher is not None:
+            _refresher.join(timeout=5)
+            _refresher = None
+        if _service is not None:
+            _service.close()
+            _service = None
 
 
 def extract_folder_id_from_url(url: str) -> str | None:
@@ -49,39 +152,151 @@ def extract_folder_id_from_url(url: str) -> str | None:
     return None
 
 
-def list_files_in_folder(service: Resource, folder_id: str) -> list[dict]:
+def list_files_in_folder(service: Resource, folder_id: str) -> list[dict] | None:
     """
     Lists all files within a specific Google Drive folder, sorted by creation time.
 
+    Follows nextPageToken until the last page, so folders of any size are listed in full.
+
     :param service: The authenticated Google Drive service resource.
     :param folder_id: The ID of the folder to list files from.
-    :return: A list of file objects (dictionaries), now including mimeType and createdTime.
+    :return: A list of file objects (dictionaries), now including mimeType and createdTime,
+        or None if the folder could not be listed in full, e.g. a page failed.
     """
-    query = f"'{folder_id}' in parents and mimeType != 'application/vnd.google-apps.folder'"
+    query = f"'{folder_id}' in parents and mimeType != '{FOLDER_MIME_TYPE}' and trashed = false"
+    files = []
+    page_token = None
     try:
-        results = service.files().list(
-            q=query,
-            pageSize=100,  # Max 1000
-            orderBy="createdTime asc",  # Sort by upload date in ascending order
-            fields="nextPageToken, files(id, name, mimeType, createdTime)"
-        ).execute()
-        return results.get('files', [])
+        while True:
+            results = service.files().list(
+                q=query,
+                pageSize=PAGE_SIZE,
+                orderBy="createdTime asc",  # Sort by upload date in ascending order
+                fields=f"nextPageToken, files({FILE_FIELDS})",
+                pageToken=page_token
+            ).execute()
+            files.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
     except Exception as e:
+        # A partial listing would look like a folder whose other files were removed
         print(f"An error occurred while listing files: {e}")
-        return []
+        return None
+
+
+def get_start_page_token(service: Resource) -> str | None:
+    """
+    Returns the token marking the current position in the Drive change feed.
 
+    Changes made after this call are returned by list_changes(service, token).
 
-def get_file_as_stream(service: Resource, file: dict) -> io.BytesIO | None:
+    :param service: The authenticated Google Drive service resource.
+    :return: The start page token, or None on failure.
+    """
+    try:
+        return service.changes().getStartPageToken().execute().get('startPageToken')
+    except Exception as e:
+        print(f"An error occurred while getting the start page token: {e}")
+        return None
+
+
+def list_changes(service: Resource, page_token: str) -> tuple[list[dict], set[str], str] | None:
+    """
+    Lists the files created, modified or removed since a change-feed token.
+
+    A file changed several times is returned once, in its latest state. Trashed
+    files count as removed; folders are left out.
+
+    :param service: The authenticated Google Drive service resource.
+    :param page_token: A token from get_start_page_token or a previous list_changes call.
+    :return: A tuple (changed files sorted by createdTime, IDs of removed files,
+             token to resume from next time), or None on failure.
     """
-    Gets a file's content as an in-memory byte stream.
+    changed = {}
+    removed = set()
+    try:
+        while True:
+            results = service.changes().list(
+                pageToken=page_token,
+                pageSize=PAGE_SIZE,
+                spaces='drive',
+                fields=f"nextPageToken, newStartPageToken, "
+                       f"changes(fileId, removed, file({FILE_FIELDS}, parents, trashed))"
+            ).execute()
+            for change in results.get('changes', []):
+                file = change.get('file')
+                file_id = change.get('fileId')
+                if change.get('removed') or not file or file.get('trashed'):
+                    changed.pop(file_id, None)
+                    removed.add(file_id)
+                elif file.get('mimeType') != FOLDER_MIME_TYPE:
+                    changed[file['id']] = file
+                    removed.discard(file['id'])
+            if 'newStartPageToken' in results:
+                files = sorted(changed.values(), key=lambda f: f.get('createdTime', ''))
+                return files, removed, results['newStartPageToken']
+            page_token = results['nextPageToken']
+    except Exception as e:
+        print(f"An error occurred while listing changes: {e}")
+        return None
+
+
+def load_sync_token(state_file: str = SYNC_STATE_FILE) -> str | None:
+    """
+    Reads the change-feed token saved by the last successful sync.
+
+    :param state_file: The JSON file holding the sync state.
+    :return: The saved token, or None if there has been no sync yet.
+    """
+    try:
+        with open(state_file, encoding='utf-8') as f:
+            return json.load(f).get('startPageToken')
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_sync_token(token: str, state_file: str = SYNC_STATE_FILE):
+    """
+    Saves the change-feed token the next sync should resume from.
+
+    :param token: The token to save.
+    :param state_file: The JSON file holding the sync state.
+    """
+    directory = os.path.dirname(state_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_file = f"{state_file}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump({'startPageToken': token}, f)
+    os.replace(temp_file, state_file)
+
+
+def is_supported_file(file: dict) -> bool:
+    """
+    Tells whether get_file_as_stream can download a file, i.e. it is a Google Sheet or an Excel file.
+    """
+    return file.get('mimeType') in MIME_TYPES.values()
+
+
+def get_file_as_stream(service: Resource, file: dict) -> tempfile.SpooledTemporaryFile | None:
+    """
+    Gets a file's content as a seekable binary stream.
 
     It handles both native Google Sheets (by exporting them) and regular
     files like .xlsx (by downloading them).
 
+    The content is downloaded in DOWNLOAD_CHUNK_BYTES chunks into a spooled
+    temporary file, which stays in memory for small files and moves to disk past
+    SPOOL_MAX_MEMORY_BYTES, so large exports never sit in memory whole. The caller
+    should close the stream when done; closing deletes the temporary file.
+
     :param service: The authenticated Google Drive service resource.
     :param file: The file object, including 'id', 'name', and 'mimeType'.
-    :return: A BytesIO object containing the file content, or None on failure.
+    :return: A binary file object positioned at the start, or None on failure.
     """
+    from googleapiclient.http import MediaIoBaseDownload
+
     file_id = file['id']
     file_mime_type = file['mimeType']
     request = None
@@ -91,7 +306,7 @@ def get_file_as_stream(service: Resource, file: dict) -> io.BytesIO | None:
             # It's a Google Sheet, so we need to export it
             print(f"Exporting Google Sheet: {file['name']}")
             request = service.files().export_media(fileId=file_id, mimeType=MIME_TYPES['excel'])
-        elif file_mime_type in [MIME_TYPES['excel'], MIME_TYPES['excel_legacy']]:
+        elif is_supported_file(file):
             # It's a regular Excel file (.xlsx or .xls), so we can download it directly
             print(f"Downloading Excel file: {file['name']}")
             request = service.files().get_media(fileId=file_id)
@@ -100,11 +315,15 @@ def get_file_as_stream(service: Resource, file: dict) -> io.BytesIO | None:
             print(f"Skipping unsupported file type '{file_mime_type}' for file: {file['name']}")
             return None
 
-        file_stream = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_stream, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
+        file_stream = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY_BYTES)
+        try:
+            downloader = MediaIoBaseDownload(file_stream, request, chunksize=DOWNLOAD_CHUNK_BYTES)
+            done = False
+            while done is False:
+                status, done = downloader.next_chunk()
+        except Exception:
+            file_stream.close()
+            raise
         file_stream.seek(0)
         return file_stream
 
@@ -0,0 +1,152 @@
+"""
+Per-stage spans for the ingest pipeline.
+
+A reload of one source records a span for every stage it goes through, per file:
+
+    'list'      listing the Drive folder
+    'download'  fetching a file from Drive
+    'cache'     copying it into the raw-file cache
+    'read'      HTML/Excel parsing
+    'infer'     column cleaning and type inference
+    'convert'   value coercion (values that cannot be converted are counted as rejected)
+    'insert'    executing the inserts
+    'commit'    committing the transaction
+    'index'     indexing the staging table of a full reload (see database_utils.load_files)
+    'analyze'   gathering its planner statistics
+    'swap'      renaming it over the live table, the only step that holds up other writers
+    'drop'      dropping the replaced table
+    'mirror'    rewriting the Parquet mirror
+    'search'    rebuilding the table's patient search entries (see patient_search)
+    'load'      a file that failed to parse or write (recorded with its error only)
+
+Each span carries its duration and, where they apply, the bytes, rows and rejected
+values it handled. IngestTrace.summary() is returned in the reload responses, and
+every span is also added to the ingest_* metrics served on /metrics.
+"""
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Iterator
+
+import metrics
+
+if TYPE_CHECKING:
+    from database_utils import ParsedFile
+
+PARSE_STAGES = ("read", "infer", "convert", "insert", "commit")
+
+metrics.describe("ingest_stage_seconds_total", "counter", "Seconds spent in each ingest stage.")
+metrics.describe("ingest_stage_spans_total", "counter", "Number of spans recorded for each ingest stage.")
+metrics.describe("ingest_bytes_total", "counter", "Bytes handled by each ingest stage.")
+metrics.describe("ingest_rows_total", "counter", "Rows handled by each ingest stage.")
+metrics.describe("ingest_rejected_values_total", "counter", "Values that could not be converted and were stored as NULL.")
+metrics.describe("ingest_errors_total", "counter", "Files that failed in an ingest stage.")
+metrics.describe("ingest_last_duration_seconds", "gauge", "Wall time of the last load of each source.")
+
+
+@dataclass
+class Span:
+    source: str
+    stage: str
+    file: str | None = None
+    seconds: float = 0.0
+    bytes: int | None = None
+    rows: int | None = None
+    rejected: int | None = None
+    error: str | None = None
+
+
+class IngestTrace:
+    """
+    Collects the spans of one load of one source.
+
+    :param source: The source being loaded, e.g. 'cobros'.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.spans: list[Span] = []
+        self._started = time.perf_counter()
+
+    def add(self, span: Span):
+        """
+        Records a finished span and adds it to the ingest metrics.
+        """
+        self.spans.append(span)
+        labels = {"source": span.source, "stage": span.stage}
+        metrics.inc("ingest_stage_seconds_total", labels, span.seconds)
+        metrics.inc("ingest_stage_spans_total", labels)
+        if span.bytes:
+            metrics.inc("ingest_bytes_total", labels, span.bytes)
+        if span.rows:
+            metrics.inc("ingest_rows_total", labels, span.rows)
+        if span.rejected:
+            metrics.inc("ingest_rejected_values_total", {"source": span.source}, span.rejected)
+        if span.error:
+            metrics.inc("ingest_errors_total", labels)
+
+    @contextmanager
+    def span(self, stage: str, file: str | None = None) -> Iterator[Span]:
+        """
+        Times the block it wraps as one span. The block can fill in bytes and rows on
+        the span it is given; an exception is recorded as the span's error and re-raised.
+
+        :param stage: The stage name.
+        :param file: The file being processed, if any.
+        """
+        span = Span(self.source, stage, file)
+        started = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.error = str(e)
+            raise
+        finally:
+            span.seconds = time.perf_counter() - started
+            self.add(span)
+
+    def add_parsed(self, parsed: ParsedFile, size: int | None = None):
+        """
+        Records the parse and write stages of a file from the timings it carries.
+
+        :param parsed: A ParsedFile that has been written.
+        :param size: The size of the raw file in bytes.
+        """
+        rows = len(parsed.rows)
+        for stage in PARSE_STAGES:
+            if stage not in parsed.timings:
+                continue
+            self.add(Span(
+                self.source, stage, parsed.file_name, parsed.timings[stage],
+                bytes=size if stage == "read" else None,
+                rows=rows if stage != "read" else None,
+                rejected=parsed.rejected if stage == "convert" else None,
+            ))
+
+    def summary(self) -> dict:
+        """
+        Summarizes the trace for a reload response.
+
+        :return: A dictionary with the total seconds, the totals per stage and every span.
+        """
+        seconds = time.perf_counter() - self._started
+        metrics.set_gauge("ingest_last_duration_seconds", {"source": self.source}, seconds)
+        stages = {}
+        for span in self.spans:
+            totals = stages.setdefault(span.stage, {"seconds": 0.0, "spans": 0, "bytes": 0, "rows": 0,
+                                                    "rejected": 0, "errors": 0})
+            totals["seconds"] += span.seconds
+            totals["spans"] += 1
+            totals["bytes"] += span.bytes or 0
+            totals["rows"] += span.rows or 0
+            totals["rejected"] += span.rejected or 0
+            totals["errors"] += 1 if span.error else 0
+        for totals in stages.values():
+            totals["seconds"] = round(totals["seconds"], 4)
+        return {
+            "seconds": round(seconds, 4),
+            "stages": stages,
+            "spans": [dict(asdict(span), seconds=round(span.seconds, 4)) for span in self.spans],
+        }
@@ -1,13 +1,39 @@
+import functools
+import inspect
 import logging
-
-from fastapi import FastAPI
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.routing import APIRoute
 from pydantic import BaseModel
 from datetime import datetime
 from typing import Optional
 
+import async_db
+import blob_cache
+import change_log
+import columnar
 import config
+import database
 import database_utils
+import date_keys
+import dimensions
 import gdrive
+import ingest_trace
+import maintenance
+import metrics
+import name_keys
+import partitions
+import patient_search
+import profiler
+import queries
+import version_feed
 
 from appointment_reminders import perform_appointment_reminders
 from daily_checks import perform_appointment_checks
@@ -20,12 +46,98 @@ class DateRangeRequest(BaseModel):
     table_name: Optional[str] = "citas" # Example: allow specifying table, default to citas
     date_column: Optional[str] = "Fecha" # Example: allow specifying date column, default to Fecha
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Opens the shared connection pool, adds any missing date shadow, name key and
+    row hash columns and patient search entries, closes the years that ended in
+    partitioned tables, takes the first in-memory snapshot, publishes its data
+    versions and authenticates with Google Drive when the server starts, and
+    closes all of them on shutdown.
+    """
+    with database.get_pool(database.DB_PATH).writer() as conn:
+        date_keys.migrate_database(conn)
+        name_keys.migrate_database(conn)
+        patient_search.migrate_database(conn)
+        dimensions.migrate_database(conn)
+        change_log.migrate_database(conn)
+        partitions.migrate_database(conn)
+    database.refresh_snapshot(database.DB_PATH)
+    _publish_versions(database.DB_PATH)
+    # Built once here and reused by every reload; a failure is retried on the next reload
+    gdrive.get_drive_service()
+    yield
+    gdrive.close_drive_service()
+    async_db.shutdown_executor()
+    database_utils.shutdown_parse_pool()
+    database.close_pools()
+
+class FollowedRoute(APIRoute):
+    """
+    A route whose sync endpoint is sampled by the request's profiler on the threadpool worker that runs it.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = profiler.followed(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
 # Initialize the FastAPI application
 app = FastAPI(
     title="Laia Lubens Data Loader",
     description="An API to load data from Google Drive into an in-memory SQL database.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
+app.router.route_class = FollowedRoute
+
+metrics.describe("http_request_duration_seconds", "histogram", "Request latency per route and status.")
+metrics.describe("http_request_db_seconds", "histogram", "Time each request spent in database statements.")
+metrics.describe("http_request_python_seconds", "histogram", "Time each request spent outside the database.")
+metrics.describe("http_request_size_bytes", "histogram", "Request body sizes.", buckets=metrics.SIZE_BUCKETS)
+metrics.describe("http_response_size_bytes", "histogram", "Response body sizes.", buckets=metrics.SIZE_BUCKETS)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    Records the latency, database time and payload sizes of every request, per route.
+
+    With ?profile=1, and PROFILE_REQUESTS=1 set on the server, the response is
+    replaced by a sampling profile of the request; the endpoint's own status code
+    is kept in the X-Profiled-Status header. One request is profiled at a time;
+    another one asking for a profile meanwhile gets a 409.
+    """
+    profile = request.query_params.get("profile") == "1" and config.profiling_enabled()
+    db_seconds = queries.track_db_time()
+    started = time.perf_counter()
+    if profile:
+        try:
+            with profiler.SamplingProfiler() as sampler:
+                response = await call_next(request)
+        except profiler.ProfilerBusy as e:
+            return PlainTextResponse(f"{e}; try again when it has finished.", status_code=409)
+    else:
+        response = await call_next(request)
+    seconds = time.perf_counter() - started
+
+    # The matched route template keeps the label set small, e.g. '/reload_cobros'
+    route = request.scope.get("route")
+    labels = {"method": request.method, "route": route.path if route is not None else "unmatched"}
+    metrics.observe("http_request_duration_seconds", dict(labels, status=str(response.status_code)), seconds)
+    metrics.observe("http_request_db_seconds", labels, db_seconds[0])
+    metrics.observe("http_request_python_seconds", labels, max(seconds - db_seconds[0], 0.0))
+    if request.headers.get("content-length"):
+        metrics.observe("http_request_size_bytes", labels, int(request.headers["content-length"]))
+    if response.headers.get("content-length"):
+        metrics.observe("http_response_size_bytes", labels, int(response.headers["content-length"]))
+
+    if profile:
+        report = sampler.report(f"{request.method} {request.url.path} ({response.status_code})")
+        return PlainTextResponse(report, headers={"X-Profiled-Status": str(response.status_code)})
+    return response
+
 
 @app.get("/")
 def read_root():
@@ -34,9 +146,41 @@ def read_root():
     """
     return {"message": "Welcome to the Data Loader API. Use /reload_[source_name] to load data."}
 
-async def _process_drive_source(source_name: str, table_name: str, db_name: str, parse_func) -> dict:
+# The loaders are plain functions, run by FastAPI's threadpool so the event loop keeps
+# serving other requests. They share the Drive client, which is not thread-safe, so
+# one load runs at a time, with its maintenance and snapshot refresh: every loading
+# endpoint holds the lock. A /sync_all that falls back to /reload_all holds it twice
+_load_lock = threading.RLock()
+
+
+def _one_load_at_a_time(func):
+    @functools.wraps(func)
+    def run_locked(*args, **kwargs):
+        with _load_lock:
+            return func(*args, **kwargs)
+    return run_locked
+
+
+@_one_load_at_a_time
+def _process_drive_source(source_name: str, table_name: str, db_name: str, parse_func,
+                          files: list[dict] | None = None) -> dict:
     """
     Helper function to process a single Google Drive source.
+
+    When `files` is given (e.g. the changed files found by /sync_all), only those files
+    are processed and the folder is not listed.
+
+    Without `files`, the whole folder is loaded and swapped in for the table at once
+    (see database_utils.load_files), so rows from files removed from the folder go
+    away and readers never see a half-loaded table. If any file of the folder cannot
+    be downloaded, the table is left as it was, as its rows would go away too; only
+    files of an unsupported type are skipped. Failed downloads make the result
+    unsuccessful either way, so /sync_all retries them.
+    Once every file is downloaded, a full reload also removes the cached copies of
+    files no longer in the folder (see blob_cache.prune).
+
+    Once the source is reached, the result includes a 'timings' summary with a span
+    per file and stage (see ingest_trace).
     """
     source_url = config.DRIVE_SOURCES.get(source_name)
     if not source_url:
@@ -62,161 +206,371 @@ async def _process_drive_source(source_name: str, table_name: str, db_name: str,
             "message": "Invalid Google Drive folder URL."
         }
 
-    files = gdrive.list_files_in_folder(service, folder_id)
+    trace = ingest_trace.IngestTrace(source_name)
+    full_reload = files is None
+    if full_reload:
+        with trace.span("list") as span:
+            files = gdrive.list_files_in_folder(service, folder_id)
+            span.rows = len(files) if files is not None else 0
+        if files is None:
+            return {
+                "source": source_name,
+                "success": False,
+                "message": f"Could not list the '{source_name}' directory; kept the current '{table_name}' table.",
+                "timings": trace.summary()
+            }
     if not files:
         return {
             "source": source_name,
             "success": True,
-            "message": f"No files found in the '{source_name}' directory."
+            "message": f"No files found in the '{source_name}' directory.",
+            "timings": trace.summary()
         }
 
-    processed_files_count = 0
-    for file in files:
+    # Download every file first; the Drive client must only be used from this thread
+    file_sources = []
+    failed_files = []
+    for file in sorted(files, key=lambda f: f.get('createdTime', '')):
+        if not gdrive.is_supported_file(file):
+            print(f"Skipping file {file['name']} (unsupported format '{file.get('mimeType')}').")
+            continue
         print(f"Processing file: {file['name']} ({file['id']}) for source '{source_name}'")
         try:
-            file_stream = gdrive.get_file_as_stream(service, file)
-            if file_stream:
-                parse_func(file_stream, db_name, table_name, file['name'])
-                processed_files_count += 1
-            else:
-                print(f"Skipping file {file['name']} (unsupported format or empty stream).")
+            with trace.span("download", file['name']) as span:
+                file_stream = gdrive.get_file_as_stream(service, file)
+                if file_stream:
+                    span.bytes = file_stream.seek(0, os.SEEK_END)
+                    file_stream.seek(0)
+            if not file_stream:
+                print(f"Could not download file {file['name']} for source '{source_name}'.")
+                failed_files.append(file['name'])
+                continue
+            # Closing the stream removes its temporary file, if it spilled to disk
+            with file_stream:
+                try:
+                    # Keep the raw bytes, so the database can be rebuilt offline; the
+                    # parse workers read the cached copy instead of a second download
+                    with trace.span("cache", file['name']) as span:
+                        checksum = blob_cache.store_blob(file_stream, source_name, file)
+                        span.bytes = os.path.getsize(blob_cache.blob_path(checksum))
+                    file_sources.append((blob_cache.blob_path(checksum), file['name']))
+                except Exception as e:
+                    print(f"Could not cache file {file['name']}: {e}")
+                    file_sources.append((file_stream.read(), file['name']))
         except Exception as e:
             print(f"Could not process file {file['name']} for source '{source_name}': {e}")
-            # Optionally, you might want to return an error for the whole source if any file fails
-            # For now, we continue processing other files but log the error.
+            failed_files.append(file['name'])
+
+    if failed_files and full_reload:
+        # Swapping in the other files would delete every row of the missing ones
+        print(f"Kept the current '{table_name}' table: {len(failed_files)} files could not be downloaded.")
+        return {
+            "source": source_name,
+            "success": False,
+            "message": f"Could not download {', '.join(failed_files)}; kept the current '{table_name}' table.",
+            "timings": trace.summary()
+        }
+
+    if full_reload:
+        # The listing is complete here, so cached copies of files no longer in it are stale
+        try:
+            blob_cache.prune(source_name, {file['id'] for file in files})
+        except Exception as e:
+            print(f"Could not prune the cached files of '{source_name}': {e}")
+
+    # Files are parsed in parallel and written oldest first, so the newest file wins
+    processed_files_count = database_utils.load_files(file_sources, db_name, table_name, parse_func, trace,
+                                                      staged=full_reload)
+
+    if processed_files_count > 0 and table_name in columnar.MIRRORED_TABLES:
+        try:
+            with trace.span("mirror") as span:
+                span.rows = columnar.export_table(db_name, table_name)
+        except Exception as e:
+            # The SQLite tables are the source of truth; a stale mirror only slows analytics down
+            print(f"Could not mirror table '{table_name}' to Parquet: {e}")
+
+    if processed_files_count > 0 and table_name in patient_search.INDEXED_TABLES:
+        try:
+            with trace.span("search") as span:
+                span.rows = patient_search.index_table(db_name, table_name)
+        except Exception as e:
+            print(f"Could not update the patient search index for table '{table_name}': {e}")
+
+    if failed_files:
+        return {
+            "source": source_name,
+            "success": False,
+            "message": f"Processed {processed_files_count} files, but could not download {', '.join(failed_files)}.",
+            "processed_count": processed_files_count,
+            "timings": trace.summary()
+        }
 
     if processed_files_count == 0:
         return {
             "source": source_name,
             "success": False,
-            "message": f"Found files for '{source_name}', but none could be processed successfully."
+            "message": f"Found files for '{source_name}', but none could be processed successfully.",
+            "timings": trace.summary()
         }
 
     return {
         "source": source_name,
         "success": True,
         "message": f"Successfully processed {processed_files_count} files and updated table '{table_name}'.",
-        "processed_count": processed_files_count
+        "processed_count": processed_files_count,
+        "timings": trace.summary()
     }
 
+def _publish_versions(db_name: str):
+    """
+    Tells the /data_versions subscribers which tables the current snapshot changed.
+    """
+    with database.snapshot_reader(db_name) as conn:
+        versions = database.get_data_versions(conn)
+    version_feed.get_feed().publish(versions)
+
+def _finish_load(db_name: str) -> dict | None:
+    """
+    Runs the post-load maintenance, swaps in a new snapshot for the readers, then
+    publishes the new data versions to the /data_versions subscribers.
+
+    :return: The maintenance report, or None if maintenance failed.
+    """
+    report = None
+    try:
+        report = maintenance.run_maintenance(db_name)
+    except Exception as e:
+        # Stale statistics only slow queries down; the new data is served regardless
+        print(f"Post-load maintenance of '{db_name}' failed: {e}")
+    database.refresh_snapshot(db_name)
+    _publish_versions(db_name)
+    return report
+
 @app.post("/reload_all", tags=["Data Loading"])
-async def reload_all():
+@_one_load_at_a_time
+def reload_all():
     """
     Reloads data for all configured Google Drive sources.
+
+    Also records the position of the Drive change feed, so the next /sync_all only
+    fetches what changed after this reload.
     """
     results = []
-    db_name = "output/data.db" # Consistent database name
+    db_name = database.DB_PATH # Consistent database name
+
+    # Taken before listing, so files added while we load are picked up by the next sync
+    service = gdrive.get_drive_service()
+    sync_token = gdrive.get_start_page_token(service) if service else None
 
     for source_name, source_url in config.DRIVE_SOURCES.items():
         table_name = source_name
-        parse_func = database_utils.parse_html_to_db # Default parser
+        parse_func = database_utils.parser_for(source_name)
+
+        result = _process_drive_source(source_name, table_name, db_name, parse_func)
+        results.append(result)
+
+    if sync_token and all(result["success"] for result in results):
+        gdrive.save_sync_token(sync_token)
+
+    maintenance_report = _finish_load(db_name)
+    return {"message": "Attempted to reload all sources.", "results": results, "maintenance": maintenance_report}
+
+@app.post("/sync_all", tags=["Data Loading"])
+@_one_load_at_a_time
+def sync_all():
+    """
+    Loads only the files added since the last sync, using the Drive changes feed.
 
-        if source_name == "citas" or source_name == "doctores":
-            parse_func = database_utils.parse_xlsx_to_db
+    New files are appended to their tables. A source with a modified or removed
+    file is reloaded in full instead (see _process_drive_source): appending a
+    modified export would keep the rows it used to have, and an older export keeps
+    its createdTime, so it would be written over rows of newer files. Files count
+    as modified when the blob cache has a copy of them, i.e. they were loaded before.
+
+    Falls back to a full /reload_all when no sync has been recorded yet.
+    """
+    sync_token = gdrive.load_sync_token()
+    if sync_token is None:
+        return reload_all()
+
+    service = gdrive.get_drive_service()
+    if not service:
+        return {
+            "message": "Failed to authenticate with Google Drive. Check service_account.json.",
+            "results": []
+        }
 
-        result = await _process_drive_source(source_name, table_name, db_name, parse_func)
+    changes = gdrive.list_changes(service, sync_token)
+    if changes is None:
+        return {"message": "Could not read the Google Drive change feed.", "results": []}
+    changed_files, removed_ids, next_sync_token = changes
+
+    # Map each configured folder back to its source
+    folder_sources = {}
+    for source_name, source_url in config.DRIVE_SOURCES.items():
+        folder_id = gdrive.extract_folder_id_from_url(source_url)
+        if folder_id:
+            folder_sources[folder_id] = source_name
+
+    loaded_files = blob_cache.load_manifest()
+    files_by_source = defaultdict(list)
+    full_reloads = set()
+    for file in changed_files:
+        for parent in file.get('parents', []):
+            if parent not in folder_sources:
+                continue
+            if file['id'] in loaded_files:
+                full_reloads.add(folder_sources[parent])
+            else:
+                files_by_source[folder_sources[parent]].append(file)
+    for file_id in removed_ids:
+        # A removed file has no parents left; the cache remembers which source it was loaded for
+        source_name = loaded_files.get(file_id, {}).get("source")
+        if source_name in config.DRIVE_SOURCES:
+            full_reloads.add(source_name)
+
+    results = []
+    db_name = database.DB_PATH
+    for source_name in config.DRIVE_SOURCES:
+        parse_func = database_utils.parser_for(source_name)
+        if source_name in full_reloads:
+            result = _process_drive_source(source_name, source_name, db_name, parse_func)
+        elif files_by_source.get(source_name):
+            result = _process_drive_source(source_name, source_name, db_name, parse_func,
+                                           files=files_by_source[source_name])
+        else:
+            continue
         results.append(result)
 
-    return {"message": "Attempted to reload all sources.", "results": results}
+    # Only move past these changes once they are all loaded; failures are retried next sync
+    if all(result["success"] for result in results):
+        gdrive.save_sync_token(next_sync_token)
+
+    maintenance_report = _finish_load(db_name)
+    new_count = sum(len(files) for source_name, files in files_by_source.items()
+                    if source_name not in full_reloads)
+    message = f"Synced {new_count} new files"
+    if full_reloads:
+        message += f" and fully reloaded {', '.join(sorted(full_reloads))}, which had modified or removed files"
+    return {"message": message + ".", "results": results, "maintenance": maintenance_report}
 
 @app.post("/reload_datos_personales", tags=["Data Loading"])
-async def reload_datos_personales():
+@_one_load_at_a_time
+def reload_datos_personales():
     """
     Reloads data for the 'datos_personales' source.
     """
     source_name = "datos_personales"
     table_name = "datos_personales"
-    db_name = "output/data.db"
-    result = await _process_drive_source(source_name, table_name, db_name, database_utils.parse_html_to_db)
+    db_name = database.DB_PATH
+    result = _process_drive_source(source_name, table_name, db_name, database_utils.parse_html)
+    result["maintenance"] = _finish_load(db_name)
     return result
 
 @app.post("/reload_fechas_pacientes", tags=["Data Loading"])
-async def reload_fechas_pacientes():
+@_one_load_at_a_time
+def reload_fechas_pacientes():
     """
     Reloads data for the 'fechas_pacientes' source.
     """
     source_name = "fechas_pacientes"
     table_name = "fechas_pacientes"
-    db_name = "output/data.db"
-    result = await _process_drive_source(source_name, table_name, db_name, database_utils.parse_html_to_db)
+    db_name = database.DB_PATH
+    result = _process_drive_source(source_name, table_name, db_name, database_utils.parse_html)
+    result["maintenance"] = _finish_load(db_name)
     return result
 
 @app.post("/reload_facturas", tags=["Data Loading"])
-async def reload_facturas():
+@_one_load_at_a_time
+def reload_facturas():
     """
     Reloads data for the 'facturas' source.
     """
     source_name = "facturas"
     table_name = "facturas"
-    db_name = "output/data.db"
-    result = await _process_drive_source(source_name, table_name, db_name, database_utils.parse_html_to_db)
+    db_name = database.DB_PATH
+    result = _process_drive_source(source_name, table_name, db_name, database_utils.parse_html)
+    result["maintenance"] = _finish_load(db_name)
     return result
 
 @app.post("/reload_cobros", tags=["Data Loading"])
-async def reload_cobros():
+@_one_load_at_a_time
+def reload_cobros():
     """
     Reloads data for the 'cobros' source.
     """
     source_name = "cobros"
     table_name = "cobros"
-    db_name = "output/data.db"
-    result = await _process_drive_source(source_name, table_name, db_name, database_utils.parse_html_to_db)
+    db_name = database.DB_PATH
+    result = _process_drive_source(source_name, table_name, db_name, database_utils.parse_html)
+    result["maintenance"] = _finish_load(db_name)
     return result
 
 @app.post("/reload_citas", tags=["Data Loading"])
-async def reload_citas():
+@_one_load_at_a_time
+def reload_citas():
     """
     Reloads data for the 'citas' source.
     """
     source_name = "citas"
     table_name = "citas"
-    db_name = "output/data.db"
-    result = await _process_drive_source(source_name, table_name, db_name, database_utils.parse_xlsx_to_db)
+    db_name = database.DB_PATH
+    result = _process_drive_source(source_name, table_name, db_name, database_utils.parse_xlsx)
+    result["maintenance"] = _finish_load(db_name)
     return result
 
 @app.post("/reload_doctores", tags=["Data Loading"])
-async def reload_doctores():
+@_one_load_at_a_time
+def reload_doctores():
     """
     Reloads data for the 'doctores' source.
     """
     source_name = "doctores"
     table_name = "doctores"
-    db_name = "output/data.db"
-    result = await _process_drive_source(source_name, table_name, db_name, database_utils.parse_xlsx_to_db)
+    db_name = database.DB_PATH
+    result = _process_drive_source(source_name, table_name, db_name, database_utils.parse_xlsx)
+    result["maintenance"] = _finish_load(db_name)
     return result
 
 @app.post("/reload_datos_tratamientos", tags=["Data Loading"])
-async def reload_datos_tratamientos():
+@_one_load_at_a_time
+def reload_datos_tratamientos():
     """
     Reloads data for the 'datos_tratamientos' source.
     """
     source_name = "datos_tratamientos"
     table_name = "datos_tratamientos"
-    db_name = "output/data.db"
-    result = await _process_drive_source(source_name, table_name, db_name, database_utils.parse_html_to_db)
+    db_name = database.DB_PATH
+    result = _process_drive_source(source_name, table_name, db_name, database_utils.parse_html)
+    result["maintenance"] = _finish_load(db_name)
     return result
 
 @app.post("/reload_trabajos_laboratorios", tags=["Data Loading"])
-async def reload_trabajos_laboratorios():
+@_one_load_at_a_time
+def reload_trabajos_laboratorios():
     """
     Reloads data for the 'trabajos_laboratorios' source.
     """
     source_name = "trabajos_laboratorios"
     table_name = "trabajos_laboratorios"
-    db_name = "output/data.db"
-    result = await _process_drive_source(source_name, table_name, db_name, database_utils.parse_html_to_db)
+    db_name = database.DB_PATH
+    result = _process_drive_source(source_name, table_name, db_name, database_utils.parse_html)
+    result["maintenance"] = _finish_load(db_name)
     return result
 
 
 @app.post("/reload_comisiones", tags=["Data Loading"])
-async def reload_comisiones():
+@_one_load_at_a_time
+def reload_comisiones():
     """
     Reloads data for the 'comisiones' source.
     """
     source_name = "comisiones"
     table_name = "comisiones"
-    db_name = "output/data.db"
-    result = await _process_drive_source(source_name, table_name, db_name, database_utils.parse_html_to_db)
+    db_name = database.DB_PATH
+    result = _process_drive_source(source_name, table_name, db_name, database_utils.parse_html)
+    result["maintenance"] = _finish_load(db_name)
     return result
 
 
@@ -226,7 +580,8 @@ async def daily_checks(request: DateRangeRequest):
     from_date = request.start_date
     to_date = request.end_date
     logging.info(f"Check appointments from dates {from_date} to {to_date}")
-    alerts = perform_appointment_checks(from_date, to_date)
+    # The checks read the snapshot and compare names with difflib; keep both off the event loop
+    alerts = await async_db.run(perform_appointment_checks, from_date, to_date)
     if alerts:
         return {
             "message": f"Found {len(alerts)} records alerts",
@@ -239,9 +594,9 @@ async def daily_checks(request: DateRangeRequest):
         }
 
 @app.get("/get_appointments_to_confirm", tags=["Data Loading"])
-def get_appointment_reminders():
+async def get_appointment_reminders():
     logging.info(f"Get appointments to confirm...")
-    results = perform_appointment_reminders()
+    results = await async_db.run(perform_appointment_reminders)
     if results['success'] == 'true' and results['data']:
         return {
             "message": f"Found {len(results['data'])} results",
@@ -254,6 +609,110 @@ def get_appointment_reminders():
         }
 
 
+@app.get("/patients/search", tags=["Patients"])
+def search_patients(q: str, limit: int = 20):
+    """
+    Finds patients by partial name, phone or DNI, e.g. ?q=garcia jos or ?q=626 28.
+
+    Every word is matched as a prefix, without regard to case or accents, and the
+    best matches come first (see patient_search).
+    """
+    try:
+        with database.snapshot_reader(database.DB_PATH) as conn:
+            results = patient_search.search(conn, q, limit)
+    except sqlite3.Error as e:
+        print(f"SQLite error in search_patients: {e}")
+        results = []
+    return {
+        "message": f"Found {len(results)} patients",
+        "data": results
+    }
+
+
+@app.get("/changes", tags=["Data Loading"])
+def get_changes(since: int = 0, table: Optional[str] = None, limit: int = 1000):
+    """
+    Returns the rows inserted, updated and deleted by the loads after sequence number `since`, oldest first.
+
+    Pass the 'last_seq' of a response as `since` to read the next changes (see change_log).
+    The log only keeps recent changes: when some after `since` have been pruned, the
+    response has 'resync' set and no changes. The client should then read the tables
+    in full and continue from the 'last_seq' of that response.
+    """
+    resync = False
+    try:
+        with database.snapshot_reader(database.DB_PATH) as conn:
+            if since < change_log.first_sequence(conn):
+                resync = True
+                changes = []
+                last_seq = change_log.last_sequence(conn)
+            else:
+                changes = change_log.changes_since(conn, since, table, limit)
+                last_seq = changes[-1]["seq"] if changes else since
+    except sqlite3.Error as e:
+        print(f"SQLite error in get_changes: {e}")
+        changes = []
+        last_seq = since
+    if resync:
+        message = f"Changes after {since} are no longer kept; read the tables in full, then continue from last_seq"
+    else:
+        message = f"Found {len(changes)} changes"
+    return {
+        "message": message,
+        "data": changes,
+        "last_seq": last_seq,
+        "resync": resync
+    }
+
+
+@app.get("/data_versions", tags=["Data Loading"])
+async def get_data_versions(since: int = -1, timeout: float = 25):
+    """
+    Returns the data version of every table once it moves past sequence number `since` (a long poll).
+
+    Without `since` it answers at once. Otherwise it waits up to `timeout` seconds for
+    a load to change a table; pass the 'seq' of a response as the next `since`.
+    """
+    feed = version_feed.get_feed()
+    state = await feed.wait(since, min(max(timeout, 0), version_feed.MAX_POLL_SECONDS))
+    if state is None:
+        state = dict(feed.state(), changed={})
+    return {
+        "message": f"{len(state['changed'])} tables changed",
+        "data": state["versions"],
+        "changed": state["changed"],
+        "seq": state["seq"]
+    }
+
+
+@app.get(version_feed.STREAM_PATH, tags=["Data Loading"])
+async def stream_data_versions():
+    """
+    Streams the data version of every table as Server-Sent Events: once on connect,
+    then after every load that changed a table (see version_feed).
+    """
+    return StreamingResponse(
+        version_feed.stream_events(version_feed.get_feed()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/query_stats", tags=["Monitoring"])
+def query_stats():
+    """
+    Returns call counts and timings of every named query run by this worker, slowest first.
+    """
+    return {"data": queries.get_stats()}
+
+
+@app.get("/metrics", tags=["Monitoring"], response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Returns this worker's metrics in the Prometheus text format, for scraping.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 
 if __name__ == "__main__":
     import uvicorn
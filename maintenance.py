@@ -0,0 +1,212 @@
+"""
+Post-load maintenance of the SQLite database: planner statistics and free pages.
+
+The loaders record how many rows they write to each table (record_changes). After
+a reload, run_maintenance:
+
+- deletes the row changes older than the change log keeps (see change_log.prune),
+  so neither the file nor the in-memory snapshots grow with every load;
+- runs ANALYZE on every table that was never analyzed, or whose rows written since
+  its last ANALYZE reach ANALYZE_FRACTION of the rows it had then, followed by
+  PRAGMA optimize;
+- releases free pages once they make up VACUUM_FRACTION of the file, at most
+  VACUUM_PAGES per run so the writer is only held briefly. Smaller amounts are left
+  for the next load to reuse, e.g. by the staging table of the next full reload.
+
+Free pages can only be released incrementally with auto_vacuum=INCREMENTAL, which
+new databases get from database.ConnectionPool. An older database is switched over
+with one full VACUUM the first time it has enough free pages.
+
+Every run that changes something reports the seconds it took, the bytes it released,
+and the run time of the registered queries over the last PROBE_DAYS days before and
+after, as an estimate of the time the new statistics save.
+"""
+from __future__ import annotations
+
+import logging
+import sqlite3
+import time
+from datetime import date, timedelta
+
+import change_log
+import database
+import date_keys
+import metrics
+import queries
+
+# Fraction of a table's rows written since its last ANALYZE that triggers a new one
+ANALYZE_FRACTION = 0.1
+# Fraction of the file's pages on the free list that triggers releasing them
+VACUUM_FRACTION = 0.1
+# Most pages released by one run
+VACUUM_PAGES = 10_000
+# The registered queries are timed over this many days, ending today
+PROBE_DAYS = 30
+
+metrics.describe("maintenance_seconds_total", "counter", "Seconds spent in post-load maintenance.")
+metrics.describe("maintenance_released_bytes_total", "counter", "Bytes of free pages released by maintenance.")
+
+
+def _create_changes_table(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS _table_changes ("
+        "table_name TEXT PRIMARY KEY, changed_rows INTEGER NOT NULL, analyzed_at TEXT)"
+    )
+
+
+def record_changes(conn: sqlite3.Connection, table_name: str, rows: int):
+    """
+    Adds to the number of rows written to a table since it was last analyzed.
+
+    Call this inside the same transaction as the write.
+
+    :param conn: The writer connection.
+    :param table_name: The table that was written.
+    :param rows: How many rows were inserted or replaced.
+    """
+    _create_changes_table(conn)
+    conn.execute(
+        "INSERT INTO _table_changes (table_name, changed_rows) VALUES (?, ?) "
+        "ON CONFLICT(table_name) DO UPDATE SET changed_rows = changed_rows + excluded.changed_rows",
+        (table_name, rows)
+    )
+
+
+def mark_analyzed(conn: sqlite3.Connection, table_name: str):
+    """
+    Records that a table's statistics are up to date, e.g. after ANALYZE.
+
+    :param conn: The writer connection.
+    :param table_name: The table that was analyzed.
+    """
+    _create_changes_table(conn)
+    conn.execute(
+        "INSERT INTO _table_changes (table_name, changed_rows, analyzed_at) VALUES (?, 0, datetime('now')) "
+        "ON CONFLICT(table_name) DO UPDATE SET changed_rows = 0, analyzed_at = excluded.analyzed_at",
+        (table_name,)
+    )
+
+
+def _tables_to_analyze(conn: sqlite3.Connection) -> list[str]:
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name NOT LIKE '\\_%' ESCAPE '\\'"
+    )]
+    try:
+        changes = {name: (rows, analyzed_at) for name, rows, analyzed_at in conn.execute(
+            "SELECT table_name, changed_rows, analyzed_at FROM _table_changes")}
+    except sqlite3.OperationalError:
+        changes = {}
+    try:
+        # The first number of a table's statistics is its row count when it was analyzed
+        analyzed_rows = {tbl: int(stat.split()[0]) for tbl, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1")}
+    except sqlite3.OperationalError:
+        analyzed_rows = {}
+
+    due = []
+    for table_name in tables:
+        changed_rows, analyzed_at = changes.get(table_name, (0, None))
+        # ANALYZE leaves no statistics for an empty table, so it is only known from _table_changes
+        if analyzed_at is None and table_name not in analyzed_rows:
+            due.append(table_name)
+        elif changed_rows >= ANALYZE_FRACTION * max(analyzed_rows.get(table_name, 0), 1):
+            due.append(table_name)
+    return due
+
+
+def _probe(db_path: str) -> tuple[dict[str, float], dict[str, list[str]]]:
+    # Times every registered statement over the last PROBE_DAYS days and captures its plan;
+    # statements whose tables are not loaded are left out
+    today = date.today()
+    bounds = date_keys.range_bounds(today - timedelta(days=PROBE_DAYS), today)
+    seconds, plans = {}, {}
+    with database.get_pool(db_path).reader() as conn:
+        for name in queries.statement_names():
+            try:
+                sql = queries.resolve_sql(conn, name, bounds)
+                plans[name] = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", bounds)]
+                # The first run warms the page cache, the second is timed
+                conn.execute(sql, bounds).fetchall()
+                started = time.perf_counter()
+                conn.execute(sql, bounds).fetchall()
+                seconds[name] = time.perf_counter() - started
+            except sqlite3.Error:
+                continue
+    return seconds, plans
+
+
+def run_maintenance(db_path: str = database.DB_PATH) -> dict:
+    """
+    Refreshes planner statistics and releases free pages where the last loads call for it.
+
+    Run it after the loaders and before database.refresh_snapshot, so the snapshot
+    carries the new statistics and is built from the smaller file.
+
+    :param db_path: The path to the SQLite database file.
+    :return: A dictionary with the changes pruned from the change log, the tables
+        analyzed, the vacuum done ('incremental', 'full' or None), the seconds taken, the bytes released, the probe query
+        seconds before and after, and the statements whose plan changed.
+    """
+    started = time.perf_counter()
+    pool = database.get_pool(db_path)
+    with pool.writer() as conn:
+        pruned = change_log.prune(conn)
+        to_analyze = _tables_to_analyze(conn)
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    vacuum = None
+    if free_pages and free_pages >= VACUUM_FRACTION * page_count:
+        vacuum = "incremental" if auto_vacuum == 2 else "full"
+
+    report = {"pruned_changes": pruned, "analyzed": to_analyze, "vacuum": vacuum, "seconds": 0.0, "released_bytes": 0,
+              "query_seconds_before": None, "query_seconds_after": None, "plans_changed": []}
+    if not to_analyze and not vacuum:
+        report["seconds"] = round(time.perf_counter() - started, 4)
+        return report
+
+    seconds_before, plans_before = _probe(db_path)
+    work_started = time.perf_counter()
+
+    for table_name in to_analyze:
+        with pool.writer() as conn:
+            conn.execute(f'ANALYZE "{table_name}"')
+            mark_analyzed(conn, table_name)
+    if to_analyze:
+        with pool.writer() as conn:
+            conn.execute("PRAGMA optimize")
+
+    if vacuum == "incremental":
+        with pool.writer() as conn:
+            # Each step frees one page; executescript runs the pragma to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+    elif vacuum == "full":
+        with pool.writer() as conn:
+            # Takes effect with the VACUUM that rebuilds the file
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+
+    with pool.writer() as conn:
+        # ANALYZE can add a page or two for sqlite_stat1
+        released_pages = max(page_count - conn.execute("PRAGMA page_count").fetchone()[0], 0)
+    work_seconds = time.perf_counter() - work_started
+
+    seconds_after, plans_after = _probe(db_path)
+    probed = [name for name in seconds_before if name in seconds_after]
+    report.update({
+        "seconds": round(work_seconds, 4),
+        "released_bytes": released_pages * page_size,
+        "query_seconds_before": round(sum(seconds_before[name] for name in probed), 4),
+        "query_seconds_after": round(sum(seconds_after[name] for name in probed), 4),
+        "plans_changed": [name for name in probed if plans_before.get(name) != plans_after.get(name)],
+    })
+    queries.add_db_time(work_seconds)
+    metrics.inc("maintenance_seconds_total", None, work_seconds)
+    metrics.inc("maintenance_released_bytes_total", None, report["released_bytes"])
+    logging.info(
+        f"Maintenance of '{db_path}' took {work_seconds:.3f}s: analyzed {len(to_analyze)} tables, "
+        f"released {report['released_bytes'] / 1_000_000:.1f} MB ({vacuum or 'no'} vacuum); "
+        f"probe queries {report['query_seconds_before']:.4f}s -> {report['query_seconds_after']:.4f}s, "
+        f"{len(report['plans_changed'])} plans changed."
+    )
+    return report
@@ -0,0 +1,147 @@
+"""
+Process-wide counters, gauges and histograms, rendered in the Prometheus text
+exposition format.
+
+A metric is declared once with describe() and then updated with inc(),
+set_gauge() or observe(), one value per combination of label values:
+
+    metrics.describe("ingest_rows_total", "counter", "Rows written by the loaders.")
+    metrics.inc("ingest_rows_total", {"source": "cobros"}, 3649)
+
+    metrics.describe("http_request_duration_seconds", "histogram", "Request latency.",
+                     buckets=metrics.LATENCY_BUCKETS)
+    metrics.observe("http_request_duration_seconds", {"route": "/daily_checks"}, 0.42)
+
+render() returns every value as text that Prometheus can scrape, e.g. from the
+API's /metrics endpoint. Values live in the memory of the worker process.
+"""
+import bisect
+import threading
+from typing import Sequence
+
+# Upper bounds of the histogram buckets for durations in seconds and for sizes in bytes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+_lock = threading.Lock()
+# Metric name -> (type, help text), in declaration order
+_descriptions: dict[str, tuple[str, str]] = {}
+# Metric name -> {sorted label items -> value}; histograms hold [bucket counts..., sum, count]
+_values: dict[str, dict[tuple, float | list[float]]] = {}
+# Histogram name -> bucket upper bounds
+_buckets: dict[str, tuple[float, ...]] = {}
+
+
+def describe(name: str, metric_type: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+    """
+    Declares a metric. Declaring it again with the same type is a no-op.
+
+    :param name: The metric name, e.g. 'ingest_rows_total'.
+    :param metric_type: 'counter', 'gauge' or 'histogram'.
+    :param help_text: One line describing the metric.
+    :param buckets: The bucket upper bounds of a histogram, in increasing order.
+    """
+    with _lock:
+        existing = _descriptions.get(name)
+        if existing is not None and existing[0] != metric_type:
+            raise ValueError(f"Metric '{name}' is already declared as a {existing[0]}.")
+        _descriptions[name] = (metric_type, help_text)
+        _values.setdefault(name, {})
+        if metric_type == "histogram":
+            _buckets[name] = tuple(buckets)
+
+
+def _key(labels: dict[str, str] | None) -> tuple:
+    return tuple(sorted((labels or {}).items()))
+
+
+def inc(name: str, labels: dict[str, str] | None = None, amount: float = 1.0):
+    """
+    Adds to a counter.
+
+    :param name: A declared metric name.
+    :param labels: The label values, e.g. {'source': 'cobros'}.
+    :param amount: How much to add.
+    """
+    with _lock:
+        values = _values[name]
+        key = _key(labels)
+        values[key] = values.get(key, 0.0) + amount
+
+
+def set_gauge(name: str, labels: dict[str, str] | None, value: float):
+    """
+    Sets a gauge to a value.
+
+    :param name: A declared metric name.
+    :param labels: The label values.
+    :param value: The new value.
+    """
+    with _lock:
+        _values[name][_key(labels)] = value
+
+
+def observe(name: str, labels: dict[str, str] | None, value: float):
+    """
+    Adds an observation to a histogram.
+
+    :param name: A declared histogram name.
+    :param labels: The label values.
+    :param value: The observed value, e.g. a duration in seconds.
+    """
+    buckets = _buckets[name]
+    with _lock:
+        values = _values[name]
+        key = _key(labels)
+        counts = values.get(key)
+        if counts is None:
+            counts = values[key] = [0.0] * (len(buckets) + 2)
+        # Buckets are stored non-cumulatively and summed up when rendered; values
+        # above the last bound only count towards +Inf
+        position = bisect.bisect_left(buckets, value)
+        if position < len(buckets):
+            counts[position] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_sample(name: str, key: tuple, value: float) -> str:
+    labels = ",".join(f'{label}="{_escape(v)}"' for label, v in key)
+    number = int(value) if float(value).is_integer() else value
+    return f"{name}{{{labels}}} {number}" if labels else f"{name} {number}"
+
+
+def render() -> str:
+    """
+    Returns every metric in the Prometheus text exposition format (version 0.0.4).
+    """
+    lines = []
+    with _lock:
+        for name, (metric_type, help_text) in _descriptions.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key, value in _values[name].items():
+                if metric_type != "histogram":
+                    lines.append(_format_sample(name, key, value))
+                    continue
+                cumulative = 0
+                for bound, count in zip(_buckets[name], value):
+                    cumulative += count
+                    lines.append(_format_sample(f"{name}_bucket", key + (("le", bound),), cumulative))
+                lines.append(_format_sample(f"{name}_bucket", key + (("le", "+Inf"),), value[-1]))
+                lines.append(_format_sample(f"{name}_sum", key, value[-2]))
+                lines.append(_format_sample(f"{name}_count", key, value[-1]))
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """
+    Clears every recorded value, keeping the declarations.
+    """
+    with _lock:
+        for values in _values.values():
+            values.clear()
@@ -0,0 +1,146 @@
+"""
+Precomputed patient-name columns, filled at ingest time.
+
+Tables that hold patient names get three derived columns per name, all indexed:
+
+    "<name>__norm"    lowercase and single-spaced, as daily_checks compares names
+    "<name>__folded"  the same without accents, e.g. 'jose garcia' for 'José García'
+    "<name>__key"     the folded words in sorted order, e.g. 'garcia jose', so that
+                      word order does not matter
+
+datos_personales gets them for its composed name (Nombre Apellido1 Apellido2) as
+"NombreCompleto__*", which tratamientos rows carry through their join on the patient
+code; citas gets them for Paciente. The checks read "__norm" instead of rebuilding
+and normalizing every name on every call, and lookups by name can use an index.
+"""
+import sqlite3
+import unicodedata
+from typing import Sequence
+
+import database
+import dimensions
+import partitions
+
+NORM_SUFFIX = "__norm"
+FOLDED_SUFFIX = "__folded"
+KEY_SUFFIX = "__key"
+
+# Table -> (name of the derived columns, source columns joined with spaces)
+NAME_SOURCES = {
+    "datos_personales": ("NombreCompleto", ("Nombre", "Apellido1", "Apellido2")),
+    "citas": ("Paciente", ("Paciente",)),
+}
+
+
+def is_key_column(column: str) -> bool:
+    """
+    Tells whether a column is one of the derived name columns.
+
+    :param column: The column name.
+    :return: True for '<name>__norm', '<name>__folded' and '<name>__key' columns.
+    """
+    return column.endswith((NORM_SUFFIX, FOLDED_SUFFIX, KEY_SUFFIX))
+
+
+def key_columns(name: str) -> tuple[str, str, str]:
+    """
+    Returns the derived columns of a name.
+
+    :param name: The name the columns derive from, e.g. 'Paciente'.
+    :return: A tuple (normalized, accent-folded, word key) column names.
+    """
+    return f"{name}{NORM_SUFFIX}", f"{name}{FOLDED_SUFFIX}", f"{name}{KEY_SUFFIX}"
+
+
+def normalize_name(name: str) -> str:
+    """
+    Lowercases a name and collapses its whitespace.
+    """
+    return " ".join(name.lower().split())
+
+
+def fold_accents(text: str) -> str:
+    """
+    Removes accents and other combining marks, e.g. 'Muñoz' becomes 'Munoz'.
+    """
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def join_name(parts: Sequence[str | None]) -> str:
+    """
+    Joins the parts of a name with spaces, skipping missing ones.
+
+    Empty cells of the HTML exports can reach the database as the text 'nan'; such
+    parts are skipped as well.
+
+    :param parts: The source values, e.g. (Nombre, Apellido1, Apellido2).
+    """
+    return " ".join(str(part) for part in parts if part not in (None, "") and str(part).lower() != "nan")
+
+
+def name_values(parts: Sequence[str | None]) -> tuple[str | None, str | None, str | None]:
+    """
+    Computes the derived values of a name.
+
+    :param parts: The source values, e.g. (Nombre, Apellido1, Apellido2); missing parts are skipped.
+    :return: A tuple (normalized, accent-folded, word key), or three Nones if there is no name.
+    """
+    norm = normalize_name(join_name(parts))
+    if not norm:
+        return None, None, None
+    folded = fold_accents(norm)
+    return norm, folded, " ".join(sorted(folded.split()))
+
+
+def ensure_name_columns(conn: sqlite3.Connection, table_name: str, name: str, sources: Sequence[str],
+                        create_indexes: bool = True) -> bool:
+    """
+    Adds, backfills and indexes the derived columns of a name in a table.
+
+    Columns and indexes that already exist are left alone, so this is cheap to call
+    on every load.
+
+    :param conn: A writer connection.
+    :param table_name: The table to migrate, e.g. 'citas' or its staging table.
+    :param name: The name of the derived columns, from NAME_SOURCES.
+    :param sources: The columns the name is composed of.
+    :param create_indexes: False to leave the indexes out while a staging table is being filled.
+    :return: False if the table lacks a source column, so it has no derived columns.
+    """
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+    if not all(source in existing for source in sources):
+        return False
+
+    columns = key_columns(name)
+    missing = [column for column in columns if column not in existing]
+    for column in missing:
+        conn.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{column}" TEXT')
+    if missing:
+        # Rows loaded before the columns existed are computed once, in Python, as at ingest
+        source_list = ", ".join(f'"{source}"' for source in sources)
+        rows = conn.execute(f'SELECT rowid, {source_list} FROM "{table_name}"').fetchall()
+        assignments = ", ".join(f'"{column}" = ?' for column in columns)
+        conn.executemany(f'UPDATE "{table_name}" SET {assignments} WHERE rowid = ?',
+                         (name_values(row[1:]) + (row[0],) for row in rows))
+    if create_indexes:
+        for column in columns:
+            database.ensure_index(conn, table_name, column)
+    return True
+
+
+def migrate_database(conn: sqlite3.Connection):
+    """
+    Runs ensure_name_columns over every table in NAME_SOURCES that exists.
+
+    Encoded tables get the columns in their storage table (see dimensions.py), and
+    partitioned tables in each of their partitions (see partitions.py).
+
+    :param conn: A writer connection.
+    """
+    for table_name, (name, sources) in NAME_SOURCES.items():
+        if partitions.is_partitioned(conn, table_name):
+            storage_tables = partitions.storage_tables(conn, table_name)
+        else:
+            storage_tables = [dimensions.storage_table(conn, table_name)]
+        for storage_name in storage_tables:
+            ensure_name_columns(conn, storage_name, name, sources)
@@ -0,0 +1,349 @@
+"""
+Year-partitioned storage for the large history tables.
+
+A partitioned table keeps its rows in one table per closed year plus one for the
+years still being loaded:
+
+    "<table>__current"   the last OPEN_YEARS years, rows without a date, and any later rows
+    "<table>__2023"      the rows of 2023, once that year is closed
+    "<table>"            a view with the UNION ALL of them, with the columns of the plain table
+
+Loads only ever write to "<table>__current". A year is closed (moved out of
+"<table>__current" into its own table) by freeze_years, which runs after every
+load of the table and at startup, so the oldest open year closes once a new
+year starts. Rows of tables without a key are read-only once their year is
+closed: the loaders skip rows dated in a closed year. Rows of keyed tables, such
+as the patients of fechas_pacientes, are still corrected by later loads: a load
+compares them with every partition, writes the changed ones to
+"<table>__current", and freeze_years moves each of them into the partition of
+its date, in place of the copy it replaces.
+
+Readers keep querying "<table>". Registered statements that declare they filter a
+partitioned table on the date range of its partition column (see queries.register)
+read only the partitions that overlap the range, from routed_source() below; other
+queries read the whole view.
+
+Encoded tables (see dimensions.py) are not partitioned.
+
+Usage:
+    python partitions.py [table ...]    # partition these tables, or every table in PARTITIONED_TABLES
+"""
+from __future__ import annotations
+
+import argparse
+import re
+import sqlite3
+from datetime import date, datetime, timedelta
+from typing import Callable, Sequence
+
+import change_log
+import database
+import date_keys
+
+# Tables that can be partitioned, with the DATETIME column their rows are partitioned by
+PARTITIONED_TABLES = {
+    "cobros": "Fechadecobro",
+    "tratamientos": "Fecharealizado",
+    "citas": "Fecha",
+    "fechas_pacientes": "Fechadealta",
+}
+
+# The current and the previous year stay in "<table>__current", where reloads can still correct them
+OPEN_YEARS = 2
+
+CURRENT_SUFFIX = "__current"
+
+
+def current_partition(table_name: str) -> str:
+    """
+    Returns the partition that reloads write to, e.g. 'citas__current'.
+    """
+    return table_name + CURRENT_SUFFIX
+
+
+def year_partition(table_name: str, year: int) -> str:
+    """
+    Returns the read-only partition of a closed year, e.g. 'citas__2023'.
+    """
+    return f"{table_name}__{year}"
+
+
+def first_open_year() -> int:
+    """
+    Returns the oldest year still loaded into the current partitions.
+    """
+    return date.today().year - OPEN_YEARS + 1
+
+
+def _object_type(conn: sqlite3.Connection, name: str) -> str | None:
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def is_partitioned(conn: sqlite3.Connection, table_name: str) -> bool:
+    """
+    Tells whether a table is stored partitioned, i.e. is a view over "<table>__current" and its years.
+    """
+    return (table_name in PARTITIONED_TABLES and _object_type(conn, table_name) == "view"
+            and _object_type(conn, current_partition(table_name)) == "table")
+
+
+def closed_years(conn: sqlite3.Connection, table_name: str) -> list[int]:
+    """
+    Returns the closed years of a partitioned table, oldest first.
+    """
+    pattern = re.compile(rf"{re.escape(table_name)}__(\d{{4}})")
+    years = []
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?",
+                                (f"{table_name}%",)):
+        match = pattern.fullmatch(name)
+        if match:
+            years.append(int(match.group(1)))
+    return sorted(years)
+
+
+def storage_tables(conn: sqlite3.Connection, table_name: str) -> list[str]:
+    """
+    Returns the tables holding the rows of a partitioned table, current partition first.
+    """
+    return [current_partition(table_name)] + [year_partition(table_name, year)
+                                              for year in closed_years(conn, table_name)]
+
+
+def _columns(conn: sqlite3.Connection, table_name: str) -> list[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')]
+
+
+def _missing_columns(conn: sqlite3.Connection, table_name: str, partition: str) -> list[str]:
+    # The columns of the current partition that a closed year lacks
+    present = set(_columns(conn, partition))
+    return [column for column in _columns(conn, current_partition(table_name)) if column not in present]
+
+
+def union_sql(conn: sqlite3.Connection, table_name: str, partitions: Sequence[str],
+              columns: Sequence[str] | None = None) -> str:
+    """
+    Returns a SELECT of the given partitions of a table, with the columns of its current partition.
+
+    Columns added to the current partition after a year was closed, e.g. new date
+    shadows, read as NULL in that year.
+
+    :param columns: Only select these columns; all of them by default.
+    """
+    columns = columns or _columns(conn, current_partition(table_name))
+    selects = []
+    for partition in partitions:
+        missing = set(_missing_columns(conn, table_name, partition))
+        select_list = ", ".join(f'NULL AS "{column}"' if column in missing else f'"{column}"' for column in columns)
+        selects.append(f'SELECT {select_list} FROM "{partition}"')
+    return " UNION ALL ".join(selects)
+
+
+def sync_view(conn: sqlite3.Connection, table_name: str):
+    """
+    Creates or recreates the view of a partitioned table when its partitions or their columns changed.
+
+    :param conn: A writer connection.
+    :param table_name: The table the view is named after, e.g. 'citas'.
+    """
+    view_sql = f'CREATE VIEW "{table_name}" AS {union_sql(conn, table_name, storage_tables(conn, table_name))}'
+    row = conn.execute("SELECT type, sql FROM sqlite_master WHERE name = ?", (table_name,)).fetchone()
+    if row == ("view", view_sql):
+        return
+    if row is not None:
+        conn.execute(f'DROP VIEW "{table_name}"')
+    conn.execute(view_sql)
+
+
+def _index_like(conn: sqlite3.Connection, source: str, target: str):
+    # A closed year gets an index on every column the current partition has one on
+    for index in conn.execute(f'PRAGMA index_list("{source}")').fetchall():
+        if index[3] != "c":
+            continue
+        indexed = [row[2] for row in conn.execute(f'PRAGMA index_info("{index[1]}")')]
+        if len(indexed) == 1:
+            database.ensure_index(conn, target, indexed[0])
+
+
+def freeze_years(conn: sqlite3.Connection, table_name: str) -> list[int]:
+    """
+    Moves the rows of the years before first_open_year() out of the current partition
+    into one read-only table per year.
+
+    In a table without a key, rows of a year that already has its own table are
+    dropped from the current partition instead: closed years are never rewritten.
+    In a keyed table, a row whose key is already stored in a closed year replaces
+    that copy if it changed, and is dropped from the current partition if it did
+    not. The view is brought in step with the partitions either way, so this also
+    follows new columns.
+
+    :param conn: A writer connection, inside the caller's transaction.
+    :param table_name: A partitioned table.
+    :return: The years that were closed.
+    """
+    current = current_partition(table_name)
+    ts_column, _ = date_keys.shadow_columns(PARTITIONED_TABLES[table_name])
+    key = change_log.key_columns(conn, current)
+    if key:
+        hash_column = change_log.ROW_HASH_COLUMN
+        for year in closed_years(conn, table_name):
+            partition = year_partition(table_name, year)
+            joined = " AND ".join(f'p."{column}" = c."{column}"' for column in key)
+            # Unchanged copies of frozen rows, e.g. from a full reload, stay where they are
+            conn.execute(f'DELETE FROM "{current}" AS c WHERE EXISTS (SELECT 1 FROM "{partition}" p '
+                         f'WHERE {joined} AND p."{hash_column}" = c."{hash_column}")')
+            # Changed rows take the place of their frozen copy, in the partition of their date
+            conn.execute(f'DELETE FROM "{partition}" AS p WHERE EXISTS (SELECT 1 FROM "{current}" c WHERE {joined})')
+    boundary = date_keys.to_epoch_seconds(datetime(first_open_year(), 1, 1))
+    years = [row[0] for row in conn.execute(
+        f'SELECT DISTINCT CAST(strftime(\'%Y\', "{ts_column}", \'unixepoch\') AS INTEGER) '
+        f'FROM "{current}" WHERE "{ts_column}" < ?', (boundary,))]
+    if not years:
+        sync_view(conn, table_name)
+        return []
+
+    create_sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = ?", (current,)).fetchone()[0]
+    existing = set(closed_years(conn, table_name))
+    closed = []
+    for year in sorted(years):
+        start, end = date_keys.range_bounds(date(year, 1, 1), date(year, 12, 31))
+        partition = year_partition(table_name, year)
+        if year not in existing:
+            conn.execute(f'CREATE TABLE "{partition}" {create_sql[create_sql.index("("):]}')
+            conn.execute(f'INSERT INTO "{partition}" SELECT * FROM "{current}" WHERE "{ts_column}" BETWEEN ? AND ?',
+                         (start, end))
+            _index_like(conn, current, partition)
+            closed.append(year)
+        elif key:
+            # A closed year may lack columns added to the current partition since
+            column_list = ", ".join(f'"{column}"' for column in _columns(conn, partition))
+            conn.execute(f'INSERT INTO "{partition}" ({column_list}) SELECT {column_list} FROM "{current}" '
+                         f'WHERE "{ts_column}" BETWEEN ? AND ?', (start, end))
+        conn.execute(f'DELETE FROM "{current}" WHERE "{ts_column}" BETWEEN ? AND ?', (start, end))
+    sync_view(conn, table_name)
+    return closed
+
+
+def frozen_filter(conn: sqlite3.Connection, table_name: str,
+                  columns: Sequence[str]) -> Callable[[tuple], bool] | None:
+    """
+    Returns a predicate that tells which parsed rows of a partitioned table may be written.
+
+    :param conn: A connection to the database being loaded.
+    :param table_name: The table being loaded.
+    :param columns: The columns of the row tuples.
+    :return: A function of a row, False for rows dated in a closed year; None if
+        every row may be written, e.g. for a table that is not partitioned, or one
+        with a key, whose rows replace their frozen copy (see freeze_years).
+    """
+    if not is_partitioned(conn, table_name) or PARTITIONED_TABLES[table_name] not in columns:
+        return None
+    if change_log.key_columns(conn, current_partition(table_name)):
+        return None
+    years = set(closed_years(conn, table_name))
+    if not years:
+        return None
+    position = list(columns).index(PARTITIONED_TABLES[table_name])
+
+    def writable(row: tuple) -> bool:
+        value = row[position]
+        if not isinstance(value, str) or not value[:4].isdigit():
+            return True
+        return int(value[:4]) not in years
+
+    return writable
+
+
+def _year(epoch_seconds: int) -> int:
+    return (date_keys.EPOCH + timedelta(seconds=epoch_seconds)).year
+
+
+def routed_source(conn: sqlite3.Connection, table_name: str, columns: Sequence[str] | None,
+                  bounds: Sequence[int]) -> str:
+    """
+    Returns what a statement reading a table by date range should read instead of the
+    table: the partitions the range overlaps, if the table is partitioned.
+
+    The statement must filter the table on its partition column with the bounds, as
+    the statements registered with queries.register(..., partitioned=...) do.
+
+    :param conn: The connection the statement will run on.
+    :param table_name: The table, e.g. 'cobros'.
+    :param columns: The columns the statement reads from the table, or None for all of them.
+        The epoch-seconds shadow of the partition column, which the range filters on, is read either way.
+    :param bounds: The (lower, upper) epoch-second bounds of the range.
+    :return: The quoted table name, a partition, or a subquery with the UNION ALL of the partitions.
+    """
+    if not is_partitioned(conn, table_name):
+        return f'"{table_name}"'
+    lower, upper = bounds
+    years = range(_year(lower), _year(upper) + 1)
+    closed = set(closed_years(conn, table_name))
+    partitions = [year_partition(table_name, year) for year in years if year in closed]
+    # Every year without its own table, and rows without a date, are in the current partition
+    if not all(year in closed for year in years):
+        partitions.insert(0, current_partition(table_name))
+    if len(partitions) == 1 and not _missing_columns(conn, table_name, partitions[0]):
+        return f'"{partitions[0]}"'
+    if columns is not None:
+        # SQLite computes every column of a UNION ALL subquery, so only those the statement reads are selected
+        ts_column, _ = date_keys.shadow_columns(PARTITIONED_TABLES[table_name])
+        columns = list(dict.fromkeys([ts_column, *columns]))
+    # An empty range keeps the statement's shape and reads no rows
+    if not partitions:
+        return f"({union_sql(conn, table_name, [current_partition(table_name)], columns)} LIMIT 0)"
+    return f"({union_sql(conn, table_name, partitions, columns)})"
+
+
+def partition_table(db_path: str, table_name: str) -> bool:
+    """
+    Converts a plain table into a partitioned one, in one transaction.
+
+    The table is renamed to "<table>__current", its closed years are moved out by
+    freeze_years and the view takes its name.
+
+    :param db_path: The path to the SQLite database file.
+    :param table_name: One of PARTITIONED_TABLES.
+    :return: False if the table is missing, already partitioned, or not a plain table.
+    """
+    with database.get_pool(db_path).writer() as conn:
+        if _object_type(conn, table_name) != "table":
+            return False
+        conn.execute("PRAGMA legacy_alter_table = ON")
+        try:
+            # DDL does not open a transaction by itself; the rename and the view must commit together
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f'ALTER TABLE "{table_name}" RENAME TO "{current_partition(table_name)}"')
+            if _object_type(conn, "sqlite_stat1") == "table":
+                # Renaming leaves the statistics under the old table name
+                conn.execute("UPDATE sqlite_stat1 SET tbl = ? WHERE tbl = ?", (current_partition(table_name), table_name))
+            closed = freeze_years(conn, table_name)
+            database.bump_data_version(conn, table_name)
+        finally:
+            conn.execute("PRAGMA legacy_alter_table = OFF")
+    print(f"Partitioned '{table_name}'; closed years: {', '.join(map(str, closed)) or 'none'}.")
+    return True
+
+
+def migrate_database(conn: sqlite3.Connection):
+    """
+    Closes the years that ended since the last load and recreates the views of partitioned tables.
+
+    Run it after the other migrations, which may add columns to the partitions.
+
+    :param conn: A writer connection.
+    """
+    for table_name in PARTITIONED_TABLES:
+        if is_partitioned(conn, table_name):
+            freeze_years(conn, table_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("tables", nargs="*", help="tables to partition; every table in PARTITIONED_TABLES by default")
+    parser.add_argument("--db", default=database.DB_PATH, help="the SQLite database file")
+    args = parser.parse_args()
+
+    for table in args.tables or PARTITIONED_TABLES:
+        partition_table(args.db, table)
+    database.close_pools()
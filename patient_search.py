@@ -0,0 +1,216 @@
+"""
+Full-text patient search over names, phones and DNI, backed by an SQLite FTS5 index.
+
+The index lives in the '_patient_search' virtual table. Every patient of
+datos_personales and every distinct (Paciente, Teléfono) pair of citas is one
+entry, with its name, its phone numbers and its DNI. The loaders rebuild the
+entries of a table after writing it (index_table), and migrate_database fills
+the index of an existing database at startup.
+
+Names are matched without regard to case or accents, and every word of the query
+is a prefix: 'gar jos' finds 'José García'. Phone numbers are indexed as digits
+only, with and without the country code, so '626 28' and '+34 626 28' both find
+'+34 626 286 423'. Results are ranked with bm25 and give one entry per patient.
+"""
+from __future__ import annotations
+
+import re
+import sqlite3
+
+import database
+import name_keys
+
+SEARCH_TABLE = "_patient_search"
+
+# Tables indexed for the search, with the columns each entry is made of; columns a
+# loaded table does not have are left out
+INDEXED_TABLES = {
+    "datos_personales": {"name": ("Nombre", "Apellido1", "Apellido2"), "phone": ("Teléfono", "Móvil"),
+                         "dni": ("Dni",), "code": "Código"},
+    "citas": {"name": ("Paciente",), "phone": ("Teléfono",), "dni": (), "code": None},
+}
+
+# Local numbers are the last digits of a phone; they are indexed on their own as well
+LOCAL_PHONE_DIGITS = 9
+# Most results returned by search()
+MAX_RESULTS = 100
+
+
+def _create_search_table(conn: sqlite3.Connection):
+    conn.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        "name, phone, dni, source UNINDEXED, code UNINDEXED, name_norm UNINDEXED, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+
+
+def phone_tokens(*phones) -> str:
+    """
+    Returns the indexed form of phone numbers: their digits, plus the local number when a prefix is present.
+
+    :param phones: Phone numbers as loaded, e.g. '+34 626 286 423'; None and blanks are skipped.
+    :return: The tokens separated by spaces, e.g. '34626286423 626286423'.
+    """
+    tokens = []
+    for phone in phones:
+        if isinstance(phone, float) and phone.is_integer():
+            # A phone column inferred as numeric
+            phone = int(phone)
+        digits = re.sub(r"\D", "", str(phone)) if phone is not None else ""
+        if not digits:
+            continue
+        tokens.append(digits)
+        if len(digits) > LOCAL_PHONE_DIGITS:
+            tokens.append(digits[-LOCAL_PHONE_DIGITS:])
+    return " ".join(dict.fromkeys(tokens))
+
+
+def _entries(conn: sqlite3.Connection, table_name: str):
+    spec = INDEXED_TABLES[table_name]
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+    name_columns = [c for c in spec["name"] if c in existing]
+    phone_columns = [c for c in spec["phone"] if c in existing]
+    dni_columns = [c for c in spec["dni"] if c in existing]
+    code_column = spec["code"] if spec["code"] in existing else None
+    if not name_columns:
+        return
+
+    selected = name_columns + phone_columns + dni_columns + ([code_column] if code_column else [])
+    select_list = ", ".join(f'"{c}"' for c in selected)
+    # citas repeats a patient on every appointment; one entry per name and phone is enough
+    distinct = "" if code_column else "DISTINCT "
+    for row in conn.execute(f'SELECT {distinct}{select_list} FROM "{table_name}"'):
+        names = row[:len(name_columns)]
+        norm, _, _ = name_keys.name_values(names)
+        if norm is None:
+            continue
+        position = len(name_columns)
+        phones = row[position:position + len(phone_columns)]
+        position += len(phone_columns)
+        dni = name_keys.join_name(row[position:position + len(dni_columns)])
+        code = row[-1] if code_column else None
+        yield name_keys.join_name(names), phone_tokens(*phones), dni, table_name, code, norm
+
+
+def _index_rows(conn: sqlite3.Connection, table_name: str) -> int:
+    _create_search_table(conn)
+    conn.execute(f"DELETE FROM {SEARCH_TABLE} WHERE source = ?", (table_name,))
+    cursor = conn.executemany(
+        f"INSERT INTO {SEARCH_TABLE} (name, phone, dni, source, code, name_norm) VALUES (?, ?, ?, ?, ?, ?)",
+        _entries(conn, table_name)
+    )
+    return max(cursor.rowcount, 0)
+
+
+def index_table(db_path: str, table_name: str) -> int:
+    """
+    Replaces the search entries of a table with its current rows, in one transaction.
+
+    :param db_path: The path to the SQLite database file.
+    :param table_name: The table that was loaded. Must be one of INDEXED_TABLES.
+    :return: The number of entries indexed.
+    """
+    with database.get_pool(db_path).writer() as conn:
+        rows = _index_rows(conn, table_name)
+    print(f"Indexed {rows} patient search entries of '{table_name}'.")
+    return rows
+
+
+def migrate_database(conn: sqlite3.Connection):
+    """
+    Creates the search index and fills it for every indexed table that has rows but no entries yet.
+
+    :param conn: A writer connection.
+    """
+    _create_search_table(conn)
+    for table_name in INDEXED_TABLES:
+        # Encoded and partitioned tables are views
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?",
+                            (table_name,)).fetchone():
+            continue
+        if conn.execute(f"SELECT 1 FROM {SEARCH_TABLE} WHERE source = ? LIMIT 1", (table_name,)).fetchone():
+            continue
+        _index_rows(conn, table_name)
+
+
+def match_expression(text: str) -> str | None:
+    """
+    Turns what the user typed into an FTS5 query where every word is a prefix.
+
+    A query made of digits and phone punctuation only is one phone number, so
+    '626 286' looks up numbers starting with 626286.
+
+    :param text: The search text, e.g. 'garcia jos' or '+34 626 286'.
+    :return: The MATCH expression, or None if the text has nothing to search for.
+    """
+    compact = re.sub(r"[\s+\-().]", "", text)
+    words = [compact] if compact.isdigit() else re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search(conn: sqlite3.Connection, text: str, limit: int = 20) -> list[dict]:
+    """
+    Finds patients by partial name, phone or DNI.
+
+    :param conn: A reader connection, e.g. from database.snapshot_reader.
+    :param text: The search text.
+    :param limit: The most patients to return, up to MAX_RESULTS.
+    :return: One dictionary per patient, best match first, with the 'name', 'code'
+        (Código in datos_personales, when known), 'dni', 'phones' and the 'source'
+        table of the best matching entry.
+    """
+    expression = match_expression(text)
+    if expression is None:
+        return []
+    limit = max(1, min(limit, MAX_RESULTS))
+    # Entries of one patient are merged below, so a few more are fetched than returned
+    rows = conn.execute(
+        f"SELECT name, phone, dni, source, code, name_norm FROM {SEARCH_TABLE} "
+        f"WHERE {SEARCH_TABLE} MATCH ? ORDER BY rank LIMIT ?",
+        (expression, limit * 4)
+    ).fetchall()
+
+    # A patient is one datos_personales code; appointment entries, which have no code,
+    # are merged with the first patient of the same name
+    results, by_code, by_name = [], {}, {}
+    for name, phone, dni, source, code, name_norm in rows:
+        same_name = by_name.get(name_norm)
+        result = by_code.get(code) if code is not None else same_name
+        if result is None and same_name is not None and same_name["code"] is None:
+            # The patient was first found through an appointment
+            result = same_name
+            result["code"] = code
+            by_code[code] = result
+        if result is None:
+            if len(results) == limit:
+                continue
+            result = {"name": name, "code": code, "dni": dni or None, "phones": [], "source": source}
+            results.append(result)
+            by_name.setdefault(name_norm, result)
+            if code is not None:
+                by_code[code] = result
+        result["dni"] = result["dni"] or dni or None
+        # A local number and the full number it ends are one phone; the full number is kept
+        for number in phone.split():
+            same = [known for known in result["phones"] if known.endswith(number) or number.endswith(known)]
+            if not same:
+                result["phones"].append(number)
+            elif len(number) > len(same[0]):
+                result["phones"][result["phones"].index(same[0])] = number
+
+    # Look up the code of appointment patients that datos_personales has under the same name
+    unknown = {name_norm: result for name_norm, result in by_name.items() if result["code"] is None}
+    if unknown:
+        norm_column = name_keys.key_columns(name_keys.NAME_SOURCES["datos_personales"][0])[0]
+        placeholders = ", ".join("?" for _ in unknown)
+        try:
+            for name_norm, code in conn.execute(
+                    f'SELECT "{norm_column}", Código FROM datos_personales WHERE "{norm_column}" IN ({placeholders})',
+                    list(unknown)):
+                unknown[name_norm]["code"] = code
+        except sqlite3.OperationalError:
+            # datos_personales is not loaded yet
+            pass
+    return results
@@ -0,0 +1,197 @@
+"""
+A sampling profiler for single API requests.
+
+While it is active, a background thread records, at a fixed interval, the call
+stacks of the threads working on the profiled request: the thread that entered the
+profiler, and every thread running part of the request inside follow(), e.g. the
+threadpool worker of a sync endpoint or an async_db worker. Only stacks running
+code from this project are kept, so idle waits do not dilute the result. The
+report lists, per function, the share of samples spent in the function itself ('own', like cProfile's tottime)
+and in it or anything it called ('total', like cumtime):
+
+    with profiler.SamplingProfiler() as sampler:
+        perform_appointment_checks(from_date, to_date)
+    print(sampler.report())
+
+Sampling keeps the overhead on the profiled code low at the cost of precision:
+the sampler only runs when it gets the GIL, so a short request yields few samples
+and the percentages are estimates rather than exact call timings.
+
+Samples are taken per thread, not per request. The event loop thread also runs the
+async parts of every other request, and one profile at a time is the most that
+can be told apart, so entering a second SamplingProfiler while one is running
+raises ProfilerBusy. Work the request hands to other processes, e.g. file parsing
+in database_utils' parse pool, or to threads outside follow() is not sampled.
+"""
+from __future__ import annotations
+
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, TypeVar
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_INTERVAL_SECONDS = 0.001
+
+# (file name, first line, function name)
+Frame = tuple[str, int, str]
+
+T = TypeVar("T")
+
+# The profiler of the current context, e.g. one API request; see follow()
+_active: ContextVar[SamplingProfiler | None] = ContextVar("profiler", default=None)
+
+# Held by the running SamplingProfiler
+_running = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    """
+    Raised when a SamplingProfiler is entered while another one is running.
+    """
+
+
+def _in_project(frame: Frame) -> bool:
+    # Module-level code (e.g. 'python main.py' running uvicorn) is on the stack of
+    # the main thread for its whole life, so it does not make a stack interesting
+    file_name, _, function = frame
+    return file_name.startswith(PROJECT_DIR) and file_name != __file__ and function != "<module>"
+
+
+def _location(frame: Frame) -> str:
+    file_name, line, function = frame
+    if file_name.startswith(PROJECT_DIR):
+        file_name = os.path.relpath(file_name, PROJECT_DIR)
+    elif "site-packages" in file_name:
+        file_name = file_name.split("site-packages" + os.sep, 1)[1]
+    else:
+        file_name = os.path.basename(file_name)
+    return f"{function} ({file_name}:{line})"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the threads working in its context while used as a context manager.
+
+    :param interval: Seconds between samples.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.samples = 0
+        self.seconds = 0.0
+        self._own: Counter[Frame] = Counter()
+        self._total: Counter[Frame] = Counter()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._started = 0.0
+        # How many follow() blocks each profiled thread is in
+        self._threads: Counter[int] = Counter()
+        self._threads_lock = threading.Lock()
+        self._token = None
+
+    def __enter__(self) -> SamplingProfiler:
+        if not _running.acquire(blocking=False):
+            raise ProfilerBusy("Another request is being profiled")
+        self._token = _active.set(self)
+        self._add_thread(threading.get_ident())
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.seconds = time.perf_counter() - self._started
+        _active.reset(self._token)
+        _running.release()
+
+    def _add_thread(self, thread_id: int):
+        with self._threads_lock:
+            self._threads[thread_id] += 1
+
+    def _remove_thread(self, thread_id: int):
+        with self._threads_lock:
+            self._threads[thread_id] -= 1
+            if not self._threads[thread_id]:
+                del self._threads[thread_id]
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            with self._threads_lock:
+                profiled = set(self._threads)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in profiled:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                if not any(_in_project(f) for f in stack):
+                    continue
+                self.samples += 1
+                self._own[stack[0]] += 1
+                # A recursive function counts once per sample towards its total
+                self._total.update(set(stack))
+
+    def report(self, title: str = "Profile", limit: int = 40) -> str:
+        """
+        Formats the samples as a table of this project's functions, and of any function
+        samples were taken in, with the largest total share first.
+
+        :param title: The first line of the report, e.g. the request it profiles.
+        :param limit: How many functions to list.
+        :return: The report as plain text.
+        """
+        lines = [f"{title}: {self.seconds:.3f}s wall, {self.samples} samples "
+                 f"every {self.interval * 1000:g}ms", ""]
+        if not self.samples:
+            lines.append("No samples were taken in this project's code.")
+            return "\n".join(lines) + "\n"
+        lines.append(f"{'own %':>7}{'total %':>9}  function")
+        # Server and framework frames wrap every sample; only list them where time was spent
+        frames = [f for f in self._total if _in_project(f) or self._own[f]]
+        ranked = sorted(frames, key=lambda f: (self._total[f], self._own[f]), reverse=True)
+        for frame in ranked[:limit]:
+            own = 100 * self._own[frame] / self.samples
+            total = 100 * self._total[frame] / self.samples
+            lines.append(f"{own:>7.1f}{total:>9.1f}  {_location(frame)}")
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def follow() -> Iterator[None]:
+    """
+    Samples the current thread for the profiler of the current context, if there is one.
+
+    Threads that run part of a profiled request enter this with the request's
+    context, e.g. through async_db.run or a thread pool that copies it.
+    """
+    sampler = _active.get()
+    if sampler is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    sampler._add_thread(thread_id)
+    try:
+        yield
+    finally:
+        sampler._remove_thread(thread_id)
+
+
+def followed(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Wraps a function so that its calls run inside follow().
+    """
+    @functools.wraps(func)
+    def run_followed(*args: Any, **kwargs: Any) -> T:
+        with follow():
+            return func(*args, **kwargs)
+    return run_followed
@@ -0,0 +1,438 @@
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Sequence
+
+import date_keys
+import dimensions
+import partitions
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Queries slower than this are logged with their name and duration.
+SLOW_QUERY_SECONDS = 0.5
+
+GRANULARITIES = ("day", "month", "year")
+
+# Named SQL statements. The text of a statement never changes between calls, only
+# its parameters, so sqlite3's per-connection statement cache prepares it once per
+# pooled connection and reuses it afterwards.
+_statements: dict[str, str] = {}
+
+# Statements that read partitioned tables by date range (see partitions.py): statement
+# name -> (SQL with a {<table>} placeholder per such table, {table: columns read or None}).
+_partitioned: dict[str, tuple[str, dict[str, tuple[str, ...] | None]]] = {}
+
+# Variants of statements that read dictionary-encoded tables on their keys (see
+# dimensions.py): statement name -> (table, SQL). A variant is run instead of the
+# statement while its table is encoded.
+_encoded_variants: dict[str, tuple[str, str]] = {}
+
+
+@dataclass
+class QueryStats:
+    calls: int = 0
+    rows: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+_stats: dict[str, QueryStats] = {}
+_stats_lock = threading.Lock()
+
+# Seconds spent in the database by the current context, e.g. one API request; see track_db_time()
+_db_seconds: ContextVar[list[float] | None] = ContextVar("db_seconds", default=None)
+
+
+def register(name: str, sql: str, partitioned: dict[str, Sequence[str] | None] | None = None) -> str:
+    """
+    Adds a named statement to the registry.
+
+    Registering the same name again with the same SQL is a no-op.
+
+    :param name: The name callers use to run the statement.
+    :param sql: The parameterized SQL text.
+    :param partitioned: The partitioned tables the statement filters on the date range
+        of their partition column (see partitions.PARTITIONED_TABLES), mapped to the
+        columns it reads from them, or None for all of them; e.g. {"cobros": ["Importecobrado"]}.
+        These tables are written as placeholders in the SQL, e.g. 'FROM {cobros}',
+        and the statement's parameters must be the range's two bounds. While a table
+        is partitioned, only the partitions the range overlaps are read.
+    :return: The name, for convenience.
+    """
+    if partitioned:
+        for table_name in partitioned:
+            if table_name not in partitions.PARTITIONED_TABLES:
+                raise ValueError(f"Query '{name}' routes '{table_name}', which is not a partitioned table.")
+        template, sql = sql, sql.format(**{table_name: f'"{table_name}"' for table_name in partitioned})
+    existing = _statements.get(name)
+    if existing is not None and existing != sql:
+        raise ValueError(f"Query '{name}' is already registered with different SQL.")
+    _statements[name] = sql
+    if partitioned:
+        _partitioned[name] = (template, {table_name: tuple(columns) if columns is not None else None
+                                         for table_name, columns in partitioned.items()})
+    return name
+
+
+def get_sql(name: str) -> str:
+    """
+    Returns the SQL text of a registered statement.
+
+    :param name: The statement name.
+    :return: The SQL text.
+    """
+    try:
+        return _statements[name]
+    except KeyError:
+        raise KeyError(f"Unknown query '{name}'.") from None
+
+
+def register_encoded(name: str, table_name: str, sql: str) -> str:
+    """
+    Adds the variant of a registered statement for when a table it reads is dictionary-encoded.
+
+    The variant must return the same rows, e.g. by grouping and filtering on the
+    keys in "<table>__data" and joining the dimension table afterwards.
+
+    :param name: The name of the registered statement.
+    :param table_name: The table whose encoding selects the variant, e.g. 'tratamientos'.
+    :param sql: The parameterized SQL text, with the same parameters as the statement.
+    :return: The name, for convenience.
+    """
+    get_sql(name)
+    _encoded_variants[name] = (table_name, sql)
+    return name
+
+
+def resolve_sql(conn: sqlite3.Connection, name: str, params: Sequence[Any] = ()) -> str:
+    """
+    Returns the SQL text to run a registered statement with on a connection's database:
+    its encoded variant if it has one and the table is encoded there, else the statement.
+
+    The partitioned tables it was registered with are replaced by the partitions the
+    range overlaps (see register).
+
+    :param conn: The connection the statement will run on.
+    :param name: The statement name.
+    :param params: The values that will be bound to the statement's placeholders.
+    :return: The SQL text.
+    """
+    variant = _encoded_variants.get(name)
+    if variant is not None and dimensions.is_encoded(conn, variant[0]):
+        return variant[1]
+    routed = _partitioned.get(name)
+    if routed is None:
+        return get_sql(name)
+    template, tables = routed
+    return template.format(**{table_name: partitions.routed_source(conn, table_name, columns, params)
+                              for table_name, columns in tables.items()})
+
+
+def statement_names() -> list[str]:
+    """
+    Returns the names of every registered statement, in registration order.
+    """
+    return list(_statements)
+
+
+def track_db_time() -> list[float]:
+    """
+    Starts adding up the time the current context spends in the database.
+
+    Tasks and worker threads started from this context afterwards add to the same
+    total, so an API middleware can call this before handing the request on.
+
+    :return: A one-element list holding the seconds spent so far.
+    """
+    total = [0.0]
+    _db_seconds.set(total)
+    return total
+
+
+def add_db_time(seconds: float):
+    """
+    Adds database time spent outside the named statements, e.g. by the loaders,
+    to the total started by track_db_time(). Does nothing if none was started.
+    """
+    total = _db_seconds.get()
+    if total is not None:
+        total[0] += seconds
+
+
+def _record(name: str, seconds: float, rows: int):
+    add_db_time(seconds)
+    with _stats_lock:
+        stats = _stats.setdefault(name, QueryStats())
+        stats.calls += 1
+        stats.rows += rows
+        stats.total_seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+    if seconds >= SLOW_QUERY_SECONDS:
+        logging.warning(f"Slow query '{name}': {seconds:.3f}s for {rows} rows")
+
+
+def fetch_all(conn: sqlite3.Connection, name: str, params: Sequence[Any] = (),
+              row_factory=None) -> list:
+    """
+    Runs a registered statement and returns all of its rows, recording how long it took.
+
+    :param conn: The connection to run it on.
+    :param name: The statement name.
+    :param params: The values bound to the statement's placeholders.
+    :param row_factory: Optional row factory for the cursor, e.g. sqlite3.Row.
+    :return: A list of rows.
+    """
+    sql = resolve_sql(conn, name, params)
+    start = time.perf_counter()
+    cursor = conn.cursor()
+    if row_factory is not None:
+        cursor.row_factory = row_factory
+    rows = cursor.execute(sql, tuple(params)).fetchall()
+    _record(name, time.perf_counter() - start, len(rows))
+    return rows
+
+
+def read_frame(conn: sqlite3.Connection, name: str, params: Sequence[Any] = ()) -> pd.DataFrame:
+    """
+    Runs a registered statement and returns its rows as a DataFrame.
+
+    :param conn: The connection to run it on.
+    :param name: The statement name.
+    :param params: The values bound to the statement's placeholders.
+    :return: A pandas DataFrame with one column per selected column.
+    """
+    import pandas as pd
+
+    sql = resolve_sql(conn, name, params)
+    start = time.perf_counter()
+    cursor = conn.execute(sql, tuple(params))
+    rows = cursor.fetchall()
+    df = pd.DataFrame.from_records(rows, columns=[d[0] for d in cursor.description])
+    _record(name, time.perf_counter() - start, len(rows))
+    return df
+
+
+def get_stats() -> list[dict]:
+    """
+    Returns the timing of every statement run by this process, slowest in total first.
+
+    :return: A list of dictionaries with calls, rows, total/mean/max seconds per query.
+    """
+    with _stats_lock:
+        snapshot = {name: QueryStats(**vars(stats)) for name, stats in _stats.items()}
+    return sorted(
+        (
+            {
+                "query": name,
+                "calls": stats.calls,
+                "rows": stats.rows,
+                "total_seconds": round(stats.total_seconds, 6),
+                "mean_seconds": round(stats.total_seconds / stats.calls, 6),
+                "max_seconds": round(stats.max_seconds, 6),
+            }
+            for name, stats in snapshot.items()
+        ),
+        key=lambda row: row["total_seconds"],
+        reverse=True,
+    )
+
+
+def reset_stats():
+    """
+    Clears the recorded query timings.
+    """
+    with _stats_lock:
+        _stats.clear()
+
+
+def rows_in_range(table_name: str, date_column: str, columns: Sequence[str] | None = None) -> str:
+    """
+    Returns the name of the statement selecting a table's rows within a date range,
+    registering it the first time a table/column pair is seen.
+
+    Rows of 'tratamientos' are joined with 'datos_personales' to carry the patient name
+    and its name keys (see name_keys.py).
+
+    :param table_name: The table to read.
+    :param date_column: The DATETIME column to filter on.
+    :param columns: Only select these columns of the table, in this order; all of them by default.
+        The patient name columns of the 'tratamientos' join are added either way.
+    :return: The statement name. Its parameters are the epoch-second bounds.
+    """
+    ts_column, _ = date_keys.shadow_columns(date_column)
+    selected = ", ".join(f't."{column}"' for column in columns) if columns else "t.*"
+    if table_name == "tratamientos":
+        sql = f"""
+            SELECT {selected}, dp.Nombre, dp.Apellido1, dp.Apellido2,
+                   dp."NombreCompleto__norm", dp."NombreCompleto__folded", dp."NombreCompleto__key"
+            FROM {{{table_name}}} t
+            LEFT JOIN datos_personales dp ON t.CódigoPaciente = dp.Código
+            WHERE t."{ts_column}" BETWEEN ? AND ?
+        """
+        read = [*columns, "CódigoPaciente"] if columns else None
+    else:
+        sql = f'SELECT {selected} FROM {{{table_name}}} t WHERE t."{ts_column}" BETWEEN ? AND ?'
+        read = list(columns) if columns else None
+    name = f"{table_name}_in_range:{date_column}"
+    if columns:
+        name += f"[{','.join(columns)}]"
+    if partitions.PARTITIONED_TABLES.get(table_name) == date_column:
+        return register(name, sql, partitioned={table_name: read})
+    return register(name, sql.format(**{table_name: f'"{table_name}"'}))
+
+
+# --- Commission statements ---
+
+# Only the columns commissions3 reads; see records.py
+register("commission_payments_in_range", """
+    SELECT c.Fecha, c.Código, c.Paciente, c.Tratamiento, c.Diente, c.Descripción,
+           c.Realizado, c.Cobrado, c.Seguro, c.Costelab, dp.Cómonoshaconocido
+    FROM comisiones c
+    LEFT JOIN datos_personales dp ON c.Código = dp.Código
+    WHERE c."Fecha__ts" BETWEEN ? AND ?
+""")
+
+# --- Dashboard statements; all take the epoch-second bounds of the range ---
+
+register("revenue", """
+    SELECT SUM(Importecobrado)
+    FROM {cobros}
+    WHERE "Fechadecobro__ts" BETWEEN ? AND ?
+""", partitioned={"cobros": ["Importecobrado"]})
+
+register("new_patients", """
+    SELECT COUNT(*)
+    FROM {fechas_pacientes}
+    WHERE "Fechadealta__ts" BETWEEN ? AND ?
+""", partitioned={"fechas_pacientes": []})
+
+register("new_appointments", """
+    SELECT COUNT(*)
+    FROM {citas}
+    WHERE "Fecha__ts" BETWEEN ? AND ?
+""", partitioned={"citas": []})
+
+register("treatment_distribution", """
+    SELECT
+        Especialidad,
+        COUNT(*) as treatment_count
+    FROM {tratamientos}
+    WHERE "Fecharealizado__ts" BETWEEN ? AND ?
+    GROUP BY Especialidad
+    ORDER BY treatment_count DESC
+""", partitioned={"tratamientos": ["Especialidad"]})
+register_encoded("treatment_distribution", "tratamientos", """
+    SELECT
+        d.value AS Especialidad,
+        g.treatment_count
+    FROM (
+        SELECT Especialidad, COUNT(*) as treatment_count
+        FROM tratamientos__data
+        WHERE "Fecharealizado__ts" BETWEEN ? AND ?
+        GROUP BY Especialidad
+    ) g
+    LEFT JOIN "_dim_Especialidad" d ON d.id = g.Especialidad
+    ORDER BY g.treatment_count DESC
+""")
+
+register("total_unique_patients", """
+    SELECT COUNT(DISTINCT CódigoPaciente)
+    FROM {tratamientos}
+    WHERE "Fecharealizado__ts" BETWEEN ? AND ?
+""", partitioned={"tratamientos": ["CódigoPaciente"]})
+
+register("aesthetic_total_spending", """
+    SELECT SUM(Precio)
+    FROM {tratamientos}
+    WHERE Especialidad = 'ESTETICA' AND "Fecharealizado__ts" BETWEEN ? AND ?
+""", partitioned={"tratamientos": ["Especialidad", "Precio"]})
+register_encoded("aesthetic_total_spending", "tratamientos", """
+    SELECT SUM(Precio)
+    FROM tratamientos__data
+    WHERE Especialidad = (SELECT id FROM "_dim_Especialidad" WHERE value = 'ESTETICA')
+      AND "Fecharealizado__ts" BETWEEN ? AND ?
+""")
+
+register("unique_aesthetic_patients", """
+    SELECT COUNT(DISTINCT CódigoPaciente)
+    FROM {tratamientos}
+    WHERE Especialidad = 'Estetica' AND "Fecharealizado__ts" BETWEEN ? AND ?
+""", partitioned={"tratamientos": ["Especialidad", "CódigoPaciente"]})
+register_encoded("unique_aesthetic_patients", "tratamientos", """
+    SELECT COUNT(DISTINCT CódigoPaciente)
+    FROM tratamientos__data
+    WHERE Especialidad = (SELECT id FROM "_dim_Especialidad" WHERE value = 'Estetica')
+      AND "Fecharealizado__ts" BETWEEN ? AND ?
+""")
+
+def _period_columns(column: str, granularity: str) -> list[str]:
+    # The shadow columns date_keys.period_key_sql buckets on, besides the epoch seconds
+    return [] if granularity == "day" else [date_keys.shadow_columns(column)[1]]
+
+
+# Period statements come in one variant per granularity, e.g. 'revenue_by_period:month'.
+for _granularity in GRANULARITIES:
+    register(f"revenue_by_period:{_granularity}", f"""
+        SELECT
+            {date_keys.period_key_sql("Fechadecobro", _granularity)} as period,
+            SUM(Importecobrado) as total_revenue
+        FROM {{cobros}}
+        WHERE "Fechadecobro__ts" BETWEEN ? AND ?
+        GROUP BY period
+        ORDER BY period
+    """, partitioned={"cobros": ["Importecobrado", *_period_columns("Fechadecobro", _granularity)]})
+
+    register(f"new_patients_by_period:{_granularity}", f"""
+        SELECT
+            {date_keys.period_key_sql("Fechadealta", _granularity)} as period,
+            COUNT(*) as new_patients_count
+        FROM {{fechas_pacientes}}
+        WHERE "Fechadealta__ts" BETWEEN ? AND ?
+        GROUP BY period
+        ORDER BY period
+    """, partitioned={"fechas_pacientes": _period_columns("Fechadealta", _granularity)})
+
+    register(f"new_appointments_by_period:{_granularity}", f"""
+        SELECT
+            {date_keys.period_key_sql("Fecha", _granularity)} as period,
+            COUNT(*) as new_appointments_count
+        FROM {{citas}}
+        WHERE "Fecha__ts" BETWEEN ? AND ?
+        GROUP BY period
+        ORDER BY period
+    """, partitioned={"citas": _period_columns("Fecha", _granularity)})
+
+    register(f"total_patients_by_period:{_granularity}", f"""
+        SELECT
+            {date_keys.period_key_sql("Fecharealizado", _granularity)} as period,
+            COUNT(DISTINCT CódigoPaciente) as total_patients_count
+        FROM {{tratamientos}}
+        WHERE "Fecharealizado__ts" BETWEEN ? AND ?
+        GROUP BY period
+        ORDER BY period
+    """, partitioned={"tratamientos": ["CódigoPaciente", *_period_columns("Fecharealizado", _granularity)]})
+
+    register(f"average_spending_per_patient_by_period:{_granularity}", f"""
+        SELECT
+            period,
+            AVG(patient_spending) as avg_spending_per_patient
+        FROM (
+            SELECT
+                CódigoPaciente,
+                {date_keys.period_key_sql("Fecharealizado", _granularity)} as period,
+                SUM(Precio) as patient_spending
+            FROM {{tratamientos}}
+            WHERE "Fecharealizado__ts" BETWEEN ? AND ?
+            GROUP BY CódigoPaciente, period
+        )
+        GROUP BY period
+        ORDER BY period
+    """, partitioned={"tratamientos": ["CódigoPaciente", "Precio",
+                                       *_period_columns("Fecharealizado", _granularity)]})
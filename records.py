@@ -0,0 +1,108 @@
+"""
+Compact rows for the row-by-row checks and commission calculations.
+
+A dict per fetched row costs a hash table on top of its values, and a SELECT *
+drags along every column even when the consumer reads three of them. A Record
+keeps its values in __slots__ on a class made once per column list, and the
+fetch functions that return records select only the columns their consumer
+names. benchmark_records.py measures the difference on a year of tratamientos.
+
+Records read like the dictionaries they replace, so the check and commission code
+works on either:
+
+    Treatment = records.record_type(["Fecharealizado", "NumDoctor", "Nombre"], extra=["Fecha_normalizada"])
+    row = Treatment(("2025-03-04T10:00:00", "15", "Ana"))
+    row["Nombre"], row.get("Apellido2", ""), dict(row)
+    row["Fecha_normalizada"] = "04-03-2025"
+
+Values derived by the consumer can only be stored in the extra fields declared
+with the type; any other new key raises KeyError. Use dict(record) where a real
+dictionary is needed, e.g. in a JSON response.
+"""
+from __future__ import annotations
+
+import threading
+from collections.abc import Mapping
+from typing import Iterator, Sequence
+
+
+class Record(Mapping):
+    """
+    A row with a fixed set of fields stored in slots. Subclasses are made by record_type().
+    """
+    __slots__ = ()
+    # Field name -> slot name; fields can be any column name, slots must be identifiers
+    _slot_names: dict[str, str] = {}
+    _column_slots: tuple[str, ...] = ()
+
+    def __init__(self, values: Sequence):
+        for slot, value in zip(self._column_slots, values):
+            setattr(self, slot, value)
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, self._slot_names[key])
+        except (KeyError, AttributeError):
+            # Unknown fields and extra fields not assigned yet read like missing keys
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value):
+        slot = self._slot_names.get(key)
+        if slot is None:
+            raise KeyError(f"'{key}' is not a field of this record; declare it as an extra field.")
+        setattr(self, slot, value)
+
+    def __iter__(self) -> Iterator[str]:
+        return (key for key, slot in self._slot_names.items() if hasattr(self, slot))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"Record({dict(self)!r})"
+
+
+_types: dict[tuple[tuple[str, ...], tuple[str, ...]], type[Record]] = {}
+_types_lock = threading.Lock()
+
+
+def record_type(columns: Sequence[str], extra: Sequence[str] = ()) -> type[Record]:
+    """
+    Returns the record class for a column list, creating it the first time.
+
+    :param columns: The fetched columns, in the order of the row tuples.
+    :param extra: Fields the consumer fills in later, e.g. 'Fecha_normalizada'.
+    :return: A Record subclass whose constructor takes one row tuple.
+    """
+    key = (tuple(columns), tuple(extra))
+    with _types_lock:
+        record_class = _types.get(key)
+        if record_class is None:
+            fields = list(key[0]) + [field for field in key[1] if field not in key[0]]
+            slots = tuple(f"_{position}" for position in range(len(fields)))
+            record_class = type("Record", (Record,), {
+                "__slots__": slots,
+                "_slot_names": dict(zip(fields, slots)),
+                "_column_slots": slots[:len(key[0])],
+            })
+            _types[key] = record_class
+        return record_class
+
+
+def row_factory(extra: Sequence[str] = ()):
+    """
+    Returns a cursor row factory that turns rows into records, e.g. for queries.fetch_all.
+
+    The record class is made from the cursor's column names on the first row.
+
+    :param extra: Fields the consumer fills in later.
+    """
+    record_class = None
+
+    def make_record(cursor, row):
+        nonlocal record_class
+        if record_class is None:
+            record_class = record_type([description[0] for description in cursor.description], extra)
+        return record_class(row)
+
+    return make_record
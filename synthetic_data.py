@@ -0,0 +1,320 @@
+"""
+Generates a synthetic clinic database for benchmarking, at any scale.
+
+Fills citas, tratamientos, cobros, comisiones, fechas_pacientes and datos_personales
+with random but consistent rows for a number of clinics over the last few years:
+patients register, book appointments with the doctors in daily_checks.doctors, get
+treated, pay and earn commissions. A small share of the rows carries the mistakes
+the daily checks look for (unknown states, misspelt names, missing treatments,
+wrong doctors). The same seed always produces the same database.
+
+Rows are written through database_utils.write_parsed, with the column types the
+loaders infer from the real exports, so the date shadows, indexes and data versions
+are the same as after a reload from Drive.
+
+Usage:
+    python synthetic_data.py [--clinics 1] [--years 1] [--seed 0] [--db output/data.db]
+
+Stop the API server and the dashboard first: the database file is replaced
+underneath them.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+from datetime import date, datetime, timedelta
+
+import columnar
+import database
+import database_utils
+import patient_search
+from calculate_commissions import doctors_commissions
+from daily_checks import doctors
+
+# One clinic-year is about 8,000 appointments, 7,500 treatments and 6,500 payments
+APPOINTMENTS_PER_DAY = 32
+NEW_PATIENTS_PER_DAY = 3
+DENTISTS_PER_CLINIC = 5
+
+APPOINTMENT_STATES = ["Visita realizada", "No ha venido", "Cancelada", "Programada"]
+APPOINTMENT_STATE_WEIGHTS = [80, 8, 10, 2]
+MISSPELT_NAME_RATE = 0.02
+MISSING_TREATMENT_RATE = 0.03
+WRONG_DOCTOR_RATE = 0.03
+PAID_RATE = 0.85
+
+# (Tratamiento, Descripción, Precio, share of the price that is lab cost) per Especialidad
+TREATMENTS = {
+    "ODONTOLOGIA": [("REC", "RECONSTRUCCIÓN", 80, 0), ("END", "ENDODONCIA", 250, 0),
+                    ("EXO", "EXODONCIA SIMPLE", 60, 0), ("REV", "REVISION", 0, 0)],
+    "HIGIENE": [("LIM", "LIMPIEZA BUCAL", 60, 0)],
+    "IMPLANTOLOGIA": [("IMP", "IMPLANTE", 900, 0.25), ("COR", "CORONA SOBRE IMPLANTE", 600, 0.35)],
+    "ORTODONCIA": [("INV", "INVISALIGN", 3500, 0.3), ("BRK", "ORTODONCIA BRACKETS", 1800, 0.2)],
+    "ESTETICA": [("BOT", "TOXINA BOTULINICA", 300, 0.1), ("AH", "ACIDO HIALURONICO", 350, 0.15),
+                 ("MES", "MESOTERAPIA FACIAL", 150, 0)],
+}
+DENTAL_SPECIALTY_WEIGHTS = {"ODONTOLOGIA": 55, "HIGIENE": 25, "IMPLANTOLOGIA": 12, "ORTODONCIA": 8}
+
+FIRST_NAMES = ["María", "Carmen", "Lucía", "Ana", "Laura", "Marta", "Sofía", "Elena", "Paula", "Julia",
+               "Antonio", "José", "Manuel", "Francisco", "David", "Javier", "Daniel", "Carlos", "Pablo",
+               "Alejandro", "Olena", "Iryna", "Natalia", "Taras", "Polina", "Andrii", "Vitalii"]
+SURNAMES = ["García", "Martínez", "López", "Sánchez", "Pérez", "Gómez", "Martín", "Jiménez", "Ruiz",
+            "Hernández", "Díaz", "Moreno", "Muñoz", "Álvarez", "Romero", "Navarro", "Torres", "Domínguez",
+            "Gil", "Vázquez", "Serrano", "Ramos", "Blanco", "Molina", "Ortiz", "Kovalenko", "Shevchenko"]
+REFERRALS = ["Amigos", "Internet", "Cartel", "Doctoralia", "Referido Anna U", "Referido Juan"]
+DNI_LETTERS = "TRWAGMYFPDXBNJZSQVHLCKE"
+
+# Column types as the loaders infer them from the real exports
+TABLE_COLUMNS = {
+    "datos_personales": [
+        ("Código", "INTEGER PRIMARY KEY"), ("Nombre", "TEXT"), ("Apellido1", "TEXT"), ("Apellido2", "TEXT"),
+        ("Dni", "TEXT"), ("Sexo", "TEXT"), ("Edad", "TEXT"), ("Edadenelalta", "TEXT"),
+        ("Fechadenacimiento", "DATETIME"), ("Dirección", "TEXT"), ("Portal", "TEXT"), ("Puerta", "TEXT"),
+        ("Escalera", "TEXT"), ("Códigopostal", "TEXT"), ("Población", "TEXT"), ("Provincia", "TEXT"),
+        ("Teléfono", "TEXT"), ("Móvil", "TEXT"), ("Email", "TEXT"), ("Moroso", "TEXT"),
+        ("Clasificación", "TEXT"), ("Motivobaja", "TEXT"), ("Cómonoshaconocido", "TEXT"), ("Anotaciones", "TEXT"),
+    ],
+    "fechas_pacientes": [
+        ("Código", "INTEGER PRIMARY KEY"), ("Fechadealta", "DATETIME"), ("Fechadeúltimarevisión", "DATETIME"),
+        ("Fechaúltimavisita", "DATETIME"), ("Fechaprimeravisita", "DATETIME"), ("Fechapróximacita", "DATETIME"),
+        ("Tienepróximacita", "TEXT"), ("Fechadeuda", "DATETIME"), ("Númerodecitas", "TEXT"), ("Impuntual", "TEXT"),
+    ],
+    "citas": [
+        ("Fecha", "DATETIME"), ("Hora", "TEXT"), ("Paciente", "TEXT"), ("Teléfono", "TEXT"),
+        ("Especialista", "TEXT"), ("Servicios", "TEXT"), ("Aseguradora", "TEXT"), ("Precio", "REAL"),
+        ("Origendelacita", "TEXT"), ("Estado", "TEXT"), ("Comentarios", "TEXT"), ("Creacióndelacita", "TEXT"),
+    ],
+    # NumDoctor is kept as text, the way the daily checks compare it
+    "tratamientos": [
+        ("CódigoPaciente", "INTEGER"), ("Fecharealizado", "DATETIME"), ("Tratamiento", "TEXT"),
+        ("Descripción", "TEXT"), ("Especialidad", "TEXT"), ("Diente", "TEXT"), ("Doctor", "TEXT"),
+        ("NumDoctor", "TEXT"), ("Coste", "REAL"), ("Precio", "REAL"),
+    ],
+    "cobros": [
+        ("Código", "INTEGER"), ("Saldo", "REAL"), ("SaldoaFecha", "DATETIME"), ("Fechadecobro", "DATETIME"),
+        ("Importecobrado", "REAL"), ("Importerealizado", "REAL"), ("FechafacturadoPacientes", "DATETIME"),
+        ("ImportefacturadoPacientes", "REAL"), ("Importefacturado1T", "REAL"), ("Importefacturado2T", "REAL"),
+        ("Importefacturado3T", "REAL"), ("Importefacturado4T", "REAL"), ("Númerodefactura", "TEXT"),
+        ("Importefinanciado", "REAL"), ("Importedeuda", "REAL"),
+    ],
+    "comisiones": [
+        ("Fecha", "DATETIME"), ("Código", "INTEGER PRIMARY KEY"), ("Paciente", "TEXT"), ("Tratamiento", "TEXT"),
+        ("Diente", "TEXT"), ("Descripción", "TEXT"), ("Realizado", "REAL"), ("Cobrado", "REAL"),
+        ("Seguro", "REAL"), ("Costelab", "REAL"), ("Costefinan", "REAL"), ("Comisión", "REAL"), ("Com", "TEXT"),
+    ],
+}
+
+
+def create_table_sql(table_name: str) -> str:
+    """
+    Returns the CREATE TABLE statement the loaders would build for a table.
+    """
+    column_defs = [f'"{name}" {sql_type}' for name, sql_type in TABLE_COLUMNS[table_name]]
+    if table_name == "cobros":
+        column_defs.insert(0, '"id" INTEGER PRIMARY KEY AUTOINCREMENT')
+    if table_name == "citas":
+        column_defs.append('PRIMARY KEY ("Fecha", "Hora", "Paciente")')
+    return f'CREATE TABLE IF NOT EXISTS {table_name} ({", ".join(column_defs)})'
+
+
+def _iso(day: date) -> str:
+    return datetime.combine(day, datetime.min.time()).isoformat()
+
+
+def _misspell(rng: random.Random, name: str) -> str:
+    position = rng.randrange(len(name))
+    return name[:position] + name[position + 1:]
+
+
+def _new_patient(rng: random.Random, code: int, day: date) -> dict:
+    first_name, surname1, surname2 = rng.choice(FIRST_NAMES), rng.choice(SURNAMES), rng.choice(SURNAMES)
+    birth = day - timedelta(days=rng.randint(18 * 365, 85 * 365))
+    age = (day - birth).days // 365
+    number = rng.randint(10_000_000, 99_999_999)
+    mobile = f"6{rng.randint(10_000_000, 99_999_999)}"
+    return {
+        "code": code,
+        "name": f"{first_name} {surname1} {surname2}",
+        "phone": f"+34 {mobile[:3]} {mobile[3:6]} {mobile[6:]}",
+        "registered": day,
+        "visits": 0,
+        "last_visit": None,
+        "row": (
+            code, first_name.upper(), surname1.upper(), surname2.upper(), f"{number}{DNI_LETTERS[number % 23]}",
+            rng.choice("MH"), str(age), str(age), _iso(birth), None, None, None, None,
+            f"46{rng.randint(0, 999):03d}", "VALENCIA", "VALENCIA", None, mobile, None, None, None, None,
+            rng.choice(REFERRALS), None,
+        ),
+    }
+
+
+def _generate_clinic(rng: random.Random, clinic: int, start: date, end: date, codes: itertools.count):
+    """
+    Simulates one clinic day by day.
+
+    :return: An iterator of (table name, rows, file name) batches, one per table and
+             calendar year for the daily tables, then the patient tables and commissions.
+    """
+    aesthetic_ids = sorted({c["id"] for c in doctors_commissions if c["treatment_type"] == "aesthetic_medicine"})
+    dentist_ids = sorted(set(doctors) - set(aesthetic_ids))
+    clinic_doctors = rng.sample(dentist_ids, DENTISTS_PER_CLINIC) + rng.sample(aesthetic_ids, 1)
+    commission_rates = {c["id"]: c["commission"] for c in doctors_commissions if c["commission_type"] == "regular"}
+
+    patients = []
+    commissions = {}
+    batch = {"citas": [], "tratamientos": [], "cobros": []}
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            appointments = rng.randint(APPOINTMENTS_PER_DAY - 6, APPOINTMENTS_PER_DAY + 6)
+            new_patients = rng.randint(0, 2 * NEW_PATIENTS_PER_DAY)
+            for slot in range(appointments):
+                first_visit = slot < new_patients or not patients
+                if first_visit:
+                    patient = _new_patient(rng, next(codes), day)
+                    patients.append(patient)
+                else:
+                    patient = rng.choice(patients)
+                doctor_id = rng.choice(clinic_doctors)
+                aesthetic = doctor_id in aesthetic_ids
+                state = rng.choices(APPOINTMENT_STATES, APPOINTMENT_STATE_WEIGHTS)[0]
+                patient_name = patient["name"]
+                if rng.random() < MISSPELT_NAME_RATE:
+                    patient_name = _misspell(rng, patient_name)
+
+                booked = day - timedelta(days=rng.randint(0, 45))
+                batch["citas"].append((
+                    _iso(day), f"{9 + slot * 11 // appointments:02d}:{rng.choice(('00', '30'))}", patient_name,
+                    patient["phone"], doctors[doctor_id],
+                    ("Primera visita Estética" if aesthetic else "Primera visita Odontología") if first_visit
+                    else "Tratamiento", "Sin aseguradora", None, rng.choice(("Agenda", "Doctoralia")), state,
+                    None, booked.strftime("%d/%m/%Y"),
+                ))
+
+                if state != "Visita realizada" or rng.random() < MISSING_TREATMENT_RATE:
+                    continue
+                patient["visits"] += 1
+                patient["last_visit"] = day
+
+                for _ in range(1 if first_visit else rng.choice((1, 1, 1, 2))):
+                    if aesthetic:
+                        specialty = "ESTETICA"
+                    elif first_visit:
+                        specialty = "ODONTOLOGIA"
+                    else:
+                        specialty = rng.choices(list(DENTAL_SPECIALTY_WEIGHTS), list(DENTAL_SPECIALTY_WEIGHTS.values()))[0]
+                    treatment, description, price, lab_share = rng.choice(TREATMENTS[specialty])
+                    if first_visit:
+                        treatment, description, price, lab_share = "PV", f"PRIMERA VISITA {specialty}", 0, 0
+                    lab_cost = round(price * lab_share, 2)
+                    tooth = str(rng.randint(11, 48)) if specialty != "ESTETICA" else "0"
+                    treated_by = doctor_id if rng.random() >= WRONG_DOCTOR_RATE else rng.choice(clinic_doctors)
+                    batch["tratamientos"].append((
+                        patient["code"], _iso(day), treatment, description, specialty, tooth,
+                        doctors[treated_by].split()[0].upper(), treated_by, lab_cost, float(price),
+                    ))
+
+                    paid = 0.0
+                    if price and rng.random() < PAID_RATE:
+                        paid = float(price)
+                        paid_on = min(day + timedelta(days=rng.randint(0, 20)), end)
+                        batch["cobros"].append((
+                            patient["code"], 0.0, None, _iso(paid_on), paid, float(price), None, 0.0,
+                            None, None, None, None, None, 0.0, None,
+                        ))
+                    # The commissions export keeps one row per patient, the latest one wins
+                    commissions[patient["code"]] = (
+                        _iso(day), patient["code"], patient_name.upper(), treatment, tooth, description,
+                        float(price), paid, 0.0, lab_cost, 0.0, float(commission_rates.get(treated_by, 0)), None,
+                    )
+
+        next_day = day + timedelta(days=1)
+        if next_day.year != day.year or next_day > end:
+            for table_name, rows in batch.items():
+                yield table_name, rows, f"synthetic-clinic{clinic + 1}-{day.year}"
+            batch = {"citas": [], "tratamientos": [], "cobros": []}
+        day = next_day
+
+    file_name = f"synthetic-clinic{clinic + 1}"
+    yield "datos_personales", [p["row"] for p in patients], file_name
+    yield "fechas_pacientes", [
+        (p["code"], _iso(p["registered"]), None, _iso(p["last_visit"]) if p["last_visit"] else None,
+         _iso(p["registered"]), None, None, None, str(p["visits"]), None)
+        for p in patients
+    ], file_name
+    yield "comisiones", list(commissions.values()), file_name
+
+
+def _remove_database_files(db_path: str):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+
+def generate_database(db_path: str = database.DB_PATH, clinics: int = 1, years: int = 1, seed: int = 0,
+                      end: date | None = None, parquet_dir: str = columnar.PARQUET_DIR) -> dict[str, int]:
+    """
+    Replaces a database with synthetic data for a number of clinics and years.
+
+    The data is built in a new file next to the database, which then replaces it,
+    and the Parquet mirrors are rewritten afterwards.
+
+    :param db_path: The database file to replace.
+    :param clinics: How many clinics to simulate. Each has its own patients and doctors.
+    :param years: How many years of history to generate, ending the day before `end`.
+    :param seed: The random seed.
+    :param end: The day after the last generated day; defaults to today.
+    :param parquet_dir: The directory holding the Parquet datasets.
+    :return: A dictionary mapping each table to the number of rows it holds.
+    """
+    end = (end or date.today()) - timedelta(days=1)
+    start = end - timedelta(days=365 * years) + timedelta(days=1)
+    build_path = f"{db_path}.synthetic"
+    _remove_database_files(build_path)
+
+    rng = random.Random(seed)
+    codes = itertools.count(1)
+    for clinic in range(clinics):
+        for table_name, rows, file_name in _generate_clinic(rng, clinic, start, end, codes):
+            parsed = database_utils.ParsedFile(
+                table_name, file_name, create_table_sql(table_name),
+                'INSERT' if table_name == 'cobros' else 'INSERT OR REPLACE',
+                [name for name, _ in TABLE_COLUMNS[table_name]], rows)
+            database_utils.write_parsed(parsed, build_path)
+    for table_name in patient_search.INDEXED_TABLES:
+        patient_search.index_table(build_path, table_name)
+
+    # Rows that share a key with a later one were replaced, as with real exports
+    with database.get_pool(build_path).reader() as conn:
+        counts = {table_name: conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+                  for table_name in TABLE_COLUMNS}
+
+    # Close every connection before swapping the file, so no stale WAL is replayed into it
+    database.close_pools()
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _remove_database_files(db_path)
+    os.replace(build_path, db_path)
+    print(f"Generated {clinics} clinic(s) x {years} year(s) of data from {start} to {end} in '{db_path}'.")
+
+    for table_name in counts:
+        if table_name in columnar.MIRRORED_TABLES:
+            try:
+                columnar.export_table(db_path, table_name, parquet_dir)
+            except Exception as e:
+                print(f"Could not mirror table '{table_name}' to Parquet: {e}")
+    database.close_pools()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clinics", type=int, default=1, help="number of clinics (1 to 10)")
+    parser.add_argument("--years", type=int, default=1, help="years of history (1 to 10)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--db", default=database.DB_PATH, help="database file to replace")
+    args = parser.parse_args()
+
+    print(json.dumps(generate_database(args.db, args.clinics, args.years, args.seed), indent=2))
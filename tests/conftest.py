@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A fresh database file, whose pools and snapshots are closed after the test."""
+    yield str(tmp_path / "data.db")
+    database.close_pools()
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def drive(tmp_path, monkeypatch):
+    """
+    A fake Google Drive with a 'cobros' folder holding the two example Cobros exports,
+    used by the loaders in place of the real one. The test runs in tmp_path, so the
+    blob cache, sync state and output/data.db land there.
+    """
+    import config
+    import fake_drive
+    import gdrive
+
+    service = fake_drive.FakeDriveService(str(tmp_path / "drive"))
+    for name in ("Cobros-01.01.2020-31.01.2025.xls", "Cobros-Todo2026.xls"):
+        with open(os.path.join(REPO_DIR, "examples", name), "rb") as f:
+            service.add_file("cobros", name, f.read())
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(gdrive, "_service", service)
+    monkeypatch.setattr(config, "DRIVE_SOURCES",
+                        {"cobros": "https://drive.google.com/drive/folders/cobros"}, raising=False)
+    yield service
+    database.close_pools()
@@ -0,0 +1,91 @@
+import database
+import database_utils
+import maintenance
+from change_log import changes_since, first_sequence, last_sequence, prune
+
+CITAS_SQL = ('CREATE TABLE IF NOT EXISTS citas ("Fecha" DATETIME, "Hora" TEXT, "Paciente" TEXT, "Estado" TEXT, '
+             'PRIMARY KEY ("Fecha", "Hora", "Paciente"))')
+CITAS_COLUMNS = ["Fecha", "Hora", "Paciente", "Estado"]
+
+
+def write_citas(db_path, *rows):
+    parsed = database_utils.ParsedFile("citas", "citas.xlsx", CITAS_SQL, "INSERT OR REPLACE",
+                                       list(CITAS_COLUMNS), list(rows))
+    database_utils.write_parsed(parsed, db_path)
+
+
+def test_citas_rows_differing_only_in_their_key_are_both_kept(db_path):
+    write_citas(db_path, ("2025-02-05T00:00:00", "10:00", "André Xhaka", "Confirmada"))
+    write_citas(db_path, ("2025-02-19T00:00:00", "10:00", "Georgia Radici", "Confirmada"))
+
+    with database.get_pool(db_path).reader() as conn:
+        patients = [row[0] for row in conn.execute("SELECT Paciente FROM citas ORDER BY Fecha")]
+        changes = changes_since(conn, 0, "citas")
+    assert patients == ["André Xhaka", "Georgia Radici"]
+    assert [(change["key"], change["operation"]) for change in changes] == [
+        ('["2025-02-05T00:00:00","10:00","André Xhaka"]', "insert"),
+        ('["2025-02-19T00:00:00","10:00","Georgia Radici"]', "insert"),
+    ]
+
+
+def test_edited_citas_row_is_logged_as_an_update_of_its_key(db_path):
+    write_citas(db_path, ("2025-02-05T00:00:00", "10:00", "André Xhaka", "Confirmada"))
+    write_citas(db_path, ("2025-02-05T00:00:00", "10:00", "André Xhaka", "Anulada"))
+    write_citas(db_path, ("2025-02-05T00:00:00", "10:00", "André Xhaka", "Anulada"))
+
+    with database.get_pool(db_path).reader() as conn:
+        states = [row[0] for row in conn.execute("SELECT Estado FROM citas")]
+        changes = changes_since(conn, 0, "citas")
+    assert states == ["Anulada"]
+    assert [change["operation"] for change in changes] == ["insert", "update"]
+    assert changes[1]["key"] == '["2025-02-05T00:00:00","10:00","André Xhaka"]'
+
+
+def age_changes(db_path, days):
+    with database.get_pool(db_path).writer() as conn:
+        conn.execute("UPDATE _changes SET changed_at = datetime(changed_at, ?)", (f"-{days} days",))
+
+
+def test_maintenance_prunes_changes_older_than_the_retention(db_path, monkeypatch):
+    monkeypatch.setenv("CHANGE_LOG_DAYS", "30")
+    write_citas(db_path, ("2025-02-05T00:00:00", "10:00", "André Xhaka", "Confirmada"))
+    age_changes(db_path, 31)
+    write_citas(db_path, ("2025-02-19T00:00:00", "10:00", "Georgia Radici", "Confirmada"))
+
+    assert maintenance.run_maintenance(db_path)["pruned_changes"] == 1
+
+    with database.get_pool(db_path).reader() as conn:
+        assert [change["seq"] for change in changes_since(conn, 1)] == [2]
+        assert (first_sequence(conn), last_sequence(conn)) == (1, 2)
+
+
+def test_sequence_numbers_go_on_after_the_whole_log_is_pruned(db_path):
+    write_citas(db_path, ("2025-02-05T00:00:00", "10:00", "André Xhaka", "Confirmada"))
+    age_changes(db_path, 1)
+    with database.get_pool(db_path).writer() as conn:
+        assert prune(conn, keep_days=0) == 1
+        assert (first_sequence(conn), last_sequence(conn)) == (1, 1)
+
+    write_citas(db_path, ("2025-02-19T00:00:00", "10:00", "Georgia Radici", "Confirmada"))
+
+    with database.get_pool(db_path).reader() as conn:
+        assert [change["seq"] for change in changes_since(conn, 1)] == [2]
+        assert first_sequence(conn) == 1
+
+
+def test_changes_endpoint_asks_for_a_resync_past_the_pruned_changes(db_path, monkeypatch):
+    import main
+
+    monkeypatch.setattr(database, "DB_PATH", db_path)
+    write_citas(db_path, ("2025-02-05T00:00:00", "10:00", "André Xhaka", "Confirmada"))
+    write_citas(db_path, ("2025-02-19T00:00:00", "10:00", "Georgia Radici", "Confirmada"))
+    with database.get_pool(db_path).writer() as conn:
+        conn.execute("UPDATE _changes SET changed_at = datetime(changed_at, '-2 days') WHERE seq = 1")
+        prune(conn, keep_days=1)
+    database.refresh_snapshot(db_path, force=True)
+
+    stale = main.get_changes(since=0)
+    current = main.get_changes(since=1)
+
+    assert (stale["resync"], stale["data"], stale["last_seq"]) == (True, [], 2)
+    assert (current["resync"], [change["seq"] for change in current["data"]]) == (False, [2])
@@ -0,0 +1,102 @@
+from datetime import date
+
+import database
+import database_utils
+import date_keys
+import partitions
+import queries
+from change_log import changes_since
+
+PATIENTS_SQL = ('CREATE TABLE IF NOT EXISTS fechas_pacientes ("Código" INTEGER PRIMARY KEY, '
+                '"Fechadealta" DATETIME, "Númerodecitas" TEXT, "Fechaúltimavisita" DATETIME)')
+PATIENTS_COLUMNS = ["Código", "Fechadealta", "Númerodecitas", "Fechaúltimavisita"]
+
+OLD_PATIENT = (7, "2023-05-10T00:00:00", "42", "2026-03-20T00:00:00")
+UPDATED_PATIENT = (7, "2023-05-10T00:00:00", "43", "2026-09-01T00:00:00")
+NEW_PATIENT = (8, f"{partitions.first_open_year()}-02-01T00:00:00", "1", None)
+
+
+def parsed_patients(*rows):
+    return database_utils.ParsedFile("fechas_pacientes", "pacientes.xls", PATIENTS_SQL, "INSERT OR REPLACE",
+                                     list(PATIENTS_COLUMNS), list(rows))
+
+
+def stored_patients(db_path):
+    with database.get_pool(db_path).reader() as conn:
+        rows = conn.execute('SELECT "Código", "Númerodecitas", "Fechaúltimavisita" FROM fechas_pacientes '
+                            'ORDER BY "Código"').fetchall()
+        frozen = conn.execute('SELECT "Código" FROM "fechas_pacientes__2023"').fetchall()
+        current = conn.execute('SELECT "Código" FROM "fechas_pacientes__current"').fetchall()
+    return rows, frozen, current
+
+
+def partitioned_patients(db_path):
+    database_utils.write_parsed(parsed_patients(OLD_PATIENT, NEW_PATIENT), db_path)
+    assert partitions.partition_table(db_path, "fechas_pacientes")
+    with database.get_pool(db_path).reader() as conn:
+        return conn.execute("SELECT MAX(seq) FROM _changes").fetchone()[0]
+
+
+def test_update_of_a_patient_in_a_closed_year_replaces_the_frozen_row(db_path):
+    seq = partitioned_patients(db_path)
+
+    database_utils.write_parsed(parsed_patients(UPDATED_PATIENT, NEW_PATIENT), db_path)
+
+    rows, frozen, current = stored_patients(db_path)
+    assert rows == [(7, "43", "2026-09-01T00:00:00"), (8, "1", None)]
+    assert frozen == [(7,)]
+    assert current == [(8,)]
+    with database.get_pool(db_path).reader() as conn:
+        changes = changes_since(conn, seq, "fechas_pacientes")
+    assert [(change["key"], change["operation"]) for change in changes] == [("7", "update")]
+
+
+def test_full_reload_updates_a_patient_in_a_closed_year(db_path):
+    seq = partitioned_patients(db_path)
+
+    staging = "fechas_pacientes" + database_utils.STAGING_SUFFIX
+    database_utils.write_parsed(parsed_patients(UPDATED_PATIENT, NEW_PATIENT), db_path, staging)
+    database_utils.swap_staging_table(db_path, "fechas_pacientes")
+
+    rows, frozen, current = stored_patients(db_path)
+    assert rows == [(7, "43", "2026-09-01T00:00:00"), (8, "1", None)]
+    assert frozen == [(7,)]
+    assert current == [(8,)]
+    with database.get_pool(db_path).reader() as conn:
+        changes = changes_since(conn, seq, "fechas_pacientes")
+    assert [(change["key"], change["operation"]) for change in changes] == [("7", "update")]
+
+
+def test_unchanged_rows_of_a_closed_year_are_not_rewritten(db_path):
+    seq = partitioned_patients(db_path)
+
+    database_utils.write_parsed(parsed_patients(OLD_PATIENT, NEW_PATIENT), db_path)
+
+    rows, frozen, current = stored_patients(db_path)
+    assert rows == [(7, "42", "2026-03-20T00:00:00"), (8, "1", None)]
+    assert frozen == [(7,)]
+    with database.get_pool(db_path).reader() as conn:
+        assert changes_since(conn, seq, "fechas_pacientes") == []
+
+
+def test_declared_statement_reads_only_the_partitions_the_range_overlaps(db_path):
+    partitioned_patients(db_path)
+    bounds = date_keys.range_bounds(date(2023, 1, 1), date(2023, 12, 31))
+
+    with database.get_pool(db_path).reader() as conn:
+        sql = queries.resolve_sql(conn, "new_patients", bounds)
+        count = queries.fetch_all(conn, "new_patients", bounds)
+
+    assert '"fechas_pacientes__2023"' in sql and "__current" not in sql
+    assert count == [(1,)]
+
+
+def test_undeclared_statement_reads_the_whole_view(db_path):
+    partitioned_patients(db_path)
+    name = queries.register("test_patients_in_2023",
+                            'SELECT COUNT(*) FROM fechas_pacientes WHERE "Fechadealta__ts" BETWEEN ? AND ?')
+    bounds = date_keys.range_bounds(date(2023, 1, 1), date(2023, 12, 31))
+
+    with database.get_pool(db_path).reader() as conn:
+        assert queries.resolve_sql(conn, name, bounds) == queries.get_sql(name)
+        assert queries.fetch_all(conn, name, bounds) == [(1,)]
@@ -0,0 +1,88 @@
+import database
+import database_utils
+import patient_search
+from patient_search import match_expression
+
+PATIENTS_SQL = ('CREATE TABLE IF NOT EXISTS datos_personales ("Código" INTEGER PRIMARY KEY, "Nombre" TEXT, '
+                '"Apellido1" TEXT, "Apellido2" TEXT, "Dni" TEXT, "Teléfono" TEXT, "Móvil" TEXT)')
+PATIENTS_COLUMNS = ["Código", "Nombre", "Apellido1", "Apellido2", "Dni", "Teléfono", "Móvil"]
+CITAS_SQL = ('CREATE TABLE IF NOT EXISTS citas ("Fecha" DATETIME, "Hora" TEXT, "Paciente" TEXT, "Teléfono" TEXT, '
+             'PRIMARY KEY ("Fecha", "Hora", "Paciente"))')
+CITAS_COLUMNS = ["Fecha", "Hora", "Paciente", "Teléfono"]
+
+
+def load(db_path, patients=(), citas=()):
+    for table_name, sql, columns, rows in (("datos_personales", PATIENTS_SQL, PATIENTS_COLUMNS, patients),
+                                           ("citas", CITAS_SQL, CITAS_COLUMNS, citas)):
+        if rows:
+            parsed = database_utils.ParsedFile(table_name, f"{table_name}.xls", sql, "INSERT OR REPLACE",
+                                               list(columns), list(rows))
+            database_utils.write_parsed(parsed, db_path)
+        else:
+            with database.get_pool(db_path).writer() as conn:
+                conn.execute(sql)
+        patient_search.index_table(db_path, table_name)
+
+
+def search(db_path, text, limit=20):
+    with database.get_pool(db_path).reader() as conn:
+        return patient_search.search(conn, text, limit)
+
+
+def test_every_word_is_a_quoted_prefix():
+    assert match_expression("garcía jos") == '"garcía"* "jos"*'
+    assert match_expression("+34 626-286 (42)") == '"3462628642"*'
+
+
+def test_quotes_and_operators_are_searched_as_words():
+    assert match_expression('"garcia" OR jos* NEAR(x') == '"garcia"* "OR"* "jos"* "NEAR"* "x"*'
+    assert match_expression('"* - ()') is None
+
+
+def test_quotes_and_operators_do_not_break_the_query(db_path):
+    load(db_path, patients=[(12, "José", "García", "Pérez", "12345678Z", "+34 626 286 423", None)])
+
+    assert [result["code"] for result in search(db_path, 'garcia" jos*')] == [12]
+    # An operator is one more word every match must have
+    assert search(db_path, "garcia OR pérez") == []
+    assert search(db_path, "NOT") == []
+    assert search(db_path, '"*') == []
+
+
+def test_appointment_hit_takes_the_code_of_the_patient_of_the_same_name(db_path):
+    load(db_path,
+         patients=[(12, "José", "García", None, "12345678Z", None, None)],
+         citas=[("2025-02-05T00:00:00", "10:00", "José  GARCÍA", "611 222 333")])
+
+    # Only the appointment has the phone, so the code comes from the lookup by name
+    results = search(db_path, "611222")
+
+    assert [(result["name"], result["code"], result["source"], result["phones"]) for result in results] == [
+        ("José  GARCÍA", 12, "citas", ["611222333"])]
+
+
+def test_entries_of_one_patient_are_merged(db_path):
+    load(db_path,
+         patients=[(12, "José", "García", None, "12345678Z", "+34 626 286 423", None),
+                   (13, "Josefa", "Martín", None, None, "699 000 111", None)],
+         citas=[("2025-02-05T00:00:00", "10:00", "José García", "611 222 333"),
+                ("2025-02-06T00:00:00", "10:00", "José García", "626286423")])
+
+    results = search(db_path, "jos")
+
+    assert sorted(result["code"] for result in results) == [12, 13]
+    jose = next(result for result in results if result["code"] == 12)
+    assert jose["dni"] == "12345678Z"
+    # The local number of the appointment is the end of the full number already known
+    assert sorted(jose["phones"]) == ["34626286423", "611222333"]
+
+
+def test_limit_counts_patients_not_entries(db_path):
+    load(db_path,
+         patients=[(code, "Ana", f"Apellido{code}", None, None, None, None) for code in range(1, 6)],
+         citas=[("2025-02-05T00:00:00", f"1{code}:00", f"Ana Apellido{code}", None) for code in range(1, 6)])
+
+    results = search(db_path, "ana", limit=3)
+
+    assert len(results) == 3
+    assert len({result["code"] for result in results}) == 3
@@ -0,0 +1,52 @@
+import contextvars
+import threading
+import time
+
+import pytest
+
+import profiler
+
+
+def _spin_in_request(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def _spin_elsewhere(stop):
+    while not stop.is_set():
+        pass
+
+
+def _sampled(sampler, function):
+    return any(name == function for _, _, name in sampler._total)
+
+
+def test_samples_only_the_profiled_threads():
+    stop = threading.Event()
+    other = threading.Thread(target=_spin_elsewhere, args=(stop,), daemon=True)
+    other.start()
+    try:
+        with profiler.SamplingProfiler() as sampler:
+            # A worker running part of the request, like a threadpool or async_db worker
+            context = contextvars.copy_context()
+            worker = threading.Thread(target=context.run,
+                                      args=(profiler.followed(_spin_in_request), 0.2))
+            worker.start()
+            worker.join()
+    finally:
+        stop.set()
+        other.join()
+
+    assert _sampled(sampler, "_spin_in_request")
+    assert not _sampled(sampler, "_spin_elsewhere")
+
+
+def test_one_profile_at_a_time():
+    with profiler.SamplingProfiler():
+        with pytest.raises(profiler.ProfilerBusy):
+            with profiler.SamplingProfiler():
+                pass
+    with profiler.SamplingProfiler() as sampler:
+        _spin_in_request(0.05)
+    assert _sampled(sampler, "_spin_in_request")
@@ -0,0 +1,95 @@
+import os
+import threading
+
+import blob_cache
+import database
+import database_utils
+import gdrive
+import main
+
+
+def reload_cobros(db_path):
+    return main._process_drive_source("cobros", "cobros", db_path, database_utils.parse_html)
+
+
+def count_cobros(db_path):
+    with database.get_pool(db_path).reader() as conn:
+        return conn.execute("SELECT COUNT(*) FROM cobros").fetchone()[0]
+
+
+def test_full_reload_keeps_the_table_when_a_download_fails(db_path, drive, monkeypatch):
+    assert reload_cobros(db_path)["success"]
+    loaded = count_cobros(db_path)
+
+    download = gdrive.get_file_as_stream
+    monkeypatch.setattr(gdrive, "get_file_as_stream", lambda service, file: (
+        None if file["name"] == "Cobros-Todo2026.xls" else download(service, file)))
+    result = reload_cobros(db_path)
+
+    assert not result["success"]
+    assert "Cobros-Todo2026.xls" in result["message"]
+    assert count_cobros(db_path) == loaded
+
+
+def test_full_reload_skips_files_of_unsupported_types(db_path, drive):
+    drive.add_file("cobros", "notes.txt", b"not an export")
+
+    result = reload_cobros(db_path)
+
+    assert result["success"]
+    assert result["processed_count"] == 2
+
+
+def test_failed_listing_is_a_failure_and_keeps_the_sync_token(drive, monkeypatch):
+    page = drive.page
+
+    def fail_after_first_page(items, key, page_size, page_token):
+        if key == "files" and page_token is not None:
+            raise OSError("connection reset")
+        return page(items, key, page_size, page_token)
+
+    drive.max_page_size = 1
+    monkeypatch.setattr(drive, "page", fail_after_first_page)
+    result = main.reload_all()
+
+    assert [source["success"] for source in result["results"]] == [False]
+    assert gdrive.load_sync_token() is None
+
+
+def test_full_reload_forgets_cached_files_removed_from_the_folder(db_path, drive):
+    with open(drive.path_of("cobros/Cobros-Todo2026.xls"), "rb") as f:
+        drive.add_file("cobros", "Cobros-Todo2026 (copia).xls", f.read())
+    assert reload_cobros(db_path)["success"]
+    manifest = blob_cache.load_manifest()
+    removed_blob = blob_cache.blob_path(manifest["cobros/Cobros-01.01.2020-31.01.2025.xls"]["sha256"])
+    shared_blob = blob_cache.blob_path(manifest["cobros/Cobros-Todo2026.xls"]["sha256"])
+
+    drive.remove_file("cobros", "Cobros-01.01.2020-31.01.2025.xls")
+    drive.remove_file("cobros", "Cobros-Todo2026 (copia).xls")
+    assert reload_cobros(db_path)["success"]
+
+    assert list(blob_cache.load_manifest()) == ["cobros/Cobros-Todo2026.xls"]
+    assert not os.path.exists(removed_blob)
+    assert os.path.exists(shared_blob)
+
+
+def test_per_source_reload_finishes_its_load_inside_the_load_lock(drive, monkeypatch):
+    held = []
+
+    def try_lock():
+        acquired = main._load_lock.acquire(blocking=False)
+        if acquired:
+            main._load_lock.release()
+        held.append(not acquired)
+
+    def finish_load(db_name):
+        # Another thread, e.g. a /reload_all, must not get in before the maintenance and snapshot refresh
+        attempt = threading.Thread(target=try_lock)
+        attempt.start()
+        attempt.join()
+        return None
+
+    monkeypatch.setattr(main, "_finish_load", finish_load)
+    main.reload_cobros()
+
+    assert held == [True]
@@ -0,0 +1,42 @@
+import sqlite3
+
+import pytest
+
+import database
+
+
+def snapshot_of_table(db_path):
+    with database.get_pool(db_path).writer() as conn:
+        conn.execute("CREATE TABLE citas (Paciente TEXT)")
+        conn.execute("INSERT INTO citas VALUES ('Georgia Radici')")
+        database.bump_data_version(conn, "citas")
+    return database.get_snapshot(db_path)
+
+
+def test_reader_of_a_snapshot_retired_after_lookup_reads_its_successor(db_path, monkeypatch):
+    retired = snapshot_of_table(db_path)
+    database.refresh_snapshot(db_path, force=True)
+    lookups = iter([retired])
+    get_snapshot = database.get_snapshot
+    monkeypatch.setattr(database, "get_snapshot", lambda path=database.DB_PATH: next(lookups, None)
+                        or get_snapshot(path))
+
+    with database.snapshot_reader(db_path) as conn:
+        assert conn.execute("SELECT Paciente FROM citas").fetchall() == [("Georgia Radici",)]
+
+
+def test_retired_snapshot_opens_no_new_connections(db_path):
+    retired = snapshot_of_table(db_path)
+    database.refresh_snapshot(db_path, force=True)
+
+    assert retired.connect() is None
+    with pytest.raises(sqlite3.OperationalError):
+        with retired.reader():
+            pass
+
+
+def test_reader_keeps_a_retired_snapshot_alive(db_path):
+    snapshot_of_table(db_path)
+    with database.snapshot_reader(db_path) as conn:
+        database.refresh_snapshot(db_path, force=True)
+        assert conn.execute("SELECT COUNT(*) FROM citas").fetchone() == (1,)
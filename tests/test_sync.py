@@ -0,0 +1,72 @@
+import database
+import gdrive
+import main
+
+EDITED_FILE = "Cobros-Todo2026.xls"
+
+
+def cobros_totals():
+    with database.get_pool(database.DB_PATH).reader() as conn:
+        return conn.execute("SELECT COUNT(*), ROUND(SUM(Importecobrado), 2) FROM cobros").fetchone()
+
+
+def edit_a_cell(drive, name=EDITED_FILE):
+    """Uploads EDITED_FILE with one payment raised by 100, as `name`."""
+    with open(drive.path_of(f"cobros/{EDITED_FILE}"), "rb") as f:
+        data = f.read()
+    edited = data.replace(b"<td>350,00</td><td>350,00</td>", b"<td>450,00</td><td>450,00</td>", 1)
+    assert edited != data
+    drive.add_file("cobros", name, edited)
+
+
+def test_list_changes_reports_new_modified_and_removed_files(drive):
+    token = gdrive.get_start_page_token(drive)
+    drive.add_file("cobros", "Cobros-nuevo.xls", b"new")
+    edit_a_cell(drive)
+    drive.remove_file("cobros", "Cobros-01.01.2020-31.01.2025.xls")
+    drive.add_file("cobros", "Cobros-borrado.xls", b"short-lived")
+    drive.remove_file("cobros", "Cobros-borrado.xls")
+
+    changed, removed, next_token = gdrive.list_changes(drive, token)
+
+    assert {file["id"] for file in changed} == {f"cobros/{EDITED_FILE}", "cobros/Cobros-nuevo.xls"}
+    assert removed == {"cobros/Cobros-01.01.2020-31.01.2025.xls", "cobros/Cobros-borrado.xls"}
+    assert gdrive.list_changes(drive, next_token) == ([], set(), next_token)
+
+
+def test_sync_appends_new_files(drive):
+    assert all(result["success"] for result in main.reload_all()["results"])
+    before = cobros_totals()
+    edit_a_cell(drive, "Cobros-Todo2026 (2).xls")
+
+    result = main.sync_all()
+
+    assert [source["processed_count"] for source in result["results"]] == [1]
+    assert cobros_totals() != before
+
+
+def test_sync_reloads_a_source_with_a_modified_file(drive):
+    main.reload_all()
+    before = cobros_totals()
+    edit_a_cell(drive)
+
+    result = main.sync_all()
+
+    assert [source["processed_count"] for source in result["results"]] == [2]
+    synced = cobros_totals()
+    assert synced == (before[0], before[1] + 100)
+    main.reload_all()
+    assert cobros_totals() == synced
+
+
+def test_sync_reloads_a_source_with_a_removed_file(drive):
+    main.reload_all()
+    drive.remove_file("cobros", EDITED_FILE)
+
+    result = main.sync_all()
+
+    assert [source["success"] for source in result["results"]] == [True]
+    synced = cobros_totals()
+    main.reload_all()
+    assert cobros_totals() == synced
+    assert gdrive.list_changes(drive, gdrive.load_sync_token())[0] == []
@@ -0,0 +1,239 @@
+"""
+Pushes the per-table data versions to API clients when loads finish, and follows them from the dashboard.
+
+Every load bumps the version of the tables it changed (see
+database.bump_data_version). Clients that cache results per table used to find
+out about new data by polling, or by recomputing everything. Instead, the API
+publishes the versions to a VersionFeed once a reload or sync has finished and
+the new snapshot is in place, and clients listen in one of two ways:
+
+- GET /data_versions/stream is a Server-Sent Events stream. It sends the
+  current versions on connect, then one 'versions' event after every load that
+  changed a table, and a comment line every KEEPALIVE_SECONDS so proxies keep
+  the connection open.
+- GET /data_versions?since=<seq> is a long poll for clients that cannot read
+  event streams. It answers as soon as the feed moves past `since`, or with the
+  unchanged state once the timeout runs out.
+
+Each event carries a sequence number, the version of every table and the tables
+that changed since the previous event, e.g.
+
+    {"seq": 3, "versions": {"cobros": 12, "citas": 7}, "changed": {"cobros": 12}}
+
+The feed only keeps the latest state. A client that reconnects gets the full
+versions again and compares them with the ones it has, so it never misses a
+change. Versions are kept per API process; run the API with a single worker, or
+subscribe to each of them.
+
+Subscriber is the client side, used by clinic_dashboard.py: a daemon thread that
+follows the stream, reconnects when the API restarts, and reports no versions
+while it is disconnected so the caller can fall back to reading them itself.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+import urllib.request
+from typing import AsyncIterator, Iterator
+
+STREAM_PATH = "/data_versions/stream"
+
+KEEPALIVE_SECONDS = 15
+
+# Longest wait a long-poll request may ask for
+MAX_POLL_SECONDS = 60
+
+RECONNECT_SECONDS = 5
+
+
+class VersionFeed:
+    """
+    The latest data versions of one database, and the requests waiting for them to change.
+
+    publish() may be called from any thread; the waiters are woken on their own event loops.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._versions: dict[str, int] = {}
+        self._changed: dict[str, int] = {}
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def state(self) -> dict:
+        """
+        Returns the current sequence number, the version of every table and the tables changed last.
+        """
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> dict:
+        return {"seq": self._seq, "versions": dict(self._versions), "changed": dict(self._changed)}
+
+    def publish(self, versions: dict[str, int]) -> dict[str, int]:
+        """
+        Records the versions read after a load, and wakes the waiting requests if any table changed.
+
+        :param versions: The version of every table, from database.get_data_versions.
+        :return: The tables whose version changed, with their new versions.
+        """
+        with self._lock:
+            changed = {table: version for table, version in versions.items()
+                       if self._versions.get(table) != version}
+            if not changed:
+                return {}
+            self._seq += 1
+            self._versions = dict(versions)
+            self._changed = changed
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                # The waiter's event loop has been closed
+                pass
+        return changed
+
+    async def wait(self, since: int, timeout: float) -> dict | None:
+        """
+        Waits until the feed moves past a sequence number.
+
+        :param since: The last sequence number the caller has seen.
+        :param timeout: The longest time to wait, in seconds.
+        :return: The new state, or None if nothing changed within the timeout.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._seq > since:
+                return self._state()
+            waiter = loop.create_future()
+            self._waiters.append((loop, waiter))
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._lock:
+                if (loop, waiter) in self._waiters:
+                    self._waiters.remove((loop, waiter))
+        return self.state()
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+_feed = VersionFeed()
+
+
+def get_feed() -> VersionFeed:
+    """
+    Returns the feed the API publishes to.
+    """
+    return _feed
+
+
+def format_event(state: dict) -> str:
+    """
+    Formats a feed state as a Server-Sent Events 'versions' event.
+    """
+    return f"id: {state['seq']}\nevent: versions\ndata: {json.dumps(state)}\n\n"
+
+
+async def stream_events(feed: VersionFeed) -> AsyncIterator[str]:
+    """
+    Yields the current versions, then every change, as Server-Sent Events, until the client disconnects.
+    """
+    state = feed.state()
+    yield format_event(state)
+    seq = state["seq"]
+    while True:
+        state = await feed.wait(seq, KEEPALIVE_SECONDS)
+        if state is None:
+            yield ": keep-alive\n\n"
+            continue
+        yield format_event(state)
+        seq = state["seq"]
+
+
+def read_events(lines: Iterator[bytes]) -> Iterator[dict]:
+    """
+    Parses the 'versions' events out of a Server-Sent Events stream.
+
+    :param lines: The raw lines of the stream, e.g. an HTTP response.
+    :return: An iterator over the decoded event data.
+    """
+    event, data = "message", []
+    for raw in lines:
+        line = raw.decode("utf-8").rstrip("\r\n")
+        if not line:
+            if event == "versions" and data:
+                yield json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith(":"):
+            continue
+        else:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data.append(value)
+
+
+class Subscriber:
+    """
+    Follows a /data_versions/stream in a background thread and keeps the latest versions.
+    """
+
+    def __init__(self, url: str):
+        """
+        :param url: The full URL of the stream, e.g. 'http://localhost:8000/data_versions/stream'.
+        """
+        self.url = url
+        self._lock = threading.Lock()
+        self._versions: dict[str, int] | None = None
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> "Subscriber":
+        """
+        Starts following the stream, unless already started.
+
+        :return: The subscriber itself.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="version-feed", daemon=True)
+                self._thread.start()
+        return self
+
+    def versions(self) -> dict[str, int] | None:
+        """
+        Returns the latest version of every table.
+
+        :return: A dictionary mapping table names to versions, or None while the
+                 stream is not connected, since changes may then be missed.
+        """
+        with self._lock:
+            return None if self._versions is None else dict(self._versions)
+
+    def _run(self):
+        connected_before = False
+        while True:
+            try:
+                # Keep-alive comments arrive well within this read timeout
+                with urllib.request.urlopen(self.url, timeout=KEEPALIVE_SECONDS * 2) as response:
+                    connected_before = True
+                    for state in read_events(response):
+                        with self._lock:
+                            self._versions = state["versions"]
+            except (OSError, ValueError) as e:
+                if connected_before:
+                    print(f"Lost the data version stream at {self.url}: {e}")
+                    connected_before = False
+            with self._lock:
+                self._versions = None
+            time.sleep(RECONNECT_SECONDS)